@@ -1,14 +1,52 @@
+from typing import Optional, Tuple
 from assistant.utils import Message
-from config import WAKE_WORDS, WAKE_WAIT_DELAY
+from assistant.agent import StreamingAgent
+from assistant.playback import PlaybackHandle
+from config import WAKE_WORDS, WAKE_WAIT_DELAY, MIC_REOPEN_LEAD_MS
 from startup import (
     get_conversation_manager, get_wakeword_detector,
-    get_audio_manager, get_order_cart, get_kfc_agent
+    get_audio_manager, get_order_cart, get_kfc_agent, get_speech_pipeline, start_tts_warmup
 )
 from assistant.dg_transcription import ConversationManager
 from web_builder.builder import start_webview_server, display
 
 
 
+def respond(text: str, generation: Optional[int]=None) -> Tuple[str, bool, Optional[PlaybackHandle]]:
+    """
+    Get the agent's reply to `text`, speak it and add it to the on-screen transcript.
+
+    With a `StreamingAgent` the reply is spoken and displayed while it is still being generated.
+
+    Args:
+        text (str): The user's input text.
+        generation (Optional[int]): `AudioManager.generation` the turn started at, the reply is not spoken after a barge-in.
+
+    Returns:
+        Tuple[str, bool, Optional[PlaybackHandle]]: The reply, whether the order was confirmed and the handle of the last queued speech.
+    """
+    kfc_agent = get_kfc_agent()
+    order_cart = get_order_cart()
+    speech_pipeline = get_speech_pipeline()
+    
+    if isinstance(kfc_agent, StreamingAgent):
+        message = Message(role="assistant", content="")
+        order_cart.add_messages_to_state(message)
+        def on_text(content: str):
+            message.content = content
+            display(order_cart.get_view_data())
+        handle = speech_pipeline.speak_stream(kfc_agent.stream(text), generation, on_text)
+        return kfc_agent.response, kfc_agent.is_order_confirmed, handle
+    
+    response, order_confirmed = kfc_agent.invoke(text)
+    handle = speech_pipeline.speak(response, generation)
+    order_cart.add_messages_to_state(Message(role="assistant", content=response))
+    stream_data = order_cart.get_view_data()
+    display(stream_data)
+    return response, order_confirmed, handle
+
+
+
 ###############################################
 # Assistant thread with deep-gram voice input #
 ###############################################     
@@ -16,6 +54,7 @@ def main1():
     kfc_agent = get_kfc_agent()
     order_cart = get_order_cart()
     audio_manager = get_audio_manager()
+    start_tts_warmup()
     wake_detector = get_wakeword_detector()
     conversation_manager = ConversationManager()
     kfc_agent.update_audio_manager(audio_manager)
@@ -24,27 +63,26 @@ def main1():
     
     def open_callback():
         """Function called on open"""
-        response = audio_manager.play_initial_response()
-        audio_manager.wait_until_done()
+        kfc_agent.reset_session()
+        response, handle = audio_manager.play_initial_response()
         order_cart.add_messages_to_state(Message(role="assistant", content=response), is_started=True)
         stream_data = order_cart.get_view_data()
         display(stream_data)
+        handle.wait(remaining=MIC_REOPEN_LEAD_MS/1000)
         
         
     def data_callback(text: str) -> bool:
         """Function called when transcript is complete is order confirmed then return True to close the connection"""
+        kfc_agent.check_session_timeout()
         order_cart.add_messages_to_state(Message(role="user", content=text))
         stream_data = order_cart.get_view_data()
         display(stream_data)
         
-        response, order_confirmed = kfc_agent.invoke(text)
-        audio_manager.speak(response)
-        audio_manager.wait_until_done()
-        
-        order_cart.add_messages_to_state(Message(role="assistant", content=response))
-        stream_data = order_cart.get_view_data()
-        display(stream_data)
+        response, order_confirmed, handle = respond(text)
         
+        # The microphone resumes once this returns, so hand it back just before the reply ends
+        if handle:
+            handle.wait(remaining=MIC_REOPEN_LEAD_MS/1000)
         if order_confirmed:
             order_cart.reset_cart()
         return order_confirmed
@@ -74,6 +112,7 @@ def main2():
     kfc_agent = get_kfc_agent()
     order_cart = get_order_cart()
     audio_manager = get_audio_manager()
+    start_tts_warmup()
     wake_detector = get_wakeword_detector()
     kfc_agent.update_audio_manager(audio_manager)
     order_cart.update_audio_manager(audio_manager)
@@ -82,27 +121,26 @@ def main2():
     
     def open_callback():
         """Function called on open"""
-        response = audio_manager.play_initial_response()
-        audio_manager.wait_until_done()
+        kfc_agent.reset_session()
+        response, handle = audio_manager.play_initial_response()
         order_cart.add_messages_to_state(Message(role="assistant", content=response), is_started=True)
         stream_data = order_cart.get_view_data()
         display(stream_data)
+        handle.wait(remaining=MIC_REOPEN_LEAD_MS/1000)
         
         
     def data_callback(text: str) -> bool:
         """Function called when transcript is complete is order confirmed then return True to close the connection"""
+        kfc_agent.check_session_timeout()
         order_cart.add_messages_to_state(Message(role="user", content=text))
         stream_data = order_cart.get_view_data()
         display(stream_data)
         
-        response, order_confirmed = kfc_agent.invoke(text)
-        audio_manager.speak(response)
-        audio_manager.wait_until_done()
-        
-        order_cart.add_messages_to_state(Message(role="assistant", content=response))
-        stream_data = order_cart.get_view_data()
-        display(stream_data)
+        response, order_confirmed, handle = respond(text, audio_manager.generation)
         
+        # The microphone resumes once this returns, so hand it back just before the reply ends
+        if handle:
+            handle.wait(remaining=MIC_REOPEN_LEAD_MS/1000)
         if order_confirmed:
             order_cart.reset_cart()
         return order_confirmed
@@ -120,6 +158,8 @@ def main2():
                 on_stream=None,             # stream_callback,
                 on_open=open_callback, 
                 on_data=data_callback,
+                on_barge_in=audio_manager.interrupt,
+                playback_level=audio_manager.get_output_level,
                 end_utterance_threshold=None
             )
             
@@ -132,11 +172,12 @@ def main3():
     kfc_agent = get_kfc_agent()
     order_cart = get_order_cart()
     audio_manager = get_audio_manager()
+    start_tts_warmup()
     
     kfc_agent.update_audio_manager(audio_manager)
     order_cart.update_audio_manager(audio_manager)
     
-    response = audio_manager.play_initial_response()
+    response, _ = audio_manager.play_initial_response()
     
     order_cart.add_messages_to_state(Message(role="assistant", content=response), is_started=True)
     stream_data = order_cart.get_view_data()
@@ -144,18 +185,15 @@ def main3():
     
     while True:
         user = input("User: ")
+        kfc_agent.check_session_timeout()
         order_cart.add_messages_to_state(Message(role="user", content=user))
         stream_data = order_cart.get_view_data()
         display(stream_data)
     
-        response, order_confirmed = kfc_agent.invoke(user)
+        response, order_confirmed, handle = respond(user)
         print("Assistant:", response)
-        audio_manager.speak(response)
-        audio_manager.wait_until_done()
-        
-        order_cart.add_messages_to_state(Message(role="assistant", content=response))
-        stream_data = order_cart.get_view_data()
-        display(stream_data)
+        if handle:
+            handle.wait()
 
         if order_confirmed:
             order_cart.reset_cart()
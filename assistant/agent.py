@@ -6,21 +6,34 @@ import sounddevice as sd
 import assemblyai as aai
 from webview import Webview
 from pydub import AudioSegment
-from pydub.playback import play
 from config import SYSTEM_PROMPT
 from langchain_groq import ChatGroq
 from langchain_openai import ChatOpenAI
 from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
 # from web_builder.builder import WebViewApp
+from assistant.playback import PCMStream, PlaybackEngine, PlaybackHandle
+from assistant.tts_cache import TTSCache
+from assistant.fillers import FillerScheduler
+from assistant.tool_executor import ToolExecutor
+from assistant.history import compact_history, estimate_tokens, get_input_tokens, get_cached_tokens, StreamUsageTap
+from assistant.audio_filters import PCMStreamFilter, process_segment, get_level_dbfs, get_barge_in_threshold
+from assistant.audio_bundle import AudioBundle, BundleClip, get_bundle_sources
 from assistant.utils import StreamData, Menu
-import requests, os, queue, random, time, threading
+import requests, os, queue, random, time, threading, hashlib, json
 from langchain_core.messages import ( 
-    AIMessage, HumanMessage, SystemMessage, ToolMessage
+    AIMessage, HumanMessage, SystemMessage, ToolMessage, message_chunk_to_message
 )
-from typing import List, Dict, Optional, Tuple, Callable
+from collections import deque
+from typing import List, Dict, Optional, Tuple, Callable, Deque, Iterator
 from assemblyai.extras import AssemblyAIExtrasNotInstalledError
 from config import ( RATE, CHANNELS, ROTATE_LLM_API_KEYS,
-    ENABLE_LLM_VERBOSITY, ENABLE_STT_VERBOSITY, ENABLE_TTS_VERBOSITY
+    ENABLE_LLM_VERBOSITY, ENABLE_STT_VERBOSITY, ENABLE_TTS_VERBOSITY,
+    ENABLE_STREAMING_TTS, TTS_SAMPLE_RATE, TTS_STREAM_CHUNK_SIZE, ENABLE_TTS_CACHE,
+    ENABLE_AUDIO_BUNDLE, AUDIO_BUNDLE_PATH, ENABLE_BARGE_IN,
+    BARGE_IN_MIN_SPEECH_MS, BARGE_IN_PRE_ROLL_MS, ENABLE_AUDIO_NORMALIZATION,
+    ENABLE_ADAPTIVE_FILLERS, ENABLE_CONCURRENT_TOOLS, TOOL_EXECUTOR_WORKERS,
+    SESSION_TIMEOUT_S, HISTORY_TOKEN_BUDGET
 )
 from transformers import WhisperProcessor, WhisperForConditionalGeneration
 from sound_path import disfluencies_data, initial_responses_data, intermediate_responses_data
@@ -57,26 +70,61 @@ class AudioManager:
         self.api_key = os.getenv("DEEPGRAM_API_KEY")
         self.base_url = "https://api.deepgram.com/v1/speak"
         self.params = {"model": model_name, "encoding": "mp3"}
+        self.stream_params = {"model": model_name, "encoding": "linear16", "sample_rate": TTS_SAMPLE_RATE, "container": "none"}
         self.headers = {"Content-Type": "application/json", "Authorization": f"Token {self.api_key}"}
+        self.tts_cache = TTSCache() if ENABLE_TTS_CACHE else None
+        # Both tts paths decode to mono 16-bit pcm at the playback rate, so a clip cached by one is a hit for the other
+        self.cache_format = f"linear16_{TTS_SAMPLE_RATE}"
 
+        self.generation = 0
+        self.tts_gain_db = 0.0
         self.disfluence_index = 0
-        self.disfluencies: Dict[str, AudioSegment] = {}
-        self.initial_responses: Dict[str, AudioSegment] = {}
-        self.intermediate_responses: Dict[str, Dict[str, AudioSegment]] = {}
+        self.speak_streams: Deque[PCMStream] = deque(maxlen=100)
+        self.disfluencies: Dict[str, AudioSegment|BundleClip] = {}
+        self.initial_responses: Dict[str, AudioSegment|BundleClip] = {}
+        self.intermediate_responses: Dict[str, Dict[str, AudioSegment|BundleClip]] = {}
 
-        self.__load_disfluencies__(disfluence_folder)
-        self.__load_initial_responses__(initial_response_folder)
-        self.__load_intermediate_responses__(intermediate_response_folder)
+        if ENABLE_AUDIO_BUNDLE:
+            self.__load_audio_bundle__(disfluence_folder, initial_response_folder, intermediate_response_folder)
+        else:
+            self.__load_disfluencies__(disfluence_folder)
+            self.__load_initial_responses__(initial_response_folder)
+            self.__load_intermediate_responses__(intermediate_response_folder)
 
         self.audio_queue = queue.Queue()
-        self.playback_thread = threading.Thread(target=self.__audio_playback_worker__, daemon=True)
-        self.playback_thread.start()
+        self.playback_engine = PlaybackEngine(self.audio_queue, sample_rate=TTS_SAMPLE_RATE)
+        self.playback_engine.start()
         
+    def __load_audio_bundle__(self, disfluence_folder: str, initial_response_folder: str, intermediate_response_folder: str):
+        sources = get_bundle_sources(disfluence_folder, initial_response_folder, intermediate_response_folder)
+        audio_bundle = AudioBundle(AUDIO_BUNDLE_PATH, TTS_SAMPLE_RATE, sources)
+        for _, filler, audio_segment in audio_bundle.get_clips("disfluencies"):
+            self.disfluencies[filler] = audio_segment
+        for _, text, audio_segment in audio_bundle.get_clips("initial_responses"):
+            self.initial_responses[text] = audio_segment
+        for category in intermediate_responses_data:
+            self.intermediate_responses[category] = {}
+        for category, text, audio_segment in audio_bundle.get_clips("intermediate_responses"):
+            self.intermediate_responses[category][text] = audio_segment
+
+    def __process__(self, audio_segment: AudioSegment, label: str) -> AudioSegment:
+        if not ENABLE_AUDIO_NORMALIZATION:
+            return audio_segment
+        audio_segment, _ = process_segment(audio_segment, label)
+        return audio_segment
+
+    def __process_tts__(self, audio_segment: AudioSegment, label: str) -> AudioSegment:
+        # Complete tts clips are measured as a whole, their gain is reused to level streamed speech of the same voice
+        if not ENABLE_AUDIO_NORMALIZATION:
+            return audio_segment
+        audio_segment, self.tts_gain_db = process_segment(audio_segment, label)
+        return audio_segment
+
     def __load_disfluencies__(self, folder: str):
         for filler, filename in disfluencies_data.items():
             path = os.path.join(folder, filename)
             if os.path.isfile(path):
-                self.disfluencies[filler] = AudioSegment.from_file(path, format="mp3")
+                self.disfluencies[filler] = self.__process__(AudioSegment.from_file(path, format="mp3"), path)
             else:
                 print(f"File {filename} not found in {folder}. Skipping {filler}.")
 
@@ -84,7 +132,7 @@ class AudioManager:
         for text, filename in initial_responses_data.items():
             path = os.path.join(folder, filename)
             if os.path.isfile(path):
-                self.initial_responses[text] = AudioSegment.from_file(path, format="mp3")
+                self.initial_responses[text] = self.__process__(AudioSegment.from_file(path, format="mp3"), path)
             else:
                 print(f"File {filename} not found in {folder}.")
 
@@ -94,49 +142,53 @@ class AudioManager:
             for text, filename in responses.items():
                 path = os.path.join(folder, category, filename)
                 if os.path.isfile(path):
-                    self.intermediate_responses[category][text] = AudioSegment.from_file(path, format="mp3")
+                    self.intermediate_responses[category][text] = self.__process__(AudioSegment.from_file(path, format="mp3"), path)
                 else:
                     print(f"File {filename} for {category} not found in {folder}.")
 
-    def __audio_playback_worker__(self):
-        while True:
-            try:
-                if self.audio_queue:
-                    audio_segment, delay = self.audio_queue.get()
-                    if delay:
-                        time.sleep(delay)
-                    play(audio_segment)
-                    self.audio_queue.task_done()
-            except:
-                pass
-    
-    def __add_to_queue__(self, audio_segment: AudioSegment, delay: Optional[float]=None):
-        self.audio_queue.put((audio_segment, delay))
+    def __add_to_queue__(self, audio_segment: AudioSegment|BundleClip|PCMStream, delay: Optional[float]=None, label: str="") -> PlaybackHandle:
+        if isinstance(audio_segment, BundleClip):
+            # Bundled clips are stored at the output format, so they play straight from the mmap
+            if audio_segment.sample_rate == self.playback_engine.sample_rate and self.playback_engine.channels == 1:
+                audio_segment = audio_segment.pcm
+            else:
+                audio_segment = audio_segment.to_segment()
+        clip = self.playback_engine.create_clip(audio_segment, delay, label)
+        self.audio_queue.put(clip)
+        return self.playback_engine.create_handle(clip)
     
-    def play_disfluent_filler(self):
-        """Play a random disfluency audio."""
+    def play_disfluent_filler(self, delay: Optional[float]=1) -> PlaybackHandle:
+        """
+        Play a random disfluency audio.
+
+        Args:
+            delay (Optional[float]): Seconds of silence before the filler starts.
+
+        Returns:
+            PlaybackHandle: The playback handle of the queued clip.
+        """
         # if random.choice([True, False]):
         l = list(self.disfluencies.keys())
         choice = l[self.disfluence_index%len(l)]
         self.disfluence_index+=1
         if ENABLE_TTS_VERBOSITY:
             print(f"TTS PRE-REC: {choice}")
-        self.__add_to_queue__(self.disfluencies[choice], 1)
+        return self.__add_to_queue__(self.disfluencies[choice], delay, choice)
     
-    def play_initial_response(self) -> str:
+    def play_initial_response(self) -> Tuple[str, PlaybackHandle]:
         """
         Play a random initial response audio.
 
         Returns:
-            str: The text of the played response.
+            Tuple[str, PlaybackHandle]: The text of the played response and the playback handle of the queued clip.
         """
         choice = random.choice(list(self.initial_responses.keys()))
         if ENABLE_TTS_VERBOSITY:
             print(f"TTS PRE-REC: {choice}")
-        self.__add_to_queue__(self.initial_responses[choice])
-        return choice
+        handle = self.__add_to_queue__(self.initial_responses[choice], label=choice)
+        return choice, handle
 
-    def play_intermediate_response(self, category: str) -> str:
+    def play_intermediate_response(self, category: str) -> Tuple[str, Optional[PlaybackHandle]]:
         """
         Play a random intermediate response audio from a specific category of tool invocation.
 
@@ -144,35 +196,222 @@ class AudioManager:
             category (str): The category of the intermediate response.
 
         Returns:
-            str: The text of the played response.
+            Tuple[str, Optional[PlaybackHandle]]: The text of the played response and the playback handle of the queued clip, an empty text and None if the category has no responses.
         """
+        choice, handle = "", None
         if category in self.intermediate_responses:
             choice = random.choice(list(self.intermediate_responses[category].keys()))
             if ENABLE_TTS_VERBOSITY:
                 print(f"TTS PRE-REC: {choice}")
-            self.__add_to_queue__(self.intermediate_responses[category][choice])
-            return choice
+            handle = self.__add_to_queue__(self.intermediate_responses[category][choice], label=choice)
         else:
             if ENABLE_TTS_VERBOSITY:
                 print(f"TTS: Category {category} not found.")
-            return ""
+        return choice, handle
         
-    def speak(self, text: str) -> None:
+    def speak(self, text: str, stream: Optional[bool]=None) -> Optional[PlaybackHandle]:
         """
         Generate and play speech from the given text.
 
         Args:
             text (str): The text to convert to speech.
+            stream (Optional[bool]): Start playback while the audio is still downloading. Defaults to `ENABLE_STREAMING_TTS`.
+
+        Returns:
+            Optional[PlaybackHandle]: The handle of the queued speech, or None if synthesis failed.
         """
+        generation = self.generation
+        stream = ENABLE_STREAMING_TTS if stream is None else stream
+        if stream and self.tts_cache is not None:
+            audio_segment = self.tts_cache.get(text, self.model_name, self.cache_format)
+            if audio_segment is not None:
+                if ENABLE_TTS_VERBOSITY:
+                    print(f"TTS CACHED: {text}")
+                return self.__add_to_queue__(audio_segment, label=text)
+        if stream:
+            return self.__speak_stream__(text)
+        audio_segment = self.synthesize(text)
+        if audio_segment is not None and generation == self.generation:
+            if ENABLE_TTS_VERBOSITY:
+                print(f"TTS LLM-SPEAK: {text}")
+            return self.__add_to_queue__(audio_segment, label=text)
+        return None
+
+    def synthesize(self, text: str) -> Optional[AudioSegment]:
+        """
+        Generate speech for the given text without queueing it for playback.
+
+        Args:
+            text (str): The text to convert to speech.
+
+        Returns:
+            Optional[AudioSegment]: The decoded speech, or None if synthesis failed.
+        """
+        if self.tts_cache is not None:
+            audio_segment = self.tts_cache.get(text, self.model_name, self.cache_format)
+            if audio_segment is not None:
+                return audio_segment
         try:
             with requests.post(self.base_url, stream=False, json={"text": text}, params=self.params, headers=self.headers) as r:
-                audio_segment = AudioSegment.from_mp3(BytesIO(r.content))
+                r.raise_for_status()
+                audio_segment = AudioSegment.from_mp3(BytesIO(r.content)).set_frame_rate(TTS_SAMPLE_RATE).set_channels(1).set_sample_width(2)
+                audio_segment = self.__process_tts__(audio_segment, text)
+        except Exception as e:
+            if ENABLE_TTS_VERBOSITY:
+                print(f"TTS LLM-SPEAK: Exception in synthesize: {e}")
+            return None
+        self.__cache_put__(text, audio_segment)
+        return audio_segment
+
+    def __cache_put__(self, text: str, audio_segment: AudioSegment) -> bool:
+        """Store synthesized speech in the TTS cache, a failed write is logged and never loses the speech itself."""
+        if self.tts_cache is None:
+            return False
+        try:
+            self.tts_cache.put(text, self.model_name, self.cache_format, audio_segment)
+            return True
+        except Exception as e:
+            if ENABLE_TTS_VERBOSITY:
+                print(f"TTS CACHE: Exception while storing '{text}': {e}")
+            return False
+
+    def enqueue(self, audio_segment: AudioSegment, delay: Optional[float]=None, label: str="") -> PlaybackHandle:
+        """
+        Queue already synthesized audio for playback after everything queued before it.
+
+        Args:
+            audio_segment (AudioSegment): The audio to play.
+            delay (Optional[float]): Seconds of silence before the audio starts.
+            label (str): Text shown in verbose timing logs, e.g. the spoken text.
+
+        Returns:
+            PlaybackHandle: The handle of the queued audio.
+        """
+        return self.__add_to_queue__(audio_segment, delay, label)
+
+    def __speak_stream__(self, text: str) -> Optional[PlaybackHandle]:
+        """
+        Generate speech as raw 16-bit PCM and queue it for playback while it downloads.
+
+        The TTS endpoint is asked for headerless `linear16` audio at the playback
+        rate, so decoding each chunk only means cutting it on sample boundaries.
+        Once the download completes the audio is stored in the TTS cache. An
+        `interrupt` during the download aborts it and ends the stream.
+
+        Args:
+            text (str): The text to convert to speech.
+
+        Returns:
+            Optional[PlaybackHandle]: The handle of the queued speech, or None if the request failed before any audio was queued.
+        """
+        handle = None
+        generation = self.generation
+        pcm_stream = PCMStream(sample_rate=TTS_SAMPLE_RATE, label=text)
+        stream_filter = PCMStreamFilter(TTS_SAMPLE_RATE, self.tts_gain_db) if ENABLE_AUDIO_NORMALIZATION else None
+        try:
+            with requests.post(self.base_url, stream=True, json={"text": text}, params=self.stream_params, headers=self.headers) as r:
+                r.raise_for_status()
                 if ENABLE_TTS_VERBOSITY:
                     print(f"TTS LLM-SPEAK: {text}")
-                self.__add_to_queue__(audio_segment)
+                handle = self.__add_to_queue__(pcm_stream)
+                chunks = []
+                for chunk in r.iter_content(chunk_size=TTS_STREAM_CHUNK_SIZE):
+                    if generation != self.generation:
+                        if ENABLE_TTS_VERBOSITY:
+                            print(f"TTS LLM-SPEAK: Aborted by interrupt: {text}")
+                        return handle
+                    if stream_filter is not None:
+                        chunk = stream_filter.process(chunk)
+                    pcm_stream.feed(chunk)
+                    chunks.append(chunk)
+            if ENABLE_TTS_VERBOSITY and stream_filter is not None:
+                print(f"AUDIO: Trimmed {stream_filter.trimmed_ms}ms leading silence, gain {stream_filter.gain_db:+.1f}dB ({text})")
+            if self.tts_cache is not None and chunks:
+                self.__cache_put__(text, self.__decode_pcm__(b"".join(chunks)))
         except Exception as e:
             if ENABLE_TTS_VERBOSITY:
                 print(f"TTS LLM-SPEAK: Exception in speak: {e}")
+        finally:
+            pcm_stream.close()
+            self.speak_streams.append(pcm_stream)
+        return handle
+
+    def __decode_pcm__(self, data: bytes) -> AudioSegment:
+        # headerless mono 16-bit samples, any trailing partial sample is dropped
+        return AudioSegment(data=data[:len(data) - len(data) % 2], sample_width=2, frame_rate=TTS_SAMPLE_RATE, channels=1)
+
+    def is_cached(self, text: str) -> bool:
+        """Whether `speak(text)` and `synthesize(text)` would be served from the TTS cache."""
+        return self.tts_cache is not None and self.tts_cache.contains(text, self.model_name, self.cache_format)
+
+    def prefetch(self, text: str) -> bool:
+        """
+        Synthesize `text` into the TTS cache without playing it, over the streaming endpoint if `ENABLE_STREAMING_TTS`.
+
+        Args:
+            text (str): The text to convert to speech.
+
+        Returns:
+            bool: Whether the speech is in the cache afterwards.
+        """
+        if self.tts_cache is None:
+            return False
+        if self.is_cached(text):
+            return True
+        if not ENABLE_STREAMING_TTS:
+            return self.synthesize(text) is not None and self.is_cached(text)
+        
+        try:
+            with requests.post(self.base_url, stream=False, json={"text": text}, params=self.stream_params, headers=self.headers) as r:
+                r.raise_for_status()
+                audio_segment = self.__process_tts__(self.__decode_pcm__(r.content), text)
+        except Exception as e:
+            if ENABLE_TTS_VERBOSITY:
+                print(f"TTS PREFETCH: Exception in prefetch: {e}")
+            return False
+        return self.__cache_put__(text, audio_segment)
+
+    def get_speak_timings(self) -> List[Dict[str, Optional[int]]]:
+        """
+        Return the time to first byte and time to first sound of recent streamed utterances.
+
+        Returns:
+            List[Dict[str, Optional[int]]]: Per utterance, its text and both timings in milliseconds.
+        """
+        return [
+            {"text": stream.label, "ttfb_ms": stream.ttfb_ms, "ttfs_ms": stream.ttfs_ms} 
+            for stream in self.speak_streams
+        ]
+
+    def is_idle(self) -> bool:
+        """Whether nothing is playing or queued for playback."""
+        return self.audio_queue.unfinished_tasks == 0
+
+    def interrupt(self) -> None:
+        """
+        Stop speaking at once: cancel the playing clip, drop everything queued and abort pending synthesis.
+
+        Speech requested before the interrupt that is still synthesizing is
+        discarded instead of being queued once it is ready.
+        """
+        self.generation += 1
+        dropped = self.playback_engine.flush()
+        playing = self.playback_engine.cancel_current()
+        if ENABLE_TTS_VERBOSITY:
+            print(f"TTS: Interrupted, {'cancelled the playing clip and ' if playing else ''}dropped {dropped} queued clips")
+
+    def get_playback_latencies(self) -> List[Dict[str, Optional[int]]]:
+        """
+        Return the enqueue to first sample latency of recently played clips.
+
+        Returns:
+            List[Dict[str, Optional[int]]]: Per clip, its label and latency in milliseconds.
+        """
+        return self.playback_engine.get_latencies()
+
+    def get_output_level(self) -> Optional[float]:
+        """Return the loudest level in dBFS played within `BARGE_IN_ECHO_WINDOW_MS`, None if nothing played since."""
+        return self.playback_engine.get_output_level()
 
     def wait_until_done(self) -> bool:
         try:
@@ -198,7 +437,16 @@ class Agent:
         agent (Any): The agent bound with tools.
         system_prompt (str): The system prompt used to guide the agent's behavior.
         messages (List): The conversation history.
+        tool_executor (ToolExecutor): Runs the tool calls of a response, concurrently if `ENABLE_CONCURRENT_TOOLS`.
+        tool_turns (List[Dict[str, float]]): Per turn with tool calls, the number of calls, their wall time and the sum of their latencies.
+        session (int): Counts the conversations, the history is reset when the order is confirmed or the customer was silent for `SESSION_TIMEOUT_S`.
+        prompt_turns (List[Dict]): Per turn, the session, the number of model calls and their prompt tokens (estimated if the provider reported none), of which cached.
+        prefix (Tuple[SystemMessage, ...]): The stable start of every prompt, shared by all sessions so provider-side prompt caching applies.
     """
+    # Built once per process and never changed, so every call starts with byte-identical tool schemas and system prompt
+    tool_schemas: Dict[Tuple[str, ...], List[Dict]] = {}
+    prompt_prefixes: Dict[str, Tuple[SystemMessage, ...]] = {}
+    
     def __init__(self, model_name: str, tools: Dict[str, BaseTool], menu_items: List[Menu]) -> None:
         """
         Initialize the Agent with a specified model and set of tools.
@@ -212,28 +460,69 @@ class Agent:
             ValueError: If API keys are not set correctly when rotation is enabled.
         """
         self.audio_manager = None
+        self.filler_scheduler = None
+        self.model_name = model_name
         self.available_tools = tools
+        self.tool_latencies: Dict[str, List[float]] = {}
+        self.tool_executor = ToolExecutor(tools, TOOL_EXECUTOR_WORKERS if ENABLE_CONCURRENT_TOOLS else 1)
+        self.tool_turns: List[Dict[str, float]] = []
+        self.tool_turn: Dict[str, float] = {}
+        self.order_cart = None
+        self.session = 0
+        self.last_activity: Optional[float] = None
+        self.compacted_turns = 0
+        self.prompt_turns: List[Dict] = []
+        self.prompt_turn: Dict = {}
         self.set_llm_engine(model_name)
-        self.agent = self.model.bind_tools(list(tools.values()))
+        self.agent = self.model.bind_tools(self.get_tool_schemas(tools))
         
         if ENABLE_LLM_VERBOSITY:
             print(f"LLM: Starting Agent with api_keys: {self.api_keys}")    
         
         self.format_system_prompt(menu_items)
         
+    @classmethod
+    def get_tool_schemas(cls, tools: Dict[str, BaseTool]) -> List[Dict]:
+        """The json schemas of `tools`, converted once and ordered by name."""
+        key = tuple(sorted(tools))
+        if key not in cls.tool_schemas:
+            cls.tool_schemas[key] = [convert_to_openai_tool(tools[name]) for name in key]
+        return cls.tool_schemas[key]
+    
+    def get_prefix_fingerprint(self) -> str:
+        """
+        Hash the tool payload bound to the model and the start of the current prompt, it changes whenever the cacheable prefix does.
+
+        Returns:
+            str: The sha256 of the bound tools and of the first `len(self.prefix)` messages of the history.
+        """
+        prefix = [[message.type, message.content] for message in self.messages[:len(self.prefix)]]
+        data = json.dumps([self.agent.kwargs["tools"], prefix], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+        
     def update_audio_manager(self, audio_manager: AudioManager):
         self.audio_manager = audio_manager
+        self.filler_scheduler = FillerScheduler(audio_manager) if ENABLE_ADAPTIVE_FILLERS else None
+    
+    def update_order_cart(self, order_cart):
+        """Set the cart whose state summarizes compacted turns and which is cleared when a session times out."""
+        self.order_cart = order_cart
     
     def set_llm_engine(self, model_name: str):
         self.backend = "oai"
+        self.usage_tap = None
         if "gpt" in model_name:
             self.api_keys = [os.getenv("OPENAI_API_KEY")]
             self.model = ChatOpenAI(
                 max_tokens=1500,
                 model=model_name,
                 temperature = 0.1,
+                stream_usage=True,
                 api_key=self.api_keys[0]
             )
+            # Streamed usage loses the cached prompt tokens on the way through langchain, the tap keeps them
+            self.usage_tap = StreamUsageTap(self.model.client)
+            self.model.client = self.usage_tap
             api_keys = os.getenv("OPENAI_API_KEYS")
         else:
             self.backend = "groq"
@@ -294,7 +583,8 @@ class Agent:
                     string+="\n"
                     
             self.system_prompt = SYSTEM_PROMPT.format(menu=string)
-            self.messages = [SystemMessage(content=self.system_prompt)]
+            self.prefix = Agent.prompt_prefixes.setdefault(self.system_prompt, (SystemMessage(content=self.system_prompt),))
+            self.messages = list(self.prefix)
         
     def add_user_message(self, text:str):
         """
@@ -305,6 +595,54 @@ class Agent:
         """
         self.messages.append(HumanMessage(content=text))
     
+    def reset_session(self):
+        """Start a new conversation, dropping the history of the previous one."""
+        self.messages = list(self.prefix)
+        self.last_activity = None
+        self.session += 1
+        if ENABLE_LLM_VERBOSITY:
+            print(f"LLM: Started session {self.session}")
+    
+    def check_session_timeout(self) -> bool:
+        """
+        End the session if the customer was silent for longer than `SESSION_TIMEOUT_S`, also clearing the cart.
+
+        Call it before adding the customer's message to the transcript, since clearing the cart also clears the
+        transcript. Every turn checks it too, which is then a no-op.
+
+        Returns:
+            bool: Whether the session timed out and was reset.
+        """
+        # A customer silent for this long drove off, the next one must not see their conversation or cart
+        if self.last_activity is None or time.monotonic() - self.last_activity <= SESSION_TIMEOUT_S:
+            return False
+        if ENABLE_LLM_VERBOSITY:
+            print(f"LLM: Session {self.session} timed out")
+        if self.order_cart is not None:
+            self.order_cart.reset_cart()
+        self.reset_session()
+        return True
+    
+    def __start_turn__(self, text: str):
+        self.check_session_timeout()
+        self.add_user_message(text)
+        
+        if self.order_cart is not None:
+            self.messages, turns = compact_history(self.messages, HISTORY_TOKEN_BUDGET, self.order_cart.get_cart_state(), len(self.prefix))
+            self.compacted_turns += turns
+            if turns and ENABLE_LLM_VERBOSITY:
+                print(f"LLM: Compacted {turns} turns of session {self.session} into the cart state")
+        self.prompt_turn = {"session": self.session, "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "estimated": False}
+    
+    def __record_usage__(self, response: AIMessage, estimated_tokens: int):
+        input_tokens = get_input_tokens(response)
+        if input_tokens is None:
+            input_tokens = estimated_tokens
+            self.prompt_turn["estimated"] = True
+        self.prompt_turn["calls"] += 1
+        self.prompt_turn["prompt_tokens"] += input_tokens
+        self.prompt_turn["cached_tokens"] += get_cached_tokens(response) or 0
+    
     def invoke(self, text:str) -> Tuple[str, bool]:
         """
         Process a user input, potentially make tool calls, and generate a response.
@@ -321,7 +659,7 @@ class Agent:
         """
         tries=0
         is_order_confirmed = False
-        self.add_user_message(text)
+        self.__start_turn__(text)
         tool_call_identified = True
         if ENABLE_LLM_VERBOSITY:
             print(f"LLM INPUT: {text}")
@@ -330,29 +668,214 @@ class Agent:
             if ROTATE_LLM_API_KEYS:
                 self.rotate_key(self.api_keys, tries)
             tries+=1
-            # if self.audio_manager is not None:
-            #     self.audio_manager.play_disfluent_filler()
-            response: AIMessage = self.agent.invoke(self.messages)
+            filler_ticket = None
+            if self.filler_scheduler is not None:
+                filler_ticket = self.filler_scheduler.start(self.model_name, tries-1)
+            estimated_tokens = estimate_tokens(self.messages)
+            try:
+                response: AIMessage = self.agent.invoke(self.messages)
+            finally:
+                if filler_ticket is not None:
+                    self.filler_scheduler.finish(filler_ticket)
+            self.__record_usage__(response, estimated_tokens)
             self.messages.append(response)
-            
-            for tool_call in response.tool_calls:
-                if ENABLE_LLM_VERBOSITY:
-                    print(f"LLM TOOL CALL: {tool_call['name']} - {tool_call['args']}")
-                if tool_call["name"]=="confirm_order":
-                    is_order_confirmed = True
-                
-                selected_tool = self.available_tools[tool_call["name"]]
-                tool_output = selected_tool.invoke(tool_call["args"])
-                if ENABLE_LLM_VERBOSITY:
-                    print(f"LLM TOOL OUTPUT: {tool_output}")
-                self.messages.append(ToolMessage(tool_output, tool_call_id=tool_call["id"]))
+            is_order_confirmed = self.__invoke_tools__(response) or is_order_confirmed
             
             if len(response.tool_calls) == 0:
                 tool_call_identified = False
                 if ENABLE_LLM_VERBOSITY:
                     print(f"LLM RESPONSE: {response.content}")
+        self.__end_turn__(is_order_confirmed)
         return response.content, is_order_confirmed
 
+    def __invoke_tools__(self, response: AIMessage) -> bool:
+        """
+        Run the tool calls of a model response, appending a `ToolMessage` per call to the history in the order of the calls.
+
+        Args:
+            response (AIMessage): The model response.
+
+        Returns:
+            bool: Whether the order was confirmed by one of the calls.
+        """
+        if not response.tool_calls:
+            return False
+        start_time = time.perf_counter()
+        results = self.tool_executor.run(response.tool_calls)
+        self.tool_turn["calls"] = self.tool_turn.get("calls", 0) + len(results)
+        self.tool_turn["wall_ms"] = self.tool_turn.get("wall_ms", 0) + (time.perf_counter() - start_time) * 1000
+        
+        is_order_confirmed = False
+        for tool_call, (tool_output, elapsed_time) in zip(response.tool_calls, results):
+            if tool_call["name"]=="confirm_order":
+                is_order_confirmed = True
+            self.tool_latencies.setdefault(tool_call["name"], []).append(elapsed_time)
+            self.tool_turn["serial_ms"] = self.tool_turn.get("serial_ms", 0) + elapsed_time
+            self.messages.append(ToolMessage(tool_output, tool_call_id=tool_call["id"]))
+        return is_order_confirmed
+
+    def __end_turn__(self, is_order_confirmed: bool):
+        if self.tool_turn:
+            self.tool_turns.append(self.tool_turn)
+            if ENABLE_LLM_VERBOSITY:
+                print(f"LLM TOOLS: {self.tool_turn['calls']} calls in {self.tool_turn['wall_ms']:.1f}ms (sequential {self.tool_turn['serial_ms']:.1f}ms)")
+        self.tool_turn = {}
+        
+        self.prompt_turns.append(self.prompt_turn)
+        if ENABLE_LLM_VERBOSITY:
+            estimated = " (estimated)" if self.prompt_turn["estimated"] else ""
+            print(f"LLM PROMPT: {self.prompt_turn['prompt_tokens']} tokens ({self.prompt_turn['cached_tokens']} cached) over {self.prompt_turn['calls']} calls{estimated}, {len(self.messages)} messages in session {self.session}")
+        self.last_activity = time.monotonic()
+        
+        # The confirmed order is done with, the next car starts from the system prompt alone
+        if is_order_confirmed:
+            self.reset_session()
+
+    def get_tool_latency_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Summarize the wall time spent inside each tool call.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Per tool name, the number of calls and the mean and max latency in milliseconds.
+        """
+        return {
+            name: {"calls": len(latencies), "mean_ms": sum(latencies)/len(latencies), "max_ms": max(latencies)}
+            for name, latencies in self.tool_latencies.items()
+        }
+
+    def get_tool_turn_stats(self) -> Dict[str, float]:
+        """
+        Summarize the tool wall time per turn against running the same calls one after another.
+
+        The sequential figure is the sum of the latencies of the calls. Comparing
+        runs with `ENABLE_CONCURRENT_TOOLS` on and off also captures the time
+        they spend waiting on each other for the cart lock.
+
+        Returns:
+            Dict[str, float]: The number of turns with tool calls, the mean calls, wall and sequential time in milliseconds per turn, and the speedup.
+        """
+        if not self.tool_turns:
+            return {"turns": 0}
+        turns = len(self.tool_turns)
+        wall_ms = sum(turn["wall_ms"] for turn in self.tool_turns)
+        serial_ms = sum(turn["serial_ms"] for turn in self.tool_turns)
+        return {
+            "turns": turns,
+            "mean_calls": sum(turn["calls"] for turn in self.tool_turns) / turns,
+            "mean_wall_ms": wall_ms / turns,
+            "mean_serial_ms": serial_ms / turns,
+            "speedup": serial_ms / wall_ms if wall_ms else 1.0,
+        }
+
+    def get_prompt_token_stats(self) -> Dict[str, float]:
+        """
+        Summarize the prompt tokens sent per turn, to see how the prompt grows within and across sessions.
+
+        Returns:
+            Dict[str, float]: The number of turns and sessions, the mean and max prompt tokens per turn, the tokens of the last turn, the share of prompt tokens served from the provider's cache, the turns compacted so far and whether any count was estimated.
+        """
+        if not self.prompt_turns:
+            return {"turns": 0}
+        tokens = [turn["prompt_tokens"] for turn in self.prompt_turns]
+        cached_tokens = sum(turn["cached_tokens"] for turn in self.prompt_turns)
+        return {
+            "turns": len(tokens),
+            "sessions": len({turn["session"] for turn in self.prompt_turns}),
+            "mean_prompt_tokens": sum(tokens) / len(tokens),
+            "max_prompt_tokens": max(tokens),
+            "last_prompt_tokens": tokens[-1],
+            "cached_tokens": cached_tokens,
+            "uncached_tokens": sum(tokens) - cached_tokens,
+            "cached_ratio": cached_tokens / sum(tokens) if sum(tokens) else 0.0,
+            "compacted_turns": self.compacted_turns,
+            "estimated": any(turn["estimated"] for turn in self.prompt_turns),
+        }
+
+
+
+class StreamingAgent(Agent):
+    """
+    An `Agent` that yields its reply as the model generates it.
+
+    The model is called through `stream` instead of `invoke`. Text deltas are
+    yielded as they arrive, so speech synthesis and the transcript can start
+    with the first sentence. A response that turns out to contain tool calls
+    is gathered from its chunks, the tools are run and the model is streamed
+    again with their results, exactly like the loop in `Agent.invoke`. Text
+    of a later round is yielded after a separating space, so it does not run
+    into the sentence spoken before the tools were called.
+
+    Attributes:
+        response (str): The text of the final model response of the last completed reply, like the one `Agent.invoke` returns.
+        is_order_confirmed (bool): Whether the last reply confirmed the order.
+    """
+    def __init__(self, model_name: str, tools: Dict[str, BaseTool], menu_items: List[Menu]) -> None:
+        super().__init__(model_name, tools, menu_items)
+        self.response = ""
+        self.is_order_confirmed = False
+
+    def stream(self, text: str) -> Iterator[str]:
+        """
+        Process a user input like `invoke`, yielding the reply text as it is generated.
+
+        Args:
+            text (str): The user's input text.
+
+        Yields:
+            str: The next piece of the reply. `response` and `is_order_confirmed` are set once the generator is exhausted.
+        """
+        tries = 0
+        has_spoken = False
+        self.response = ""
+        self.is_order_confirmed = False
+        self.__start_turn__(text)
+        if ENABLE_LLM_VERBOSITY:
+            print(f"LLM INPUT: {text}")
+        
+        while True:
+            if ROTATE_LLM_API_KEYS:
+                self.rotate_key(self.api_keys, tries)
+            tries+=1
+            filler_ticket = None
+            if self.filler_scheduler is not None:
+                filler_ticket = self.filler_scheduler.start(self.model_name, tries-1)
+            
+            gathered = None
+            round_started = False
+            estimated_tokens = estimate_tokens(self.messages)
+            if self.usage_tap is not None:
+                self.usage_tap.pop_usage()
+            try:
+                for chunk in self.agent.stream(self.messages):
+                    gathered = chunk if gathered is None else gathered + chunk
+                    if chunk.content:
+                        # The answer started, there is no dead air left to fill
+                        if filler_ticket is not None:
+                            self.filler_scheduler.finish(filler_ticket)
+                            filler_ticket = None
+                        if has_spoken and not round_started:
+                            yield " "
+                        round_started = has_spoken = True
+                        yield chunk.content
+            finally:
+                if filler_ticket is not None:
+                    self.filler_scheduler.finish(filler_ticket)
+            
+            response: AIMessage = message_chunk_to_message(gathered) if gathered is not None else AIMessage(content="")
+            usage = self.usage_tap.pop_usage() if self.usage_tap is not None else None
+            if usage:
+                response.response_metadata["token_usage"] = usage
+            self.__record_usage__(response, estimated_tokens)
+            self.messages.append(response)
+            self.is_order_confirmed = self.__invoke_tools__(response) or self.is_order_confirmed
+            self.response = response.content
+            
+            if len(response.tool_calls) == 0:
+                if ENABLE_LLM_VERBOSITY:
+                    print(f"LLM RESPONSE: {self.response}")
+                self.__end_turn__(self.is_order_confirmed)
+                return
+
        
        
         
@@ -364,13 +887,21 @@ class MicrophoneStream:
     methods to stream the audio data. It supports pausing and resuming the
     audio capture, as well as writing the audio to WAV files.
 
+    While paused, the capture keeps measuring the microphone level. When the
+    customer talks over the assistant for long enough, the stream resumes by
+    itself, forwards the audio captured just before, and calls `on_barge_in`.
+    While the assistant is speaking the customer must be louder than the
+    playback, so the speaker's echo does not interrupt it.
+
     Attributes:
         sample_rate (int): The sample rate of the audio capture.
         chunk_size (int): The size of each audio chunk in frames.
         file_duration (int): The duration of each WAV file in seconds.
+        on_barge_in (Optional[Callable]): Called, on its own thread, when the customer interrupts while paused.
+        playback_level (Optional[Callable]): Returns the level in dBFS of the recent playback, None if nothing played.
 
     """
-    def __init__(self, sample_rate: int=44100, chunk_size: int=4410, file_duration: int=5):
+    def __init__(self, sample_rate: int=44100, chunk_size: int=4410, file_duration: int=5, on_barge_in: Optional[Callable]=None, playback_level: Optional[Callable]=None):
         """
         Initialize the MicrophoneStream.
 
@@ -378,7 +909,13 @@ class MicrophoneStream:
             sample_rate (int): The sample rate of the audio capture. Defaults to 44100.
             chunk_size (int): The size of each audio chunk in frames. Defaults to 4410.
             file_duration (int): The duration of each WAV file in seconds. Defaults to 5.
+            on_barge_in (Optional[Callable]): Called when the customer interrupts while paused, barge-in detection is off if None.
+            playback_level (Optional[Callable]): Returns the level in dBFS of the recent playback, e.g. `AudioManager.get_output_level`. Without it echo is only kept out by `BARGE_IN_THRESHOLD_DBFS`.
         """
+        self.on_barge_in = on_barge_in if ENABLE_BARGE_IN else None
+        self.playback_level = playback_level
+        self.speech_frames = 0
+        self.pre_roll: Deque[bytes] = deque(maxlen=max(1, int(BARGE_IN_PRE_ROLL_MS / 1000 * sample_rate / chunk_size)))
         self.file_index = 0
         self.frames_written = 0
         self.chunk_size = chunk_size
@@ -422,9 +959,34 @@ class MicrophoneStream:
         """
         if status and ENABLE_STT_VERBOSITY:
             print(f"STT: Status: {status}")
+        audio_bytes = (indata * 32767).astype(np.int16).tobytes()
         if not self._paused:
-            audio_bytes = (indata * 32767).astype(np.int16).tobytes()
             self.audio_buffer.put(audio_bytes)
+        elif self.on_barge_in is not None:
+            self.pre_roll.append(audio_bytes)
+            self.__detect_barge_in__(indata, frames)
+
+    def __detect_barge_in__(self, indata, frames: int):
+        """
+        Energy based voice activity check on a block captured while paused.
+
+        Args:
+            indata (numpy.ndarray): The input audio data, floats in [-1, 1].
+            frames (int): The number of frames in the input.
+        """
+        level_dbfs = get_level_dbfs(indata, full_scale=1.0)
+        threshold_dbfs = get_barge_in_threshold(self.playback_level() if self.playback_level is not None else None)
+        self.speech_frames = self.speech_frames + frames if level_dbfs >= threshold_dbfs else 0
+        if self.speech_frames * 1000 < BARGE_IN_MIN_SPEECH_MS * self.sample_rate:
+            return
+        
+        self.speech_frames = 0
+        while self.pre_roll:
+            self.audio_buffer.put(self.pre_roll.popleft())
+        self._paused = False
+        if ENABLE_STT_VERBOSITY:
+            print(f"STT: Barge-in detected at {level_dbfs:.1f}dBFS, recording resumed.")
+        threading.Thread(target=self.on_barge_in, daemon=True).start()
     
     def __write_to_file__(self):
         """
@@ -514,6 +1076,8 @@ class MicrophoneStream:
         """
         Pause the audio capture.
         """
+        self.speech_frames = 0
+        self.pre_roll.clear()
         self._paused = True
         if ENABLE_STT_VERBOSITY:
             print("STT: Recording paused.")
@@ -615,7 +1179,7 @@ class ConversationManager:
         if ENABLE_STT_VERBOSITY:
             print("STT: Closed connection for listening")
             
-    def run(self, on_open: Optional[Callable]=None, on_data: Optional[Callable]=None, on_stream: Optional[Callable]=None, end_utterance_threshold: Optional[int]=None):
+    def run(self, on_open: Optional[Callable]=None, on_data: Optional[Callable]=None, on_stream: Optional[Callable]=None, end_utterance_threshold: Optional[int]=None, on_barge_in: Optional[Callable]=None, playback_level: Optional[Callable]=None):
         """
         Start the conversation management process.
 
@@ -626,6 +1190,8 @@ class ConversationManager:
             on_stream (Optional[Callable]): Callback function to call when transcript streams.
             on_open (Optional[Callable]): Callback function when the connection is opened.
             on_data (Optional[Callable]): Callback function when new transcription data is received.
+            on_barge_in (Optional[Callable]): Callback function when the user starts talking while the microphone is paused.
+            playback_level (Optional[Callable]): Returns the level of the recent playback, so its echo is not taken for the user talking.
         """
         self.open_callback=on_open
         self.data_callback=on_data
@@ -644,7 +1210,7 @@ class ConversationManager:
             print("STT: Connected to assembly ai socket endpoint.")
         
         try:
-            self.microphone_stream = MicrophoneStream(sample_rate=16_000)
+            self.microphone_stream = MicrophoneStream(sample_rate=16_000, on_barge_in=on_barge_in, playback_level=playback_level)
             self.transcriber.stream(self.microphone_stream)
         finally:
             self.transcriber.close()
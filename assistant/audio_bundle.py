@@ -0,0 +1,204 @@
+import os, json, mmap, time
+from pydub import AudioSegment
+from assistant.audio_filters import process_segment
+from typing import Dict, List, Optional, Tuple
+from sound_path import disfluencies_data, initial_responses_data, intermediate_responses_data
+from config import ( ENABLE_TTS_VERBOSITY, TTS_SAMPLE_RATE, AUDIO_BUNDLE_PATH,
+    DISFLUENCE, INITIAL_RESPONSE, INTERMEDIATE_RESPONSE, ENABLE_AUDIO_NORMALIZATION,
+    SILENCE_THRESHOLD_DBFS, SILENCE_PAD_MS, TARGET_LOUDNESS_DBFS
+)
+
+
+# Every bundled clip is stored as mono 16-bit little-endian pcm at the playback rate
+BUNDLE_CHANNELS = 1
+BUNDLE_SAMPLE_WIDTH = 2
+
+
+def get_index_path(bundle_path: str) -> str:
+    return f"{os.path.splitext(bundle_path)[0]}.json"
+
+
+def get_processing_params() -> Optional[Dict]:
+    """The silence trim and loudness settings the clips are processed with, a change triggers a rebuild."""
+    if not ENABLE_AUDIO_NORMALIZATION:
+        return None
+    return {"threshold_dbfs": SILENCE_THRESHOLD_DBFS, "pad_ms": SILENCE_PAD_MS, "target_dbfs": TARGET_LOUDNESS_DBFS}
+
+
+def get_bundle_sources(disfluence_folder: str = DISFLUENCE, initial_response_folder: str = INITIAL_RESPONSE, intermediate_response_folder: str = INTERMEDIATE_RESPONSE) -> List[Dict]:
+    """
+    List the pre-recorded clips named in `sound_path.py` together with the size and mtime of their mp3.
+
+    Args:
+        disfluence_folder (str): Path to disfluency audio files.
+        initial_response_folder (str): Path to initial response audio files.
+        intermediate_response_folder (str): Path to intermediate response audio files.
+
+    Returns:
+        List[Dict]: One entry per clip with its `group`, `category`, `text`, `source` path, `mtime_ns` and `size`, missing files are skipped.
+    """
+    clips = [("disfluencies", None, text, os.path.join(disfluence_folder, filename)) for text, filename in disfluencies_data.items()]
+    clips += [("initial_responses", None, text, os.path.join(initial_response_folder, filename)) for text, filename in initial_responses_data.items()]
+    for category, responses in intermediate_responses_data.items():
+        clips += [("intermediate_responses", category, text, os.path.join(intermediate_response_folder, category, filename)) for text, filename in responses.items()]
+
+    sources = []
+    for group, category, text, path in clips:
+        if not os.path.isfile(path):
+            print(f"File {path} not found. Skipping {text}.")
+            continue
+        stat = os.stat(path)
+        sources.append({"group": group, "category": category, "text": text, "source": path, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size})
+    return sources
+
+
+def build_audio_bundle(sources: List[Dict], bundle_path: str = AUDIO_BUNDLE_PATH, sample_rate: int = TTS_SAMPLE_RATE) -> Dict:
+    """
+    Decode every source mp3 once and write them back to back into a single pcm file with a json index.
+
+    With `ENABLE_AUDIO_NORMALIZATION` the silence around every clip is trimmed
+    and its loudness normalized before it is written, so that cost is also
+    only paid when the bundle is built.
+
+    Args:
+        sources (List[Dict]): The clips, as returned by `get_bundle_sources`.
+        bundle_path (str): Path of the pcm file, the index is written next to it.
+        sample_rate (int): Sample rate the clips are resampled to.
+
+    Returns:
+        Dict: The index, with the `offset` and `length` in bytes of every clip.
+    """
+    start_time = time.perf_counter()
+    os.makedirs(os.path.dirname(bundle_path) or ".", exist_ok=True)
+    entries, offset = [], 0
+    temp_path = f"{bundle_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        for source in sources:
+            audio_segment = AudioSegment.from_file(source["source"], format="mp3")
+            audio_segment = audio_segment.set_frame_rate(sample_rate).set_channels(BUNDLE_CHANNELS).set_sample_width(BUNDLE_SAMPLE_WIDTH)
+            if ENABLE_AUDIO_NORMALIZATION:
+                audio_segment, _ = process_segment(audio_segment, source["source"])
+            data = audio_segment.raw_data
+            file.write(data)
+            entries.append({**source, "offset": offset, "length": len(data)})
+            offset += len(data)
+    os.replace(temp_path, bundle_path)
+
+    # The index is replaced last, so a crash mid-build leaves a stale signature and triggers a rebuild
+    index = {"sample_rate": sample_rate, "processing": get_processing_params(), "clips": entries}
+    index_path = get_index_path(bundle_path)
+    with open(f"{index_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as file:
+        json.dump(index, file, indent=1)
+    os.replace(f"{index_path}.{os.getpid()}.tmp", index_path)
+    if ENABLE_TTS_VERBOSITY:
+        print(f"AUDIO BUNDLE: Built {bundle_path} with {len(entries)} clips, {offset} bytes in {time.perf_counter() - start_time:.2f}s")
+    return index
+
+
+def is_bundle_current(index: Optional[Dict], sources: List[Dict], sample_rate: int) -> bool:
+    """Whether `index` was built from exactly `sources`, unchanged since, at `sample_rate` and with the current processing settings."""
+    if not index or index.get("sample_rate") != sample_rate or index.get("processing") != get_processing_params():
+        return False
+    signature = lambda entry: (entry["group"], entry["category"], entry["text"], entry["source"], entry["mtime_ns"], entry["size"])
+    return [signature(entry) for entry in index["clips"]] == [signature(source) for source in sources]
+
+
+
+class AudioBundle:
+    """
+    Read-only view of a pre-decoded pcm bundle of the pre-recorded clips.
+
+    The pcm file is memory-mapped, so loading it costs neither an ffmpeg
+    subprocess per clip nor reading the file up front, only the pages of the
+    clips that are actually sliced out are read.
+
+    Attributes:
+        bundle_path (str): Path of the pcm file.
+        sample_rate (int): Sample rate of every clip.
+        clips (List[Dict]): The index entries of the bundled clips.
+    """
+    def __init__(self, bundle_path: str = AUDIO_BUNDLE_PATH, sample_rate: int = TTS_SAMPLE_RATE, sources: Optional[List[Dict]] = None) -> None:
+        """
+        Open the bundle at `bundle_path`, rebuilding it first if the sources changed since it was built.
+
+        Args:
+            bundle_path (str): Path of the pcm file.
+            sample_rate (int): Sample rate the clips must be stored at.
+            sources (Optional[List[Dict]]): The clips to bundle, defaults to `get_bundle_sources()`.
+        """
+        sources = get_bundle_sources() if sources is None else sources
+        index = None
+        index_path = get_index_path(bundle_path)
+        if os.path.isfile(index_path) and os.path.isfile(bundle_path):
+            with open(index_path, "r", encoding="utf-8") as file:
+                index = json.load(file)
+        if not is_bundle_current(index, sources, sample_rate):
+            index = build_audio_bundle(sources, bundle_path, sample_rate)
+
+        self.bundle_path = bundle_path
+        self.sample_rate = sample_rate
+        self.clips: List[Dict] = index["clips"]
+        self.buffer = None
+        if os.path.getsize(bundle_path):
+            with open(bundle_path, "rb") as file:
+                self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get_pcm(self, clip: Dict) -> memoryview:
+        """A zero-copy view of the samples of `clip`, its pages are only read once they are played."""
+        if self.buffer is None:
+            return memoryview(b"")
+        return memoryview(self.buffer)[clip["offset"]:clip["offset"] + clip["length"]]
+
+    def get_segment(self, clip: Dict) -> AudioSegment:
+        return AudioSegment(data=bytes(self.get_pcm(clip)), sample_width=BUNDLE_SAMPLE_WIDTH, frame_rate=self.sample_rate, channels=BUNDLE_CHANNELS)
+
+    def get_clips(self, group: str) -> List[Tuple[Optional[str], str, "BundleClip"]]:
+        """
+        Return the clips of one group of `sound_path.py`, without reading their samples.
+
+        Args:
+            group (str): `disfluencies`, `initial_responses` or `intermediate_responses`.
+
+        Returns:
+            List[Tuple[Optional[str], str, BundleClip]]: The category, text and a lazy view of the audio of every clip in the group.
+        """
+        return [(clip["category"], clip["text"], BundleClip(self, clip)) for clip in self.clips if clip["group"] == group]
+
+
+
+class BundleClip:
+    """
+    Lazy view of one clip of an `AudioBundle`.
+
+    Attributes:
+        bundle (AudioBundle): The bundle the clip is stored in.
+        entry (Dict): The index entry of the clip.
+    """
+    def __init__(self, bundle: AudioBundle, entry: Dict) -> None:
+        self.bundle = bundle
+        self.entry = entry
+
+    @property
+    def sample_rate(self) -> int:
+        return self.bundle.sample_rate
+
+    @property
+    def pcm(self) -> memoryview:
+        """The mono 16-bit samples, sliced from the mmap without copying."""
+        return self.bundle.get_pcm(self.entry)
+
+    def to_segment(self) -> AudioSegment:
+        """Copy the clip out of the bundle, for playback at a different format."""
+        return self.bundle.get_segment(self.entry)
+
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+    index = build_audio_bundle(get_bundle_sources())
+    total = sum(clip["length"] for clip in index["clips"])
+    print(f"Bundled {len(index['clips'])} clips ({total} bytes of {TTS_SAMPLE_RATE}Hz pcm) into {AUDIO_BUNDLE_PATH} in {time.perf_counter() - start_time:.2f}s")
+
+    start_time = time.perf_counter()
+    AudioBundle()
+    print(f"Loading the bundle takes {(time.perf_counter() - start_time) * 1000:.1f}ms")
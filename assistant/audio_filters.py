@@ -0,0 +1,197 @@
+import numpy as np
+from pydub import AudioSegment
+from typing import Optional, Tuple
+from config import ( ENABLE_TTS_VERBOSITY,
+    SILENCE_THRESHOLD_DBFS, SILENCE_PAD_MS, TARGET_LOUDNESS_DBFS,
+    BARGE_IN_THRESHOLD_DBFS, BARGE_IN_ECHO_MARGIN_DB
+)
+
+
+WINDOW_MS = 10          # Length of the windows levels are measured over
+PEAK_HEADROOM_DB = 1.0  # Normalization never pushes the peak above this far below full scale
+
+
+def to_samples(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.int16)
+
+
+def get_level_dbfs(samples: np.ndarray, full_scale: float = 32768.0) -> float:
+    """Return the RMS level in dBFS of `samples`, `full_scale` is 1 for float samples."""
+    rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64)))) if len(samples) else 0.0
+    return 20 * float(np.log10(rms / full_scale + 1e-10))
+
+
+def get_barge_in_threshold(playback_dbfs: Optional[float], threshold_dbfs: float = BARGE_IN_THRESHOLD_DBFS, margin_db: float = BARGE_IN_ECHO_MARGIN_DB) -> float:
+    """
+    Return the microphone level that counts as the customer talking over the assistant.
+
+    The speaker's echo reaches the microphone at up to the playback level, so
+    while something plays the threshold is raised to `margin_db` above it.
+
+    Args:
+        playback_dbfs (Optional[float]): The level of the recent playback, None if nothing played.
+        threshold_dbfs (float): The threshold while nothing plays.
+        margin_db (float): How much louder than the playback the microphone must be.
+
+    Returns:
+        float: The threshold in dBFS.
+    """
+    if playback_dbfs is None:
+        return threshold_dbfs
+    return max(threshold_dbfs, playback_dbfs + margin_db)
+
+
+def get_window_levels(samples: np.ndarray, window: int) -> np.ndarray:
+    """
+    Return the RMS level in dBFS of every `window` samples, the last partial window is padded with silence.
+
+    Args:
+        samples (np.ndarray): Mono 16-bit samples.
+        window (int): Samples per window.
+
+    Returns:
+        np.ndarray: One level per window.
+    """
+    padded = np.zeros(-(-len(samples) // window) * window, dtype=np.float64)
+    padded[:len(samples)] = samples / 32768.0
+    rms = np.sqrt(np.mean(np.square(padded.reshape(-1, window)), axis=1))
+    return 20 * np.log10(rms + 1e-10)
+
+
+def find_voice_start(samples: np.ndarray, sample_rate: int, threshold_dbfs: float = SILENCE_THRESHOLD_DBFS) -> Optional[int]:
+    """
+    Return the index of the first sample of the first window above `threshold_dbfs`, or None if all of it is silence.
+    """
+    window = max(1, sample_rate * WINDOW_MS // 1000)
+    voiced = np.flatnonzero(get_window_levels(samples, window) >= threshold_dbfs)
+    return int(voiced[0]) * window if len(voiced) else None
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int, threshold_dbfs: float = SILENCE_THRESHOLD_DBFS, pad_ms: int = SILENCE_PAD_MS) -> Tuple[np.ndarray, int, int]:
+    """
+    Cut leading and trailing silence, keeping `pad_ms` around the voiced part so onsets and decays are not clipped.
+
+    Args:
+        samples (np.ndarray): Mono 16-bit samples.
+        sample_rate (int): Sample rate of the samples.
+        threshold_dbfs (float): Windows quieter than this count as silence.
+        pad_ms (int): Silence kept before and after the voiced part.
+
+    Returns:
+        Tuple[np.ndarray, int, int]: The trimmed samples and the milliseconds cut from the start and the end.
+    """
+    window = max(1, sample_rate * WINDOW_MS // 1000)
+    voiced = np.flatnonzero(get_window_levels(samples, window) >= threshold_dbfs)
+    if not len(voiced):
+        return samples, 0, 0
+    pad = sample_rate * pad_ms // 1000
+    start = max(0, int(voiced[0]) * window - pad)
+    end = min(len(samples), (int(voiced[-1]) + 1) * window + pad)
+    to_ms = lambda count: count * 1000 // sample_rate
+    return samples[start:end], to_ms(start), to_ms(len(samples) - end)
+
+
+def get_normalization_gain(samples: np.ndarray, sample_rate: int, target_dbfs: float = TARGET_LOUDNESS_DBFS, threshold_dbfs: float = SILENCE_THRESHOLD_DBFS) -> float:
+    """
+    Return the gain in dB that brings the RMS of the voiced windows to `target_dbfs`, limited so the peak does not clip.
+
+    Args:
+        samples (np.ndarray): Mono 16-bit samples.
+        sample_rate (int): Sample rate of the samples.
+        target_dbfs (float): Loudness to normalize to.
+        threshold_dbfs (float): Windows quieter than this are left out of the loudness measurement.
+
+    Returns:
+        float: The gain, 0 for silent audio.
+    """
+    window = max(1, sample_rate * WINDOW_MS // 1000)
+    levels = get_window_levels(samples, window)
+    voiced = levels[levels >= threshold_dbfs]
+    if not len(voiced):
+        return 0.0
+    loudness = 10 * np.log10(np.mean(np.power(10, voiced / 10)))
+    peak_dbfs = 20 * np.log10(np.max(np.abs(samples.astype(np.int32))) / 32768.0 + 1e-10)
+    return float(min(target_dbfs - loudness, -PEAK_HEADROOM_DB - peak_dbfs))
+
+
+def apply_gain(samples: np.ndarray, gain_db: float) -> np.ndarray:
+    if not gain_db:
+        return samples
+    scaled = samples.astype(np.float32) * np.float32(10 ** (gain_db / 20))
+    return np.clip(scaled, -32768, 32767).astype(np.int16)
+
+
+def process_segment(audio_segment: AudioSegment, label: str = "") -> Tuple[AudioSegment, float]:
+    """
+    Trim the silence around a clip and normalize its loudness to `TARGET_LOUDNESS_DBFS`.
+
+    Args:
+        audio_segment (AudioSegment): The clip, converted to mono 16-bit if needed.
+        label (str): Text shown in the verbose log, e.g. the spoken text.
+
+    Returns:
+        Tuple[AudioSegment, float]: The processed clip and the gain applied in dB.
+    """
+    audio_segment = audio_segment.set_channels(1).set_sample_width(2)
+    samples = to_samples(audio_segment.raw_data)
+    samples, lead_ms, trail_ms = trim_silence(samples, audio_segment.frame_rate)
+    gain_db = get_normalization_gain(samples, audio_segment.frame_rate)
+    samples = apply_gain(samples, gain_db)
+    if ENABLE_TTS_VERBOSITY:
+        print(f"AUDIO: Trimmed {lead_ms}ms leading and {trail_ms}ms trailing silence, gain {gain_db:+.1f}dB ({label})")
+    return AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=audio_segment.frame_rate, channels=1), gain_db
+
+
+
+class PCMStreamFilter:
+    """
+    Trims the leading silence of mono 16-bit pcm arriving in chunks and applies a fixed gain.
+
+    Streamed speech can not be measured as a whole before it plays, so it is
+    leveled with the gain measured on earlier clips of the same voice.
+
+    Attributes:
+        sample_rate (int): Sample rate of the stream.
+        gain_db (float): Gain applied to every sample.
+        trimmed_samples (int): Samples of leading silence dropped so far.
+    """
+    def __init__(self, sample_rate: int, gain_db: float = 0.0, threshold_dbfs: float = SILENCE_THRESHOLD_DBFS, pad_ms: int = SILENCE_PAD_MS) -> None:
+        self.gain_db = gain_db
+        self.sample_rate = sample_rate
+        self.threshold_dbfs = threshold_dbfs
+        self.pad = sample_rate * pad_ms // 1000
+        self.remainder = b""
+        self.trimmed_samples = 0
+        self.pending: Optional[np.ndarray] = np.empty(0, dtype=np.int16)
+
+    @property
+    def trimmed_ms(self) -> int:
+        return self.trimmed_samples * 1000 // self.sample_rate
+
+    def process(self, chunk: bytes) -> bytes:
+        """
+        Filter the next chunk of the stream.
+
+        Args:
+            chunk (bytes): Raw pcm bytes, not necessarily sample aligned.
+
+        Returns:
+            bytes: The samples to play, empty while the stream is still silent.
+        """
+        data = self.remainder + chunk
+        aligned = len(data) - len(data) % 2
+        self.remainder = data[aligned:]
+        samples = to_samples(data[:aligned])
+        if self.pending is not None:
+            samples = np.concatenate([self.pending, samples])
+            start = find_voice_start(samples, self.sample_rate, self.threshold_dbfs)
+            if start is None:
+                keep = len(samples) - max(0, len(samples) - self.pad)
+                self.trimmed_samples += len(samples) - keep
+                self.pending = samples[len(samples) - keep:]
+                return b""
+            start = max(0, start - self.pad)
+            self.trimmed_samples += start
+            self.pending = None
+            samples = samples[start:]
+        return apply_gain(samples, self.gain_db).tobytes()
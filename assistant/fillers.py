@@ -0,0 +1,126 @@
+import time, threading
+from typing import Dict, Optional, Tuple
+from assistant.playback import PlaybackHandle
+from config import ( ENABLE_TTS_VERBOSITY,
+    FILLER_MIN_DELAY_MS, FILLER_LATENCY_FACTOR, FILLER_LATENCY_ALPHA
+)
+
+
+
+class FillerTicket:
+    """
+    One in-flight llm call watched by the `FillerScheduler`.
+
+    Attributes:
+        key (Tuple[str, int]): The model name and the tool call depth of the call.
+        started_at (float): `time.perf_counter()` when the call started.
+        timer (Optional[threading.Timer]): Fires the filler once the call runs too long.
+        handle (Optional[PlaybackHandle]): The handle of the filler, if one was played.
+    """
+    def __init__(self, key: Tuple[str, int]) -> None:
+        self.key = key
+        self.started_at = time.perf_counter()
+        self.lock = threading.Lock()
+        self.finished = False
+        self.timer: Optional[threading.Timer] = None
+        self.handle: Optional[PlaybackHandle] = None
+
+
+
+class FillerScheduler:
+    """
+    Plays a disfluency filler only when an llm call is slower than usual.
+
+    A rolling (exponentially weighted) latency estimate is kept per model and
+    per tool call depth, since the first call of a turn and the calls following
+    tool results have different latencies. Each call arms a timer at
+    `FILLER_LATENCY_FACTOR` times its estimate (never earlier than
+    `FILLER_MIN_DELAY_MS`). If the answer arrives first the timer is cancelled,
+    along with a filler that was queued but has not started playing yet.
+
+    Attributes:
+        audio_manager (AudioManager): Plays the fillers.
+        estimates (Dict[Tuple[str, int], float]): Rolling latency estimate in milliseconds per model and depth.
+    """
+    def __init__(self, audio_manager, min_delay_ms: float = FILLER_MIN_DELAY_MS, latency_factor: float = FILLER_LATENCY_FACTOR, alpha: float = FILLER_LATENCY_ALPHA) -> None:
+        """
+        Initialize the FillerScheduler.
+
+        Args:
+            audio_manager (AudioManager): Plays the fillers.
+            min_delay_ms (float): Never play a filler before a call has been running this long.
+            latency_factor (float): Play one once a call runs this much longer than its estimate.
+            alpha (float): Weight of the newest call in the rolling estimate.
+        """
+        self.alpha = alpha
+        self.min_delay_ms = min_delay_ms
+        self.latency_factor = latency_factor
+        self.audio_manager = audio_manager
+        self.estimates: Dict[Tuple[str, int], float] = {}
+        self.fillers_played = 0
+        self.fillers_cancelled = 0
+
+    def get_delay_ms(self, model_name: str, depth: int) -> float:
+        estimate = self.estimates.get((model_name, depth))
+        if estimate is None:
+            return self.min_delay_ms
+        return max(self.min_delay_ms, estimate * self.latency_factor)
+
+    def start(self, model_name: str, depth: int) -> FillerTicket:
+        """
+        Start watching an llm call.
+
+        Args:
+            model_name (str): The model the call is made to.
+            depth (int): Number of tool call rounds earlier in the same turn.
+
+        Returns:
+            FillerTicket: Pass it to `finish` once the call returned.
+        """
+        ticket = FillerTicket((model_name, depth))
+        ticket.timer = threading.Timer(self.get_delay_ms(model_name, depth) / 1000, self.__fire__, args=(ticket,))
+        ticket.timer.daemon = True
+        ticket.timer.start()
+        return ticket
+
+    def __fire__(self, ticket: FillerTicket):
+        with ticket.lock:
+            # Something else is already audible (e.g. an intermediate response), so there is no dead air to fill
+            if ticket.finished or not self.audio_manager.is_idle():
+                return
+            ticket.handle = self.audio_manager.play_disfluent_filler(delay=0)
+            self.fillers_played += 1
+        if ENABLE_TTS_VERBOSITY:
+            print(f"FILLER: Played after {(time.perf_counter() - ticket.started_at) * 1000:.0f}ms for {ticket.key}")
+
+    def finish(self, ticket: FillerTicket) -> None:
+        """
+        Stop watching an llm call and fold its latency into the estimate.
+
+        Args:
+            ticket (FillerTicket): The ticket returned by `start`.
+        """
+        ticket.timer.cancel()
+        with ticket.lock:
+            ticket.finished = True
+            handle = ticket.handle
+        if handle is not None and not handle.started():
+            handle.cancel()
+            self.fillers_cancelled += 1
+
+        latency = (time.perf_counter() - ticket.started_at) * 1000
+        estimate = self.estimates.get(ticket.key)
+        self.estimates[ticket.key] = latency if estimate is None else self.alpha * latency + (1 - self.alpha) * estimate
+
+    def stats(self) -> Dict:
+        """
+        Return the latency estimates and how many fillers were played and cancelled.
+
+        Returns:
+            Dict: `estimates_ms` per `model:depth`, `fillers_played` and `fillers_cancelled`.
+        """
+        return {
+            "estimates_ms": {f"{model}:{depth}": estimate for (model, depth), estimate in self.estimates.items()},
+            "fillers_played": self.fillers_played,
+            "fillers_cancelled": self.fillers_cancelled,
+        }
@@ -0,0 +1,126 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+
+CHARS_PER_TOKEN = 4         # Rough ratio for english text, only used when the provider reports no usage
+MESSAGE_OVERHEAD_TOKENS = 4 # Role and separator tokens the chat format adds per message
+SUMMARY_NAME = "cart_state" # Marks the summary message that replaces compacted turns
+
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """Estimate the prompt tokens of `messages` from their length, including the arguments of tool calls."""
+    chars = 0
+    for message in messages:
+        chars += len(message.content) if isinstance(message.content, str) else len(json.dumps(message.content))
+        if isinstance(message, AIMessage) and message.tool_calls:
+            chars += len(json.dumps([[tool_call["name"], tool_call["args"]] for tool_call in message.tool_calls]))
+    return chars // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS * len(messages)
+
+
+def get_input_tokens(response: AIMessage) -> Optional[int]:
+    """The prompt tokens of the call that produced `response` as reported by the provider, None if it reported none."""
+    usage = getattr(response, "usage_metadata", None)
+    return usage.get("input_tokens") if usage else None
+
+
+def get_cached_tokens(response: AIMessage) -> Optional[int]:
+    """The prompt tokens of the call that produced `response` served from the provider's prompt cache, None if it reported none."""
+    # langchain-core 0.2 has no field for cache reads, the raw openai usage is the only place they are reported
+    token_usage = response.response_metadata.get("token_usage") or {}
+    return (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+
+
+def is_summary(message: BaseMessage) -> bool:
+    return isinstance(message, SystemMessage) and message.name == SUMMARY_NAME
+
+
+def compact_history(messages: List[BaseMessage], token_budget: int, cart_state: str, prefix_len: int = 1) -> Tuple[List[BaseMessage], int]:
+    """
+    Replace the oldest turns by a summary of the cart once the history exceeds `token_budget`.
+
+    A turn starts at a customer message and holds the model responses and
+    tool results that followed it, so tool calls are never separated from
+    their results. The newest turns that fit into half of the budget are
+    kept (always at least the last one), so the history is not compacted
+    again on the very next turn.
+
+    Args:
+        messages (List[BaseMessage]): The history, starting with the stable prompt prefix.
+        token_budget (int): Estimated prompt tokens the history may grow to.
+        cart_state (str): The current cart, as returned by `OrderCart.get_cart_state`.
+        prefix_len (int): Number of leading messages that form the prefix, they are always kept unchanged.
+
+    Returns:
+        Tuple[List[BaseMessage], int]: The history to continue with and the number of turns removed.
+    """
+    if estimate_tokens(messages) <= token_budget:
+        return messages, 0
+    starts = [index for index, message in enumerate(messages) if index >= prefix_len and isinstance(message, HumanMessage)]
+    if len(starts) < 2:
+        return messages, 0
+
+    cut = starts[-1]
+    for start in starts[1:]:
+        if estimate_tokens(messages[start:]) <= token_budget // 2:
+            cut = start
+            break
+    removed = [message for message in messages[prefix_len:cut] if not is_summary(message)]
+    turns = sum(isinstance(message, HumanMessage) for message in removed)
+    summary = SystemMessage(
+        name=SUMMARY_NAME,
+        content=f"Earlier turns of this conversation were removed to save space. The customer's cart currently holds: {cart_state}. Continue taking the order from there."
+    )
+    return [*messages[:prefix_len], summary, *messages[cut:]], turns
+
+
+
+class StreamUsageTap:
+    """
+    Wraps the openai chat completions client of a `ChatOpenAI` to keep the raw usage of the last streamed call.
+
+    With `stream_usage` langchain-openai turns the final usage chunk of a stream
+    into `usage_metadata`, but only keeps the input, output and total counts.
+    The tap keeps the whole usage, including `prompt_tokens_details.cached_tokens`,
+    so it can be attached to the aggregated response like that of an `invoke`.
+
+    Attributes:
+        client (Any): The wrapped `client.chat.completions`.
+        usage (Optional[Dict]): The usage of the last stream that reported one.
+    """
+    def __init__(self, client: Any) -> None:
+        self.client = client
+        self.usage: Optional[Dict] = None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def create(self, **payload) -> Any:
+        response = self.client.create(**payload)
+        return TappedStream(response, self) if payload.get("stream") else response
+
+    def pop_usage(self) -> Optional[Dict]:
+        usage, self.usage = self.usage, None
+        return usage
+
+
+
+class TappedStream:
+    """An openai stream that hands the usage of its final chunk to a `StreamUsageTap`."""
+    def __init__(self, stream: Any, tap: StreamUsageTap) -> None:
+        self.stream = stream
+        self.tap = tap
+
+    def __enter__(self) -> "TappedStream":
+        self.stream.__enter__()
+        return self
+
+    def __exit__(self, *args) -> Any:
+        return self.stream.__exit__(*args)
+
+    def __iter__(self):
+        for chunk in self.stream:
+            usage = getattr(chunk, "usage", None)
+            if usage:
+                self.tap.usage = usage.model_dump() if hasattr(usage, "model_dump") else dict(usage)
+            yield chunk
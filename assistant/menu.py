@@ -1,9 +1,17 @@
-import yaml
+import yaml, hashlib, threading
 from typing import List, Optional
 from web_builder.builder import display
 from assistant.agent import AudioManager
 from config import ENABLE_TOOL_VERBOSITY, ENABLE_TTS_VERBOSITY
-from assistant.utils import Item, Order, Menu, StreamData, Message
+from assistant.utils import Item, Order, Menu, StreamData, Message, CartOperation
+
+
+# Pre-recorded cue played for a batch cart update, by the action of its first operation
+CART_OPERATION_CUES = {
+    "add": "add_item_to_cart",
+    "remove": "remove_item_from_cart",
+    "set_quantity": "modify_item_quantity_in_cart",
+}
 
 
 
@@ -21,6 +29,10 @@ class KFCMenu:
             Menu(menu_type="main_dishes", items=self.main_dishes),
             Menu(menu_type="side_dishes", items=self.side_dishes),
         ]
+        self.update_menu_version()
+        # Tool calls of one model response may run concurrently, every read and change of the cart state holds this.
+        # `display` is also requested under it, so the renderer receives the snapshots in the order the cart changed
+        self.lock = threading.RLock()
         self.action = None
         self.is_started = False
         self.stream_messages = []
@@ -29,9 +41,15 @@ class KFCMenu:
     def update_audio_manager(self, audio_manager):
         self.audio_manager = audio_manager
         
+    def update_menu_version(self):
+        """Recompute the content hash of the menu, call after changing `self.menu`."""
+        menu_dump = "".join(menu.model_dump_json() for menu in self.menu)
+        self.menu_version = hashlib.sha1(menu_dump.encode("utf-8")).hexdigest()[:12]
+        
     def get_view_data(self) -> StreamData:
         view_data = StreamData(
             menu=self.menu,
+            menu_version=self.menu_version,
             cart=self.orders,
             action=self.action,
             is_started=self.is_started,
@@ -46,39 +64,36 @@ class KFCMenu:
         return self.get_view_data()
         
     def show_main_dishes(self) -> bool:
-        self.action = "show_main_dishes"
-        
         if self.audio_manager:
-            self.audio_manager.play_intermediate_response(self.action)
-        view_data = self.get_view_data()
-        display(view_data)
-        
-        if ENABLE_TOOL_VERBOSITY:
-            print(f"TOOL '{self.action}' Invoked")
+            self.audio_manager.play_intermediate_response("show_main_dishes")
+        with self.lock:
+            self.action = "show_main_dishes"
+            view_data = self.get_view_data()
+            display(view_data)
+            if ENABLE_TOOL_VERBOSITY:
+                print(f"TOOL '{self.action}' Invoked")
         return True
 
     def show_side_dishes(self) -> bool:
-        self.action = "show_side_dishes"
-        
         if self.audio_manager:
-            self.audio_manager.play_intermediate_response(self.action)
-        view_data = self.get_view_data()
-        display(view_data)
-        
-        if ENABLE_TOOL_VERBOSITY:
-            print(f"TOOL '{self.action}' Invoked")
+            self.audio_manager.play_intermediate_response("show_side_dishes")
+        with self.lock:
+            self.action = "show_side_dishes"
+            view_data = self.get_view_data()
+            display(view_data)
+            if ENABLE_TOOL_VERBOSITY:
+                print(f"TOOL '{self.action}' Invoked")
         return True
 
     def show_beverages(self) -> bool:
-        self.action = "show_beverages"
-        
         if self.audio_manager:
-            self.audio_manager.play_intermediate_response(self.action)
-        view_data = self.get_view_data()
-        display(view_data)
-        
-        if ENABLE_TOOL_VERBOSITY:
-            print(f"TOOL '{self.action}' Invoked")
+            self.audio_manager.play_intermediate_response("show_beverages")
+        with self.lock:
+            self.action = "show_beverages"
+            view_data = self.get_view_data()
+            display(view_data)
+            if ENABLE_TOOL_VERBOSITY:
+                print(f"TOOL '{self.action}' Invoked")
         return True
     
     def get_item_by_name(self, name: str) -> Optional[Item]:
@@ -102,129 +117,210 @@ class OrderCart(KFCMenu):
             return yaml.dump({"error": "Item not found from the menu. Please try with a valid name from the available menu items."})
         result = dict(name=item.name, total_quantity=quantity, price_per_unit=f"${item.price_per_unit}")
 
-        for i, order in enumerate(self.orders):
-            if order.name == item_name:
-                self.orders[i].total_quantity += quantity
-                # self.orders[i].image_url_path = item.image_url_path
-                result['total_quantity'] = self.orders[i].total_quantity
-                result['price_per_unit'] = f"${order.price_per_unit}"
-                is_new = False
-                break
-       
-        if is_new:
-            self.orders.append(Order(
-                name=item_name, 
-                total_quantity=quantity,
-                price_per_unit=item.price_per_unit, 
-                image_url_path=item.image_url_path
-            ))
+        with self.lock:
+            for i, order in enumerate(self.orders):
+                if order.name == item_name:
+                    self.orders[i].total_quantity += quantity
+                    # self.orders[i].image_url_path = item.image_url_path
+                    result['total_quantity'] = self.orders[i].total_quantity
+                    result['price_per_unit'] = f"${order.price_per_unit}"
+                    is_new = False
+                    break
+           
+            if is_new:
+                self.orders.append(Order(
+                    name=item_name, 
+                    total_quantity=quantity,
+                    price_per_unit=item.price_per_unit, 
+                    image_url_path=item.image_url_path
+                ))
+            self.action = "add_item_to_cart"
+            view_data = self.get_view_data()
+            display(view_data)
         
-        self.action = "add_item_to_cart"
         if self.audio_manager:
-            self.audio_manager.play_intermediate_response(self.action)
-        view_data = self.get_view_data()
-        display(view_data)
+            self.audio_manager.play_intermediate_response("add_item_to_cart")
         
         if ENABLE_TOOL_VERBOSITY:
-            print(f"TOOL '{self.action}': {yaml.dump(result)}")
+            print(f"TOOL 'add_item_to_cart': {yaml.dump(result)}")
             
         return yaml.dump(result)
 
     def remove_item_from_cart(self, item_name: str, quantity: int = 1, remove_all: bool = False) -> str:
         result = dict(name=item_name, action="not_found")
-        for i, order in enumerate(self.orders):
-            if order.name == item_name:
-                if (order.total_quantity <= quantity) or remove_all:
-                    self.orders.pop(i)
-                    result['action'] = "fully_removed"
-                else:
-                    self.orders[i].total_quantity -= quantity
-                    result['action'] = "partially_removed"
-                    result['remaining_quantity'] = self.orders[i].total_quantity
-                break
+        with self.lock:
+            for i, order in enumerate(self.orders):
+                if order.name == item_name:
+                    if (order.total_quantity <= quantity) or remove_all:
+                        self.orders.pop(i)
+                        result['action'] = "fully_removed"
+                    else:
+                        self.orders[i].total_quantity -= quantity
+                        result['action'] = "partially_removed"
+                        result['remaining_quantity'] = self.orders[i].total_quantity
+                    break
+            self.action = "remove_item_from_cart"
+            view_data = self.get_view_data()
+            display(view_data)
             
-        self.action = "remove_item_from_cart"
         if self.audio_manager:
-            self.audio_manager.play_intermediate_response(self.action)
-        view_data = self.get_view_data()
-        display(view_data)
+            self.audio_manager.play_intermediate_response("remove_item_from_cart")
         
         if ENABLE_TOOL_VERBOSITY:
-            print(f"TOOL '{self.action}': {yaml.dump(result)}")
+            print(f"TOOL 'remove_item_from_cart': {yaml.dump(result)}")
             
         return yaml.dump(result)
 
     def modify_item_quantity_in_cart(self, item_name: str, new_quantity: int) -> str:
         result = dict(name=item_name, action="not_found")
-        for order in self.orders:
-            if order.name == item_name:
-                if new_quantity <= 0:
-                    self.orders.remove(order)
-                    result['action'] = "removed"
-                else:
-                    order.total_quantity = new_quantity
-                    result['action'] = "updated"
-                    result['new_quantity'] = new_quantity
-                break
+        with self.lock:
+            for order in self.orders:
+                if order.name == item_name:
+                    if new_quantity <= 0:
+                        self.orders.remove(order)
+                        result['action'] = "removed"
+                    else:
+                        order.total_quantity = new_quantity
+                        result['action'] = "updated"
+                        result['new_quantity'] = new_quantity
+                    break
+            self.action = "modify_item_quantity_in_cart"
+            view_data = self.get_view_data()
+            display(view_data)
             
-        self.action = "modify_item_quantity_in_cart"
         if self.audio_manager:
-            self.audio_manager.play_intermediate_response(self.action)
-        view_data = self.get_view_data()
-        display(view_data)
+            self.audio_manager.play_intermediate_response("modify_item_quantity_in_cart")
         
         if ENABLE_TOOL_VERBOSITY:
-            print(f"TOOL '{self.action}': {yaml.dump(result)}")
+            print(f"TOOL 'modify_item_quantity_in_cart': {yaml.dump(result)}")
         
         return yaml.dump(result)
 
-    def confirm_order(self) -> str:
-        confirmation = {
-            "status": "confirmed",
-            "message": "Your order has been confirmed.",
-            "items": [{"name": order.name, "quantity": order.total_quantity} for order in self.orders]
-        }
-        
-        self.action = "confirm_order"
+    def apply_cart_operations(self, operations: List[CartOperation]) -> str:
+        """
+        Apply several add, remove and set-quantity operations to the cart at once.
+
+        The operations are applied in order to a copy of the cart, which only
+        replaces the cart if all of them are valid, so a failing batch leaves
+        the cart untouched. The view is rendered and an audio cue is played
+        once for the whole batch.
+
+        Args:
+            operations (List[CartOperation]): The operations to apply.
+
+        Returns:
+            str: The resulting cart lines and total price, or the invalid operations if nothing was applied.
+        """
+        operations = [CartOperation.model_validate(operation) for operation in operations]
+        errors = []
+        for operation in operations:
+            if self.get_item_by_name(operation.item_name) is None:
+                errors.append({"item_name": operation.item_name, "error": "Item not found from the menu."})
+            elif operation.quantity < 0 or (operation.action != "set_quantity" and operation.quantity == 0):
+                errors.append({"item_name": operation.item_name, "error": f"Invalid quantity {operation.quantity}."})
+        if not operations or errors:
+            return yaml.dump({"status": "not_applied", "errors": errors or [{"error": "No operations given."}]})
+
+        not_in_cart = []
+        with self.lock:
+            orders = [order.model_copy() for order in self.orders]
+            for operation in operations:
+                order = next((order for order in orders if order.name == operation.item_name), None)
+                if operation.action == "add":
+                    if order is None:
+                        item = self.get_item_by_name(operation.item_name)
+                        orders.append(Order(name=item.name, total_quantity=0, price_per_unit=item.price_per_unit, image_url_path=item.image_url_path))
+                        order = orders[-1]
+                    order.total_quantity += operation.quantity
+                elif order is None:
+                    if operation.action == "remove" or operation.quantity == 0:
+                        not_in_cart.append(operation.item_name)
+                        continue
+                    item = self.get_item_by_name(operation.item_name)
+                    orders.append(Order(name=item.name, total_quantity=operation.quantity, price_per_unit=item.price_per_unit, image_url_path=item.image_url_path))
+                elif operation.action == "remove":
+                    order.total_quantity -= min(operation.quantity, order.total_quantity)
+                else:
+                    order.total_quantity = operation.quantity
+                orders = [order for order in orders if order.total_quantity > 0]
+            self.orders = orders
+            self.action = "update_cart"
+            view_data = self.get_view_data()
+            display(view_data)
+
         if self.audio_manager:
-            self.audio_manager.play_intermediate_response(self.action)
-        view_data = self.get_view_data()
-        display(view_data)
-       
+            self.audio_manager.play_intermediate_response(CART_OPERATION_CUES[operations[0].action])
+
+        result = {
+            "status": "applied",
+            "cart": [{"name": order.name, "quantity": order.total_quantity} for order in orders],
+            "total_price": f"${view_data.total_price:.2f}",
+        }
+        if not_in_cart:
+            result["not_in_cart"] = not_in_cart
         if ENABLE_TOOL_VERBOSITY:
-            print(f"TOOL '{self.action}': {yaml.dump(confirmation)}")
-        
-        self.reset_cart()
+            print(f"TOOL 'update_cart': {yaml.dump(result)}")
+        return yaml.dump(result)
+
+    def confirm_order(self) -> str:
+        with self.lock:
+            confirmation = {
+                "status": "confirmed",
+                "message": "Your order has been confirmed.",
+                "items": [{"name": order.name, "quantity": order.total_quantity} for order in self.orders]
+            }
+            self.action = "confirm_order"
+            view_data = self.get_view_data()
+            display(view_data)
+            
+            if self.audio_manager:
+                self.audio_manager.play_intermediate_response(self.action)
+           
+            if ENABLE_TOOL_VERBOSITY:
+                print(f"TOOL '{self.action}': {yaml.dump(confirmation)}")
+            
+            self.reset_cart()
         return yaml.dump(confirmation)
 
     def get_cart_contents(self) -> str:
         contents = []
         total_price = 0
-        for order in self.orders:
-            total = order.total_quantity * order.price_per_unit
-            total_price += total
-            contents.append({"name": order.name, "quantity": order.total_quantity, "price": total})
+        with self.lock:
+            for order in self.orders:
+                total = order.total_quantity * order.price_per_unit
+                total_price += total
+                contents.append({"name": order.name, "quantity": order.total_quantity, "price": total})
+            self.action = "get_cart_contents"
+            view_data = self.get_view_data()
+            display(view_data)
             
-        self.action = "get_cart_contents"
         if self.audio_manager:
-            self.audio_manager.play_intermediate_response(self.action)
-        view_data = self.get_view_data()
-        display(view_data)
+            self.audio_manager.play_intermediate_response("get_cart_contents")
         
         if ENABLE_TOOL_VERBOSITY:
-            print(f"TOOL '{self.action}': {yaml.dump(contents)}\n\nTotal Price of items: ${total_price}")  
+            print(f"TOOL 'get_cart_contents': {yaml.dump(contents)}\n\nTotal Price of items: ${total_price}")  
             
         if contents:
             return f"{yaml.dump(contents)}\n\nTotal Price of items: ${total_price}"
         return "The cart is currently empty."
 
+    def get_cart_state(self) -> str:
+        """A one-line description of the cart for the agent's history, without rendering or playing anything."""
+        with self.lock:
+            if not self.orders:
+                return "nothing yet"
+            lines = ", ".join(f"{order.total_quantity} x {order.name}" for order in self.orders)
+            total_price = sum(order.total_quantity * order.price_per_unit for order in self.orders)
+        return f"{lines} (total ${total_price:.2f})"
+
     def reset_cart(self) -> None:
-        self.action = None
-        self.is_started = False
-        self.stream_messages = []
-        self.orders: List[Order] = []
-        view_data = self.get_view_data()
-        display(view_data)
+        with self.lock:
+            self.action = None
+            self.is_started = False
+            self.stream_messages = []
+            self.orders: List[Order] = []
+            view_data = self.get_view_data()
+            display(view_data)
 
         
 class SingletonMeta(type):
@@ -0,0 +1,403 @@
+import time, queue, threading
+import numpy as np
+import sounddevice as sd
+from concurrent.futures import Future
+from collections import deque
+from pydub import AudioSegment
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple, Union
+from assistant.audio_filters import get_level_dbfs
+from config import ENABLE_TTS_VERBOSITY, TTS_SAMPLE_RATE, PLAYBACK_BLOCK_SIZE, BARGE_IN_ECHO_WINDOW_MS
+
+
+
+class PCMStream:
+    """
+    PCM audio that is still arriving, queued for playback like a finished clip.
+
+    The producer `feed`s raw little-endian 16-bit bytes as they come off the
+    network and calls `close` at the end. The playback worker iterates the
+    stream, receiving whole samples as soon as they are available, so playback
+    starts with the first chunk instead of after the last one.
+
+    Attributes:
+        sample_rate (int): Sample rate of the audio.
+        channels (int): Number of interleaved channels.
+        sample_width (int): Bytes per sample.
+        created_at (float): `time.perf_counter()` when the stream was requested.
+        first_byte_at (Optional[float]): When the first bytes arrived.
+        first_sound_at (Optional[float]): When the first samples were handed to the audio device.
+    """
+    def __init__(self, sample_rate: int, channels: int = 1, sample_width: int = 2, label: str = "") -> None:
+        """
+        Initialize an empty PCMStream.
+
+        Args:
+            sample_rate (int): Sample rate of the audio.
+            channels (int): Number of interleaved channels.
+            sample_width (int): Bytes per sample.
+            label (str): Text shown in verbose timing logs, e.g. the spoken text.
+        """
+        self.label = label
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.remainder = b""
+        self.closed = False
+        self.received_bytes = 0
+        self.chunks = queue.Queue()
+        self.created_at = time.perf_counter()
+        self.first_byte_at: Optional[float] = None
+        self.first_sound_at: Optional[float] = None
+
+    @property
+    def frame_size(self) -> int:
+        return self.sample_width * self.channels
+
+    def feed(self, data: bytes) -> None:
+        """
+        Append raw bytes, forwarding every complete frame to the player.
+
+        Args:
+            data (bytes): The next chunk of raw PCM bytes, not necessarily frame aligned.
+        """
+        if not data:
+            return
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+        data = self.remainder + data
+        aligned = len(data) - len(data) % self.frame_size
+        self.remainder = data[aligned:]
+        if aligned:
+            self.received_bytes += aligned
+            self.chunks.put(data[:aligned])
+
+    def close(self) -> None:
+        """Mark the end of the stream, any incomplete trailing frame is dropped."""
+        self.remainder = b""
+        self.closed = True
+        self.chunks.put(None)
+
+    def mark_first_sound(self) -> None:
+        if self.first_sound_at is None:
+            self.first_sound_at = time.perf_counter()
+            if ENABLE_TTS_VERBOSITY:
+                print(f"TTS Time to First Byte (TTFB): {self.ttfb_ms}ms, Time to First Sound: {self.ttfs_ms}ms ({self.label})")
+
+    @property
+    def ttfb_ms(self) -> Optional[int]:
+        if self.first_byte_at is None:
+            return None
+        return int((self.first_byte_at - self.created_at) * 1000)
+
+    @property
+    def ttfs_ms(self) -> Optional[int]:
+        if self.first_sound_at is None:
+            return None
+        return int((self.first_sound_at - self.created_at) * 1000)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            yield chunk
+
+
+
+class PlaybackClip:
+    """
+    One queued clip of PCM audio at the playback engine's format.
+
+    Attributes:
+        source (Union[bytes, memoryview, PCMStream]): The samples, complete or still arriving.
+        lead_bytes (int): Bytes of silence played before the clip, from the requested delay.
+        lead_seconds (float): The requested delay.
+        label (str): Text shown in verbose timing logs.
+        enqueued_at (float): `time.perf_counter()` when the clip was created.
+        first_sample_at (Optional[float]): When the first sample was written to the output stream.
+        finished_at (Optional[float]): When the last sample was written to the output stream.
+        output_latency (float): Seconds a written sample takes to reach the speaker.
+        future (Future): Resolves to True once the clip was played, or False if it was cancelled.
+        cancel_event (threading.Event): Set to stop the clip at the next block.
+    """
+    def __init__(self, source: Union[bytes, memoryview, PCMStream], lead_bytes: int = 0, lead_seconds: float = 0, label: str = "") -> None:
+        self.source = source
+        self.lead_bytes = lead_bytes
+        self.lead_seconds = lead_seconds
+        self.label = label
+        self.enqueued_at = time.perf_counter()
+        self.first_sample_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.output_latency = 0.0
+        self.future = Future()
+        self.cancel_event = threading.Event()
+
+    @property
+    def latency_ms(self) -> Optional[int]:
+        """Milliseconds from enqueueing to the first sample, excluding the requested lead silence."""
+        if self.first_sample_at is None:
+            return None
+        return int((self.first_sample_at - self.enqueued_at - self.lead_seconds) * 1000)
+
+
+
+class PlaybackHandle:
+    """
+    Handle to a queued clip, returned by every enqueue on `AudioManager`.
+
+    Instead of blocking on the whole playback queue, callers can wait for this
+    clip only, wait until it is about to end (e.g. to reopen the microphone a
+    bit before the audio stops), attach a completion callback or cancel it.
+    `future` can be awaited from asyncio code through `asyncio.wrap_future`.
+
+    Attributes:
+        clip (PlaybackClip): The queued clip.
+        sample_rate (int): Sample rate of the clip.
+        frame_size (int): Bytes per frame of the clip.
+    """
+    def __init__(self, clip: PlaybackClip, sample_rate: int, frame_size: int) -> None:
+        self.clip = clip
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+
+    @property
+    def future(self) -> Future:
+        return self.clip.future
+
+    @property
+    def label(self) -> str:
+        return self.clip.label
+
+    @property
+    def audio_duration(self) -> float:
+        """Seconds of audio in the clip, a lower bound while a streamed clip is still downloading."""
+        source = self.clip.source
+        size = source.received_bytes if isinstance(source, PCMStream) else len(source)
+        return size / self.frame_size / self.sample_rate
+
+    @property
+    def duration(self) -> float:
+        """Estimated seconds the clip plays for, including its lead silence."""
+        return self.clip.lead_seconds + self.audio_duration
+
+    @property
+    def is_duration_final(self) -> bool:
+        return not isinstance(self.clip.source, PCMStream) or self.clip.source.closed
+
+    def remaining(self) -> Optional[float]:
+        """
+        Estimate the seconds until the last sample of the clip leaves the speaker.
+
+        Returns:
+            Optional[float]: The estimate, 0 once the clip ended, or None while it has not started or is still downloading.
+        """
+        if self.done():
+            return 0.0
+        if self.clip.first_sample_at is None or not self.is_duration_final:
+            return None
+        end_at = self.clip.first_sample_at + self.audio_duration + self.clip.output_latency
+        return max(0.0, end_at - time.perf_counter())
+
+    def done(self) -> bool:
+        return self.clip.future.done()
+
+    def started(self) -> bool:
+        return self.clip.first_sample_at is not None
+
+    def cancelled(self) -> bool:
+        return self.clip.cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """Stop the clip at the next block if it is playing, or skip it if it has not started."""
+        self.clip.cancel_event.set()
+
+    def add_done_callback(self, callback: Callable[["PlaybackHandle"], None]) -> None:
+        self.clip.future.add_done_callback(lambda _: callback(self))
+
+    def wait(self, timeout: Optional[float] = None, remaining: float = 0) -> bool:
+        """
+        Block until the clip has at most `remaining` seconds left to play, or has ended or been cancelled.
+
+        Args:
+            timeout (Optional[float]): Maximum seconds to wait, None waits indefinitely.
+            remaining (float): Seconds before the estimated end at which to return.
+
+        Returns:
+            bool: Whether the condition was reached before the timeout.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.done():
+            left = self.remaining()
+            if left is not None and left <= remaining:
+                return True
+            step = 0.05 if left is None else left - remaining
+            if deadline is not None:
+                step = min(step, deadline - time.perf_counter())
+                if step <= 0:
+                    return False
+            try:
+                self.clip.future.result(timeout=step)
+            except Exception:
+                pass
+        return True
+
+
+
+class PlaybackEngine:
+    """
+    Plays queued clips back to back through one persistent output stream.
+
+    Opening an output stream (or spawning a player process) per clip costs
+    tens of milliseconds and leaves audible gaps between clips, so the engine
+    keeps a single raw output stream open for its lifetime. A worker thread
+    takes `PlaybackClip`s off `clips` and writes them in fixed size blocks,
+    writing silence while idle so the device stays primed and the next clip
+    starts with the next block.
+
+    Attributes:
+        clips (queue.Queue): Queue of `PlaybackClip`s, `task_done` is called once a clip has been played.
+        sample_rate (int): Sample rate of the output stream.
+        channels (int): Number of output channels.
+        block_size (int): Frames written per block.
+        history (Deque[PlaybackClip]): The most recently played clips.
+        output_levels (Deque[Tuple[float, float]]): `time.perf_counter()` and level in dBFS of the recently written clip blocks.
+    """
+    def __init__(self, clips: queue.Queue, sample_rate: int = TTS_SAMPLE_RATE, channels: int = 1, block_size: int = PLAYBACK_BLOCK_SIZE) -> None:
+        """
+        Initialize the PlaybackEngine, call `start` to open the output stream.
+
+        Args:
+            clips (queue.Queue): Queue the clips to play are put on.
+            sample_rate (int): Sample rate of the output stream.
+            channels (int): Number of output channels.
+            block_size (int): Frames written per block.
+        """
+        self.clips = clips
+        self.channels = channels
+        self.block_size = block_size
+        self.sample_rate = sample_rate
+        self.frame_size = 2 * channels
+        self.silence = bytes(block_size * self.frame_size)
+        self.history: Deque[PlaybackClip] = deque(maxlen=100)
+        self.output_levels: Deque[Tuple[float, float]] = deque(maxlen=max(1, BARGE_IN_ECHO_WINDOW_MS * sample_rate // (1000 * block_size) + 1))
+        self.current_clip: Optional[PlaybackClip] = None
+        self.thread = threading.Thread(target=self.__worker__, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def create_clip(self, audio: Union[AudioSegment, bytes, memoryview, PCMStream], delay: Optional[float] = None, label: str = "") -> PlaybackClip:
+        """
+        Convert audio to the output format and wrap it in a clip ready to be queued.
+
+        Args:
+            audio (Union[AudioSegment, bytes, memoryview, PCMStream]): The audio, raw pcm and a PCMStream must already be at the output format.
+            delay (Optional[float]): Seconds of silence played before the audio.
+            label (str): Text shown in verbose timing logs.
+
+        Returns:
+            PlaybackClip: The clip.
+        """
+        if isinstance(audio, AudioSegment):
+            audio = audio.set_frame_rate(self.sample_rate).set_channels(self.channels).set_sample_width(2).raw_data
+        elif isinstance(audio, PCMStream) and not label:
+            label = audio.label
+        lead_bytes = int((delay or 0) * self.sample_rate) * self.frame_size
+        return PlaybackClip(audio, lead_bytes, delay or 0, label)
+
+    def __worker__(self):
+        while True:
+            try:
+                with sd.RawOutputStream(samplerate=self.sample_rate, channels=self.channels, dtype="int16", blocksize=self.block_size, latency="low") as output:
+                    while True:
+                        try:
+                            clip = self.clips.get(timeout=self.block_size / self.sample_rate)
+                        except queue.Empty:
+                            output.write(self.silence)
+                            continue
+                        self.current_clip = clip
+                        played = False
+                        try:
+                            clip.output_latency = output.latency
+                            played = self.__play_clip__(output, clip)
+                        finally:
+                            # The queue is marked done first, so whoever waits on the future also sees an idle queue
+                            self.current_clip = None
+                            self.clips.task_done()
+                            if not clip.future.done():
+                                clip.future.set_result(played)
+            except Exception as e:
+                if ENABLE_TTS_VERBOSITY:
+                    print(f"PLAYBACK: Output stream failed, dropping queued clips: {e}")
+                self.flush()
+                time.sleep(1)
+
+    def flush(self) -> int:
+        """
+        Drop every clip still waiting in the queue, their futures resolve to False.
+
+        Returns:
+            int: The number of clips dropped.
+        """
+        dropped = 0
+        while True:
+            try:
+                clip = self.clips.get_nowait()
+            except queue.Empty:
+                return dropped
+            clip.cancel_event.set()
+            self.clips.task_done()
+            clip.future.set_result(False)
+            dropped += 1
+
+    def cancel_current(self) -> bool:
+        """Stop the clip that is playing at its next block, returns whether one was playing."""
+        clip = self.current_clip
+        if clip is not None:
+            clip.cancel_event.set()
+        return clip is not None
+
+    def __play_clip__(self, output: sd.RawOutputStream, clip: PlaybackClip) -> bool:
+        """Write the clip block by block, returns whether it played to the end."""
+        block_bytes = len(self.silence)
+        for start in range(0, clip.lead_bytes, block_bytes):
+            if clip.cancel_event.is_set():
+                return False
+            output.write(bytes(min(block_bytes, clip.lead_bytes - start)))
+
+        chunks = clip.source if isinstance(clip.source, PCMStream) else [clip.source]
+        for chunk in chunks:
+            view = memoryview(chunk)
+            for start in range(0, len(view), block_bytes):
+                if clip.cancel_event.is_set():
+                    return False
+                if clip.first_sample_at is None:
+                    clip.first_sample_at = time.perf_counter()
+                    if isinstance(clip.source, PCMStream):
+                        clip.source.mark_first_sound()
+                    if ENABLE_TTS_VERBOSITY:
+                        print(f"PLAYBACK: Enqueue to first sample {clip.latency_ms}ms ({clip.label})")
+                block = view[start:start + block_bytes]
+                self.output_levels.append((time.perf_counter(), get_level_dbfs(np.frombuffer(block[:len(block) // 2 * 2], dtype=np.int16))))
+                output.write(block)
+        clip.finished_at = time.perf_counter()
+        self.history.append(clip)
+        return True
+
+    def get_output_level(self, window_ms: int = BARGE_IN_ECHO_WINDOW_MS) -> Optional[float]:
+        """Return the loudest level in dBFS written within the last `window_ms`, None if nothing played since."""
+        since = time.perf_counter() - window_ms / 1000
+        levels = [level for written_at, level in list(self.output_levels) if written_at >= since]
+        return max(levels) if levels else None
+
+    def create_handle(self, clip: PlaybackClip) -> PlaybackHandle:
+        return PlaybackHandle(clip, self.sample_rate, self.frame_size)
+
+    def get_latencies(self) -> List[Dict[str, Optional[int]]]:
+        """
+        Return the enqueue to first sample latency of the most recently played clips.
+
+        Returns:
+            List[Dict[str, Optional[int]]]: Per clip, its label and latency in milliseconds.
+        """
+        return [{"label": clip.label, "latency_ms": clip.latency_ms} for clip in self.history]
@@ -0,0 +1,265 @@
+import re, time
+from collections import deque
+from assistant.utils import Menu
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+from assistant.playback import PlaybackHandle
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from config import ( ENABLE_TTS_VERBOSITY, TTS_PIPELINE_WORKERS, TTS_SEGMENT_MAX_CHARS,
+    TTS_WARMUP_WORKERS, TTS_WARMUP_MAX_QUANTITY
+)
+
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+CLAUSE_BOUNDARY = re.compile(r"(?<=[,;:])\s+")
+
+# Readbacks the agent commonly speaks about a single item. `count` is the quantity and name the way the model
+# says it ("a Zinger Burger", "two Pepsis"), so the phrases match its replies sentence for sentence
+ITEM_READBACK_TEMPLATES = [
+    "I've added {count} to your cart.",
+    "I've added {count} to your order.",
+    "Sure, I've added {count} to your order.",
+    "Got it, {count}.",
+    "I've updated your order to {count}.",
+    "I've removed the {name} from your cart.",
+]
+ITEM_PRICE_TEMPLATES = [
+    "The {name} is ${price}.",
+    "The {name} costs ${price} each.",
+]
+# Follow-up questions the agent ends most turns with
+COMMON_REPLY_PHRASES = [
+    "Would you like anything else?",
+    "Is there anything else I can get for you?",
+    "Anything else?",
+    "Would you like to add anything else to your order?",
+]
+NUMBER_WORDS = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]
+
+
+def get_item_count(name: str, quantity: int) -> str:
+    """Spell out `quantity` of an item the way it is spoken, e.g. "a Zinger Burger", "an Iced Tea" or "two Pepsis"."""
+    # Names that already read as plural or end in a piece count ("French Fries", "Bucket 12pc") are not inflected
+    is_plural = name.endswith("s") or name[-1].isdigit() or name.endswith("pc")
+    if quantity == 1:
+        if is_plural:
+            return f"one {name}"
+        return f"{'an' if name[0].lower() in 'aeiou' else 'a'} {name}"
+    number = NUMBER_WORDS[quantity] if quantity < len(NUMBER_WORDS) else str(quantity)
+    return f"{number} {name if is_plural else name + 's'}"
+
+
+def split_into_segments(text: str, max_chars: int = TTS_SEGMENT_MAX_CHARS) -> List[str]:
+    """
+    Split text into sentence sized segments for synthesis.
+
+    Sentences longer than `max_chars` are split further on clause punctuation,
+    and fragments too short to sound natural on their own are merged into the
+    following segment.
+
+    Args:
+        text (str): The text to split.
+        max_chars (int): Length above which a sentence is split into clauses.
+
+    Returns:
+        List[str]: The segments, in speaking order.
+    """
+    pieces = []
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        if len(sentence) > max_chars:
+            pieces.extend(CLAUSE_BOUNDARY.split(sentence))
+        else:
+            pieces.append(sentence)
+
+    segments, carry = [], ""
+    for piece in pieces:
+        piece = f"{carry} {piece}".strip() if carry else piece.strip()
+        if len(piece.split()) < 3:
+            carry = piece
+            continue
+        segments.append(piece)
+        carry = ""
+    if carry:
+        if segments:
+            segments[-1] = f"{segments[-1]} {carry}"
+        else:
+            segments.append(carry)
+    return segments
+
+
+
+class SpeechPipeline:
+    """
+    Speaks long replies sentence by sentence while later sentences are still synthesizing.
+
+    The first segment is spoken through `AudioManager.speak` (streamed when
+    streaming TTS is enabled) while the remaining segments are synthesized
+    concurrently on a bounded worker pool. They are queued for playback
+    strictly in their original order as each one becomes ready.
+
+    Attributes:
+        audio_manager (AudioManager): Synthesizes and plays the segments.
+        executor (ThreadPoolExecutor): Bounded pool the segments are synthesized on.
+    """
+    def __init__(self, audio_manager, max_workers: int = TTS_PIPELINE_WORKERS) -> None:
+        """
+        Initialize the SpeechPipeline.
+
+        Args:
+            audio_manager (AudioManager): Synthesizes and plays the segments.
+            max_workers (int): Maximum number of segments synthesized concurrently.
+        """
+        self.audio_manager = audio_manager
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-pipeline")
+
+    def speak(self, text: str, generation: Optional[int] = None) -> Optional[PlaybackHandle]:
+        """
+        Speak `text`, returning once every segment has been queued for playback.
+
+        Segments not yet queued are discarded if `AudioManager.interrupt` is
+        called meanwhile.
+
+        Args:
+            text (str): The text to speak.
+            generation (Optional[int]): `AudioManager.generation` the reply belongs to, nothing is spoken if an interrupt happened since.
+
+        Returns:
+            Optional[PlaybackHandle]: The handle of the last queued segment, it completes when the whole reply was played.
+        """
+        segments = split_into_segments(text)
+        if not segments:
+            return None
+        if ENABLE_TTS_VERBOSITY:
+            print(f"TTS PIPELINE: {len(segments)} segments")
+
+        generation = self.audio_manager.generation if generation is None else generation
+        if generation != self.audio_manager.generation:
+            return None
+        futures = [self.executor.submit(self.audio_manager.synthesize, segment) for segment in segments[1:]]
+        handle = self.audio_manager.speak(segments[0])
+        for segment, future in zip(segments[1:], futures):
+            if generation != self.audio_manager.generation:
+                for pending in futures:
+                    pending.cancel()
+                return None
+            audio_segment = future.result()
+            if audio_segment is not None and generation == self.audio_manager.generation:
+                if ENABLE_TTS_VERBOSITY:
+                    print(f"TTS LLM-SPEAK: {segment}")
+                handle = self.audio_manager.enqueue(audio_segment, label=segment)
+        return handle
+
+    def speak_stream(self, deltas: Iterable[str], generation: Optional[int] = None, on_text: Optional[Callable[[str], None]] = None) -> Optional[PlaybackHandle]:
+        """
+        Speak text while it is still being generated, returning once every segment has been queued for playback.
+
+        Completed sentences are cut off the incoming text as soon as the next one
+        starts. A sentence with nothing pending ahead of it is streamed through
+        `AudioManager.speak`, the others are synthesized on the worker pool and
+        queued in order as soon as they and every sentence before them are ready. `deltas` is always consumed to the
+        end, so a generating agent can finish its turn even after an interrupt.
+
+        Args:
+            deltas (Iterable[str]): The text as it is generated, e.g. from `StreamingAgent.stream`.
+            generation (Optional[int]): `AudioManager.generation` the reply belongs to, nothing more is spoken once an interrupt happened since.
+            on_text (Optional[Callable[[str], None]]): Called with the text generated so far after every delta, e.g. to update the transcript.
+
+        Returns:
+            Optional[PlaybackHandle]: The handle of the last queued segment, it completes when the whole reply was played.
+        """
+        generation = self.audio_manager.generation if generation is None else generation
+        pending: Deque[Tuple[str, bool, Future]] = deque()
+        handle, text, buffer = None, "", ""
+
+        def submit(segment: str):
+            if generation != self.audio_manager.generation:
+                return
+            # With nothing queued ahead of it a segment can be streamed straight into playback without breaking the order
+            streamed = not pending
+            speak = self.audio_manager.speak if streamed else self.audio_manager.synthesize
+            pending.append((segment, streamed, self.executor.submit(speak, segment)))
+
+        def drain(block: bool):
+            nonlocal handle
+            while pending and (block or pending[0][2].done()):
+                segment, streamed, future = pending.popleft()
+                result = future.result()
+                if streamed:
+                    handle = result or handle
+                elif result is not None and generation == self.audio_manager.generation:
+                    if ENABLE_TTS_VERBOSITY:
+                        print(f"TTS LLM-SPEAK: {segment}")
+                    handle = self.audio_manager.enqueue(result, label=segment)
+
+        for delta in deltas:
+            text += delta
+            buffer += delta
+            if on_text is not None:
+                on_text(text)
+            boundaries = list(SENTENCE_BOUNDARY.finditer(buffer))
+            if boundaries and len(buffer[:boundaries[-1].start()].split()) >= 3:
+                ready, buffer = buffer[:boundaries[-1].start()], buffer[boundaries[-1].end():]
+                for segment in split_into_segments(ready):
+                    submit(segment)
+            drain(block=False)
+
+        for segment in split_into_segments(buffer):
+            submit(segment)
+        drain(block=True)
+        return handle
+
+
+
+def get_readback_phrases(menu_items: List[Menu], max_quantity: int = TTS_WARMUP_MAX_QUANTITY) -> List[str]:
+    """
+    Build the item readbacks and follow-up questions the agent is likely to speak for a menu.
+
+    Args:
+        menu_items (List[Menu]): The menu categories, as returned by `get_menu_items`.
+        max_quantity (int): Quantities from 1 up to this are rendered into the readbacks.
+
+    Returns:
+        List[str]: The distinct phrases, the follow-up questions first and then the readbacks in menu order.
+    """
+    phrases = dict.fromkeys(COMMON_REPLY_PHRASES)
+    for menu in menu_items:
+        for item in menu.items:
+            price = f"{item.price_per_unit:.2f}"
+            for template in ITEM_READBACK_TEMPLATES:
+                for quantity in range(1, max_quantity + 1):
+                    phrases[template.format(name=item.name, count=get_item_count(item.name, quantity), price=price)] = None
+            for template in ITEM_PRICE_TEMPLATES:
+                phrases[template.format(name=item.name, price=price)] = None
+    return list(phrases)
+
+
+def warm_tts_cache(audio_manager, phrases: List[str], max_workers: int = TTS_WARMUP_WORKERS) -> Dict[str, int]:
+    """
+    Synthesize `phrases` into the TTS cache of `audio_manager` in a bounded background batch.
+
+    Phrases already in the cache are skipped, so an interrupted warm-up resumes
+    where it stopped on the next start.
+
+    Args:
+        audio_manager (AudioManager): Synthesizes the phrases through `prefetch`.
+        phrases (List[str]): The phrases to warm.
+        max_workers (int): Maximum number of phrases synthesized concurrently.
+
+    Returns:
+        Dict[str, int]: Number of phrases `cached`, `skipped` because they were cached before, and `failed`.
+    """
+    if audio_manager.tts_cache is None:
+        return {"cached": 0, "skipped": len(phrases), "failed": 0}
+    
+    pending = [phrase for phrase in phrases if not audio_manager.is_cached(phrase)]
+    report = {"cached": 0, "skipped": len(phrases) - len(pending), "failed": 0}
+    if ENABLE_TTS_VERBOSITY:
+        print(f"TTS WARMUP: {len(pending)} of {len(phrases)} phrases to synthesize")
+    
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-warmup") as executor:
+        futures = [executor.submit(audio_manager.prefetch, phrase) for phrase in pending]
+        for done, future in enumerate(as_completed(futures), start=1):
+            report["cached" if future.result() else "failed"] += 1
+            if ENABLE_TTS_VERBOSITY and (done % 10 == 0 or done == len(pending)):
+                print(f"TTS WARMUP: {done}/{len(pending)} phrases, {report['failed']} failed, {time.perf_counter() - start_time:.1f}s")
+    return report
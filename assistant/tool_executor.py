@@ -0,0 +1,113 @@
+import time
+from langchain_core.tools import BaseTool
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+from config import ENABLE_LLM_VERBOSITY, TOOL_EXECUTOR_WORKERS
+
+
+# Tools that read, finalize or batch-change the whole cart, they only run once every earlier call finished and before any later one starts
+BARRIER_TOOLS = {"confirm_order", "get_cart_contents", "update_cart"}
+# Tools that switch the view shown to the customer, they share one conflict key so the last requested view is the one left on screen
+VIEW_TOOLS = {"show_main_dishes", "show_side_dishes", "show_beverages"}
+VIEW_CONFLICT_KEY = "__view__"
+
+
+def get_conflict_key(tool_call: Dict) -> Optional[str]:
+    """Calls sharing a key touch the same cart line or the shown view and keep their relative order, None conflicts with nothing."""
+    if tool_call["name"] in VIEW_TOOLS:
+        return VIEW_CONFLICT_KEY
+    item_name = tool_call["args"].get("item_name")
+    return None if item_name is None else str(item_name)
+
+
+def get_call_groups(tool_calls: List[Dict]) -> List[List[List[int]]]:
+    """
+    Split the tool calls of one model response into waves of independent groups.
+
+    A barrier tool forms a wave of its own. Between barriers, calls with the
+    same conflict key are chained into one group, every other call is a group
+    by itself.
+
+    Args:
+        tool_calls (List[Dict]): The `tool_calls` of an `AIMessage`.
+
+    Returns:
+        List[List[List[int]]]: The waves in order, each a list of groups of call indices. The groups of a wave may run concurrently, the calls of a group run in order.
+    """
+    waves, groups, keyed = [], [], {}
+    for index, tool_call in enumerate(tool_calls):
+        if tool_call["name"] in BARRIER_TOOLS:
+            if groups:
+                waves.append(groups)
+            waves.append([[index]])
+            groups, keyed = [], {}
+            continue
+        key = get_conflict_key(tool_call)
+        if key is None:
+            groups.append([index])
+        elif key in keyed:
+            keyed[key].append(index)
+        else:
+            keyed[key] = [index]
+            groups.append(keyed[key])
+    if groups:
+        waves.append(groups)
+    return waves
+
+
+
+class ToolExecutor:
+    """
+    Runs the tool calls of one model response, concurrently where they do not conflict.
+
+    Each tool call renders the view and queues an audio cue, so running
+    several additions one after another makes the customer wait for all of
+    them. Calls on different cart lines run on a thread pool, calls on the
+    same line, the view changes and the barrier tools keep their order, and the cart itself
+    serializes its mutations with its own lock. The outputs are returned in
+    the order of the calls, so the `ToolMessage`s match the model's request.
+
+    Attributes:
+        tools (Dict[str, BaseTool]): The tools by name.
+        max_workers (int): Calls run at the same time, 1 runs them sequentially.
+    """
+    def __init__(self, tools: Dict[str, BaseTool], max_workers: int = TOOL_EXECUTOR_WORKERS) -> None:
+        self.tools = tools
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool") if max_workers > 1 else None
+
+    def __run_call__(self, tool_call: Dict) -> Tuple[Any, float]:
+        if ENABLE_LLM_VERBOSITY:
+            print(f"LLM TOOL CALL: {tool_call['name']} - {tool_call['args']}")
+        start_time = time.perf_counter()
+        tool_output = self.tools[tool_call["name"]].invoke(tool_call["args"])
+        elapsed_time = (time.perf_counter() - start_time) * 1000
+        if ENABLE_LLM_VERBOSITY:
+            print(f"LLM TOOL OUTPUT ({elapsed_time:.1f}ms): {tool_output}")
+        return tool_output, elapsed_time
+
+    def __run_group__(self, tool_calls: List[Dict], group: List[int]) -> List[Tuple[int, Any, float]]:
+        return [(index, *self.__run_call__(tool_calls[index])) for index in group]
+
+    def run(self, tool_calls: List[Dict]) -> List[Tuple[Any, float]]:
+        """
+        Run the tool calls, an exception raised by a tool is re-raised once its wave finished.
+
+        Args:
+            tool_calls (List[Dict]): The `tool_calls` of an `AIMessage`.
+
+        Returns:
+            List[Tuple[Any, float]]: The output and latency in milliseconds of every call, in the order of `tool_calls`.
+        """
+        results: List[Optional[Tuple[Any, float]]] = [None] * len(tool_calls)
+        for groups in get_call_groups(tool_calls):
+            if self.pool is None or len(groups) == 1:
+                finished = [self.__run_group__(tool_calls, group) for group in groups]
+            else:
+                futures = [self.pool.submit(self.__run_group__, tool_calls, group) for group in groups]
+                wait(futures)
+                finished = [future.result() for future in futures]
+            for group_results in finished:
+                for index, tool_output, elapsed_time in group_results:
+                    results[index] = (tool_output, elapsed_time)
+        return results
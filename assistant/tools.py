@@ -1,4 +1,6 @@
+from typing import List
 from langchain_core.tools import tool
+from assistant.utils import CartOperation
 from assistant.menu import get_order_cart
 
   
@@ -90,6 +92,22 @@ def modify_item_quantity_in_cart(item_name: str, new_quantity: int) -> str:
     order_cart = get_order_cart()
     return order_cart.modify_item_quantity_in_cart(item_name, new_quantity)
 
+@tool
+def update_cart(operations: List[CartOperation]) -> str:
+    """
+    Apply several cart changes in one call. Use this function when a customer names more than one item to add, remove or change at once, e.g. "two zingers, a large fries and a Pepsi".
+    
+    **Note:** Either all of the operations are applied or, if one of them is invalid, none of them.
+
+    Args:
+    operations (List[CartOperation]): The changes in the order the customer said them, each with an `action` (`add`, `remove` or `set_quantity`), the `item_name` and the `quantity`.
+
+    Returns:
+    str: The items and quantities in the cart along with the total price after the changes, or the invalid operations if nothing was applied.
+    """
+    order_cart = get_order_cart()
+    return order_cart.apply_cart_operations(operations)
+
 @tool
 def get_cart_contents() -> str:
     """
@@ -118,6 +136,7 @@ def get_available_tools() -> dict:
         "show_beverages": show_beverages,
         "show_side_dishes": show_side_dishes, 
         "show_main_dishes": show_main_dishes,
+        "update_cart": update_cart,
         "add_item_to_cart": add_item_to_cart,
         "get_cart_contents": get_cart_contents,
         "remove_item_from_cart": remove_item_from_cart,
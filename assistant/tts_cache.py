@@ -0,0 +1,178 @@
+import os, re, wave, hashlib, threading
+from collections import OrderedDict
+from pydub import AudioSegment
+from typing import Dict, Optional
+from config import ( ENABLE_TTS_VERBOSITY,
+    TTS_CACHE_FOLDER, TTS_CACHE_MAX_BYTES, TTS_CACHE_HOT_ITEMS
+)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different spellings of a phrase share a cache entry."""
+    text = text.replace("’", "'").replace("“", '"').replace("”", '"')
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+
+class TTSCache:
+    """
+    Content-addressed, size-bounded cache of synthesized speech.
+
+    Entries are keyed by a hash of the normalized text, the TTS model and the
+    format of the decoded audio, and hold that audio as WAV files so a hit
+    never touches the network or a decoder. Disk usage is
+    bounded by evicting the least recently used files, and the most recently
+    used clips are additionally kept in memory as a hot tier.
+
+    Attributes:
+        folder (str): Folder the WAV files are stored in.
+        max_bytes (int): Upper bound on the summed size of the files on disk.
+        hot_items (int): Number of clips kept in memory.
+    """
+    def __init__(self, folder: str = TTS_CACHE_FOLDER, max_bytes: int = TTS_CACHE_MAX_BYTES, hot_items: int = TTS_CACHE_HOT_ITEMS) -> None:
+        """
+        Initialize the TTSCache, indexing the clips already on disk.
+
+        Args:
+            folder (str): Folder the WAV files are stored in.
+            max_bytes (int): Upper bound on the summed size of the files on disk.
+            hot_items (int): Number of clips kept in memory.
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hot_items = hot_items
+        self.lock = threading.Lock()
+        self.hot: "OrderedDict[str, AudioSegment]" = OrderedDict()
+        self.hot_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # LRU index of the files on disk, least recently used first
+        os.makedirs(folder, exist_ok=True)
+        entries = [entry for entry in os.scandir(folder) if entry.name.endswith(".wav")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        self.index: "OrderedDict[str, int]" = OrderedDict(
+            (entry.name[:-4], entry.stat().st_size) for entry in entries
+        )
+        self.disk_bytes = sum(self.index.values())
+
+    @staticmethod
+    def get_key(text: str, model_name: str, encoding: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{encoding}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.wav")
+
+    def contains(self, text: str, model_name: str, encoding: str) -> bool:
+        key = self.get_key(text, model_name, encoding)
+        with self.lock:
+            return key in self.hot or key in self.index
+
+    def get(self, text: str, model_name: str, encoding: str) -> Optional[AudioSegment]:
+        """
+        Look up the synthesized audio for `text`.
+
+        Args:
+            text (str): The spoken text.
+            model_name (str): The TTS model the audio was synthesized with.
+            encoding (str): The format of the decoded audio, e.g. `linear16_24000`.
+
+        Returns:
+            Optional[AudioSegment]: The cached audio, or None on a miss.
+        """
+        key = self.get_key(text, model_name, encoding)
+        with self.lock:
+            audio_segment = self.hot.get(key)
+            if audio_segment is not None:
+                self.hot.move_to_end(key)
+                self.hot_hits += 1
+                return audio_segment
+            if key not in self.index:
+                self.misses += 1
+                return None
+
+        path = self.get_path(key)
+        try:
+            with wave.open(path, "rb") as file:
+                audio_segment = AudioSegment(
+                    data=file.readframes(file.getnframes()),
+                    sample_width=file.getsampwidth(),
+                    frame_rate=file.getframerate(),
+                    channels=file.getnchannels(),
+                )
+            os.utime(path)
+        except (OSError, EOFError, wave.Error):
+            with self.lock:
+                self.disk_bytes -= self.index.pop(key, 0)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            if key in self.index:
+                self.index.move_to_end(key)
+            self.disk_hits += 1
+            self.__add_hot__(key, audio_segment)
+        return audio_segment
+
+    def put(self, text: str, model_name: str, encoding: str, audio_segment: AudioSegment) -> None:
+        """
+        Store synthesized audio for `text`, evicting the least recently used clips if needed.
+
+        Args:
+            text (str): The spoken text.
+            model_name (str): The TTS model the audio was synthesized with.
+            encoding (str): The format of the decoded audio, e.g. `linear16_24000`.
+            audio_segment (AudioSegment): The decoded audio.
+        """
+        key = self.get_key(text, model_name, encoding)
+        path = self.get_path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with wave.open(temp_path, "wb") as file:
+            file.setnchannels(audio_segment.channels)
+            file.setsampwidth(audio_segment.sample_width)
+            file.setframerate(audio_segment.frame_rate)
+            file.writeframes(audio_segment.raw_data)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+
+        evicted = []
+        with self.lock:
+            self.disk_bytes += size - self.index.pop(key, 0)
+            self.index[key] = size
+            self.__add_hot__(key, audio_segment)
+            while self.disk_bytes > self.max_bytes and len(self.index) > 1:
+                old_key, old_size = self.index.popitem(last=False)
+                self.hot.pop(old_key, None)
+                self.disk_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.get_path(old_key))
+            except OSError:
+                pass
+        if ENABLE_TTS_VERBOSITY and evicted:
+            print(f"TTS CACHE: Evicted {len(evicted)} clips, {self.disk_bytes} bytes on disk")
+
+    def __add_hot__(self, key: str, audio_segment: AudioSegment):
+        self.hot[key] = audio_segment
+        self.hot.move_to_end(key)
+        while len(self.hot) > self.hot_items:
+            self.hot.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return the hit counters and occupancy of the cache.
+
+        Returns:
+            Dict[str, float]: Hot and disk hits, misses, hit rate, and the number and size of stored clips.
+        """
+        with self.lock:
+            lookups = self.hot_hits + self.disk_hits + self.misses
+            return {
+                "hot_hits": self.hot_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hot_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "clips": len(self.index),
+                "disk_bytes": self.disk_bytes,
+            }
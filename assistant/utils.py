@@ -1,5 +1,5 @@
-from typing import List, Optional
-from pydantic import BaseModel, model_validator
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field, model_validator
 
 
 
@@ -14,6 +14,11 @@ class Item(BaseModel):
 class Order(Item):
     total_quantity: int = 0
     
+class CartOperation(BaseModel):
+    action:    Literal["add", "remove", "set_quantity"] = Field(description="`add` adds `quantity`, `remove` removes `quantity` (all of it if it is at least the quantity in the cart), `set_quantity` sets it to `quantity` (0 removes the item)")
+    item_name: str = Field(description="The name of the item, exactly as in the menu")
+    quantity:  int = Field(default=1, description="The quantity to add, remove or set")
+    
 class Menu(BaseModel):
     items:     List[Item] = []
     menu_type: str = "main_dish"
@@ -26,6 +31,7 @@ class Message(BaseModel):
 class StreamData(BaseModel):
     menu:              List[Menu] = []
     cart:              List[Order] = []
+    menu_version:      str = ""
     action:            Optional[str] = None
     is_started:        bool = False
     total_price:       float = 0
@@ -12,6 +12,33 @@ if not os.path.exists("downloads"):
 STT_MODEL = "nova-2"            # Optional if stt backend is of deepgram
 LLM_MODEL = "gpt-4o"            # "gemma2-9b-it"# "llama3-8b-8192"
 TTS_MODEL = "aura-asteria-en"
+TTS_SAMPLE_RATE = 24000         # Sample rate of streamed (raw linear16) tts audio
+TTS_STREAM_CHUNK_SIZE = 4800    # Bytes read per chunk from the streaming tts response (100ms at 24kHz)
+ENABLE_STREAMING_TTS = True     # Start playing tts audio as it downloads instead of after the full mp3 arrived
+TTS_PIPELINE_WORKERS = 3        # Sentences of a reply synthesized concurrently
+TTS_SEGMENT_MAX_CHARS = 120     # Sentences longer than this are split on clauses before synthesis
+PLAYBACK_BLOCK_SIZE = 480       # Frames written per block to the persistent output stream (20ms at 24kHz)
+MIC_REOPEN_LEAD_MS = 200        # Reopen the microphone this long before the spoken reply ends
+ENABLE_AUDIO_NORMALIZATION = True   # Trim the silence around clips and level their loudness before playback
+SILENCE_THRESHOLD_DBFS = -45    # Audio quieter than this at the start and end of a clip is trimmed
+SILENCE_PAD_MS = 30             # Silence kept around the speech so onsets and decays are not clipped
+TARGET_LOUDNESS_DBFS = -20      # Loudness (rms of the speech) every clip is normalized to
+ENABLE_ADAPTIVE_FILLERS = True  # Play a disfluency filler while an llm call runs slower than usual
+FILLER_MIN_DELAY_MS = 600       # Never play a filler before a call has been running this long
+FILLER_LATENCY_FACTOR = 1.5     # Play one once a call runs this much longer than the rolling estimate for its model and tool depth
+FILLER_LATENCY_ALPHA = 0.3      # Weight of the newest call in the rolling latency estimate
+ENABLE_TTS_CACHE = True         # Reuse synthesized audio for text that was spoken before
+TTS_CACHE_FOLDER = "downloads/tts_cache"
+TTS_CACHE_MAX_BYTES = 256 * 1024 * 1024    # Least recently used clips are evicted beyond this size on disk
+TTS_CACHE_HOT_ITEMS = 64        # Most recently used clips additionally kept decoded in memory
+ENABLE_TTS_WARMUP = True        # Synthesize likely menu readback phrases into the tts cache at startup
+TTS_WARMUP_WORKERS = 2          # Phrases synthesized concurrently by the warm-up job
+TTS_WARMUP_MAX_QUANTITY = 3     # Quantities up to which item readbacks are warmed
+ENABLE_STREAMING_AGENT = True   # Speak and display the reply while the llm is still generating it
+ENABLE_CONCURRENT_TOOLS = True  # Run the independent tool calls of one model response in parallel
+TOOL_EXECUTOR_WORKERS = 4       # Tool calls run at the same time when concurrent tools are enabled
+SESSION_TIMEOUT_S = 120         # A conversation silent for this long is over, the next input starts a fresh history and cart
+HISTORY_TOKEN_BUDGET = 3000     # Estimated prompt tokens after which the oldest turns are compacted into a summary of the cart
 ROTATE_LLM_API_KEYS = True
 
 
@@ -21,6 +48,26 @@ ROTATE_LLM_API_KEYS = True
 DISFLUENCE = "responses/disfluencies"
 INITIAL_RESPONSE = "responses/initial_responses"
 INTERMEDIATE_RESPONSE = "responses/intermediate_responses"
+ENABLE_AUDIO_BUNDLE = True                  # Load the pre-recorded sounds from one pre-decoded pcm file instead of decoding every mp3
+AUDIO_BUNDLE_PATH = "downloads/audio_bundle.pcm"    # Rebuilt automatically, its index is stored next to it as .json
+
+
+##################
+# WEBVIEW PARAMS #
+##################
+ASSET_CACHE_MAX_BYTES = 64 * 1024 * 1024    # Upper bound for encoded images kept in memory
+TEMPLATE_CACHE_FOLDER = "downloads/templates"  # Compiled jinja bytecode for the web_builder templates
+ENABLE_PURGED_STYLESHEET = True             # Ship MENU_PAGE_STYLE purged to the classes used in web_builder/templates.py
+ENABLE_ASSET_SERVER = True                  # Serve images and css by url instead of inlining data uris
+ASSET_SERVER_HOST = "127.0.0.1"
+ASSET_SERVER_PORT = 8081
+ENABLE_IMAGE_VARIANTS = True                # Serve resized webp variants sized for where each image is shown (needs pillow)
+IMAGE_VARIANT_FOLDER = "downloads/image_variants"
+IMAGE_VARIANT_QUALITY = 80
+ENABLE_FRAGMENT_CACHE = True                # Reuse the rendered menu category grid until the menu changes
+RENDER_FRAME_WINDOW = 0.05                  # Seconds display() requests are coalesced for before rendering
+RENDER_IN_BACKGROUND = True                 # Render on a worker thread so tool calls return without waiting on the view
+ENABLE_PATCH_UPDATES = True                 # Push only changed page regions once the page's patch applier is connected
 
 
 ####################
@@ -31,6 +78,12 @@ CHANNELS = 1
 WAKE_WAIT_DELAY = 1.2
 WAKE_WORD_MODEL = "openai/whisper-tiny.en"
 WAKE_WORDS = [word.lower() for word in ["hi", "Hello", "hey there", "Hello K F C", "hi k f c"]]
+ENABLE_BARGE_IN = True          # Stop the assistant's speech when the customer starts talking over it
+BARGE_IN_THRESHOLD_DBFS = -30   # Microphone level counted as speech while nothing is playing
+BARGE_IN_ECHO_MARGIN_DB = 3     # While the assistant speaks the microphone must be this much louder than the playback, so its own echo never interrupts it
+BARGE_IN_ECHO_WINDOW_MS = 500   # Playback this recent still counts as echo, covers the output latency and one microphone block
+BARGE_IN_MIN_SPEECH_MS = 250    # Speech needed above the threshold before the assistant is interrupted
+BARGE_IN_PRE_ROLL_MS = 500      # Audio from before the barge-in forwarded to STT, so the start of the utterance is not lost
 
 
 
@@ -54,7 +107,7 @@ Casually greet customers and ask for their order. If they ask "What do you have?
 
 Use show_main_dishes(), show_side_dishes(), and show_beverages() to share menu options. After calling a function, tell the customer to check the screen for details, then briefly mention 2-3 popular items. If asked about all items, use show_main_dishes() first, then describe them.
 
-Add items one at a time with add_item_to_cart(), always confirming quantity. Use remove_item_from_cart() or modify_item_quantity_in_cart() for order changes.
+Add items with add_item_to_cart(), always confirming quantity. Use remove_item_from_cart() or modify_item_quantity_in_cart() for order changes. When the customer names several items or changes at once, apply all of them in a single update_cart() call.
 
 Review orders with get_cart_contents() if asked or before checkout for confirmation. Finalize confirmed orders with confirm_order().
 
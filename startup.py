@@ -1,10 +1,13 @@
+import threading
+from typing import Optional
 from assistant.agent import ( AudioManager, 
-    WakeWordDetector, ConversationManager, Agent
+    WakeWordDetector, ConversationManager, Agent, StreamingAgent
 )
+from assistant.speech import SpeechPipeline, get_readback_phrases, warm_tts_cache
 from assistant.tools import get_available_tools
 from assistant.menu import get_order_cart, get_menu_items
 from config import (
-    TTS_MODEL, DISFLUENCE, LLM_MODEL,
+    TTS_MODEL, DISFLUENCE, LLM_MODEL, ENABLE_TTS_WARMUP, ENABLE_STREAMING_AGENT,
     INITIAL_RESPONSE, INTERMEDIATE_RESPONSE, WAKE_WORD_MODEL
 )
 
@@ -12,17 +15,21 @@ from config import (
 agent = None
 order_cart = None
 audio_manager = None
+speech_pipeline = None
+tts_warmup_thread = None
 wake_word_detector = None
 conversation_manager = None
 
 def get_kfc_agent() -> Agent:
     global agent
     if agent is None:
-        agent = Agent(
+        agent_class = StreamingAgent if ENABLE_STREAMING_AGENT else Agent
+        agent = agent_class(
             model_name=LLM_MODEL,
             tools=get_available_tools(),
             menu_items=get_menu_items()
         )
+        agent.update_order_cart(get_order_cart())
     return agent
 
 def get_audio_manager() -> AudioManager:
@@ -36,6 +43,26 @@ def get_audio_manager() -> AudioManager:
         )
     return audio_manager
 
+def get_speech_pipeline() -> SpeechPipeline:
+    global speech_pipeline
+    if speech_pipeline is None:
+        speech_pipeline = SpeechPipeline(
+            audio_manager=get_audio_manager()
+        )
+    return speech_pipeline
+
+def start_tts_warmup() -> Optional[threading.Thread]:
+    """Warm the tts cache with the menu readback phrases on a background thread, once per process."""
+    global tts_warmup_thread
+    if ENABLE_TTS_WARMUP and tts_warmup_thread is None:
+        tts_warmup_thread = threading.Thread(
+            target=warm_tts_cache,
+            args=(get_audio_manager(), get_readback_phrases(get_menu_items())),
+            daemon=True
+        )
+        tts_warmup_thread.start()
+    return tts_warmup_thread
+
 def get_wakeword_detector() -> WakeWordDetector:
     global wake_word_detector
     if wake_word_detector is None:
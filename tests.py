@@ -1,10 +1,27 @@
 import time
 import config
-from startup import (
+import threading
+from assistant.agent import StreamingAgent
+from startup import ( get_menu_items,
     get_audio_manager, get_kfc_agent, 
     get_conversation_manager, get_wakeword_detector, get_order_cart
 )
-from web_builder.builder import start_webview_server
+import numpy as np
+from assistant.tts_cache import TTSCache
+from assistant.fillers import FillerScheduler
+from assistant.audio_filters import trim_silence, get_normalization_gain, apply_gain, get_level_dbfs, get_barge_in_threshold
+from assistant.speech import get_readback_phrases, warm_tts_cache
+from assistant.tools import get_available_tools
+from assistant.tool_executor import ToolExecutor, get_call_groups
+from assistant.history import compact_history, estimate_tokens
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from web_builder.assets import get_asset_cache
+from web_builder.asset_server import AssetServer
+import web_builder.builder as builder
+from web_builder.scheduler import RenderScheduler
+from web_builder.builder import (
+    start_webview_server, display_dishes, display, get_render_scheduler
+)
 
 config.ENABLE_TTS_VERBOSITY = True
 config.ENABLE_LLM_VERBOSITY = True
@@ -73,6 +90,400 @@ def test_webview():
         view.update_view(f"<h2>This is a live update count {i}</h2>")
         time.sleep(1)
 
+        
+def test_asset_cache():
+    order_cart = get_order_cart()
+    order_cart.action = "show_main_dishes"
+    display_dishes(order_cart.get_view_data())
+    
+    # A steady-state render must be served entirely from memory
+    asset_cache = get_asset_cache()
+    asset_cache.reset_stats()
+    display_dishes(order_cart.get_view_data())
+    stats = asset_cache.stats()
+    print(f"Asset cache stats: {stats}")
+    assert stats["misses"] == 0, stats
+
+
+def test_asset_server():
+    # A taken port must not keep the asset route from starting
+    blocker = AssetServer(port=0).start()
+    asset_server = AssetServer(port=blocker.port).start()
+    try:
+        assert asset_server.is_running and asset_server.port != blocker.port, asset_server.port
+        assert asset_server.base_url == f"http://{asset_server.host}:{asset_server.port}/assets/"
+        
+        # New content of a logical asset replaces the old one instead of piling up
+        old_url = asset_server.register_text("body { color: red; }", ".css", key="style")
+        new_url = asset_server.register_text("body { color: blue; }", ".css", key="style")
+        assert old_url != new_url and len(asset_server.assets) == 1, asset_server.assets.keys()
+        assert asset_server.lookup(new_url.rsplit("/", 1)[1]) is not None
+    finally:
+        asset_server.stop()
+        blocker.stop()
+
+    
+def test_render_coalescing():
+    start_webview_server()
+    order_cart = get_order_cart()
+    order_cart.action = "show_main_dishes"
+    render_scheduler = get_render_scheduler()
+    before = render_scheduler.stats()
+    
+    # A burst of identical display requests must result in a single push
+    for _ in range(5):
+        display(order_cart.get_view_data())
+    time.sleep(render_scheduler.frame_window * 4)
+    after = render_scheduler.stats()
+    print(f"Render scheduler stats: {after}")
+    assert after["requested"] - before["requested"] == 5, after
+    assert after["emitted"] - before["emitted"] <= 1, after
+
+    
+def test_tool_latency():
+    order_cart = get_order_cart()
+    original_scheduler = builder.render_scheduler
+    release, rendered = threading.Event(), threading.Event()
+    def blocking_render(data):
+        release.wait(timeout=5)
+        rendered.set()
+        return True
+    
+    # With background rendering a cart tool must return while its render is still pending
+    render_scheduler = RenderScheduler(blocking_render, frame_window=0, background=True)
+    builder.render_scheduler = render_scheduler
+    try:
+        start_time = time.perf_counter()
+        order_cart.add_item_to_cart("Pepsi", 1)
+        print(f"add_item_to_cart returned after {(time.perf_counter() - start_time) * 1000:.1f}ms with the render blocked")
+        assert not rendered.is_set(), "The tool waited for the render"
+        release.set()
+        assert rendered.wait(timeout=5), "The render never ran"
+    finally:
+        release.set()
+        render_scheduler.stop()
+        builder.render_scheduler = original_scheduler
+        order_cart.reset_cart()
+
+    
+def test_fragment_cache_benchmark():
+    order_cart = get_order_cart()
+    order_cart.action = "add_item_to_cart"
+    order_cart.add_item_to_cart("Zinger Burger", 2)
+    view_data = order_cart.get_view_data()
+    
+    # Compare a full `display_dishes` render with one reusing the cached category grid
+    runs = 100
+    timings = {}
+    for use_fragments in [False, True]:
+        builder.ENABLE_FRAGMENT_CACHE = use_fragments
+        display_dishes(view_data)
+        start_time = time.perf_counter()
+        for _ in range(runs):
+            display_dishes(view_data)
+        timings[use_fragments] = (time.perf_counter() - start_time) / runs * 1000
+    builder.ENABLE_FRAGMENT_CACHE = config.ENABLE_FRAGMENT_CACHE
+    order_cart.reset_cart()
+    
+    print(f"display_dishes: full render {timings[False]:.2f}ms, with cached fragments {timings[True]:.2f}ms")
+
+    
+def test_tts_cache():
+    audio_manager = get_audio_manager()
+    text = "Your order has been confirmed, thank you for choosing KFC!"
+    
+    # The second request for the same text must not touch the network
+    for attempt in range(2):
+        start_time = time.perf_counter()
+        audio_manager.speak(text)
+        print(f"speak attempt {attempt+1}: {(time.perf_counter() - start_time) * 1000:.1f}ms")
+    audio_manager.wait_until_done()
+    
+    stats = audio_manager.tts_cache.stats()
+    print(f"TTS cache stats: {stats}")
+    assert stats["hot_hits"] + stats["disk_hits"] >= 1, stats
+    
+    # Entries survive a restart through the on-disk tier
+    stats = TTSCache().stats()
+    assert stats["clips"] >= 1, stats
+    
+    # A failing cache write must not lose the synthesized speech
+    tts_cache = audio_manager.tts_cache
+    def failing_put(*args):
+        raise OSError("No space left on device")
+    tts_cache.put = failing_put
+    try:
+        # A fresh text, so the speech is not served from an earlier run's cache
+        assert audio_manager.synthesize(f"Order number {time.time_ns() % 1000} is ready.") is not None
+    finally:
+        del tts_cache.put
+
+
+def test_tts_warmup():
+    audio_manager = get_audio_manager()
+    phrases = get_readback_phrases(get_menu_items())[:6]
+    report = warm_tts_cache(audio_manager, phrases)
+    print(f"TTS warm-up report: {report}")
+    assert report["failed"] == 0, report
+    
+    # A second run resumes from the cache and synthesizes nothing
+    report = warm_tts_cache(audio_manager, phrases)
+    assert report["skipped"] == len(phrases), report
+    
+    # Warmed phrases are hits for the non-streamed path too, which speaks every sentence after the first
+    misses = audio_manager.tts_cache.stats()["misses"]
+    audio_manager.synthesize(phrases[-1])
+    assert audio_manager.tts_cache.stats()["misses"] == misses
+
+
+def test_playback_gapless():
+    audio_manager = get_audio_manager()
+    
+    # Back to back clips must start right after each other, without reopening the device
+    audio_manager.play_intermediate_response("show_main_dishes")
+    audio_manager.play_disfluent_filler()
+    audio_manager.wait_until_done()
+    latencies = audio_manager.get_playback_latencies()
+    print(f"Playback latencies: {latencies}")
+    clips = list(audio_manager.playback_engine.history)[-2:]
+    gap_ms = (clips[1].first_sample_at - clips[0].finished_at - clips[1].lead_seconds) * 1000
+    print(f"Gap between clips: {gap_ms:.1f}ms")
+    assert gap_ms < 50, gap_ms
+
+
+def test_playback_handle():
+    audio_manager = get_audio_manager()
+    
+    # Waiting on one clip returns shortly before its estimated end, without draining the queue
+    response, handle = audio_manager.play_initial_response()
+    start_time = time.perf_counter()
+    assert handle.wait(timeout=handle.duration + 5, remaining=0.2)
+    print(f"'{response}': estimated {handle.duration:.2f}s, waited {time.perf_counter() - start_time:.2f}s")
+    handle.wait()
+    assert handle.future.result() is True
+    
+    # A cancelled clip resolves to False
+    handle = audio_manager.play_disfluent_filler()
+    handle.cancel()
+    assert handle.future.result(timeout=5) is False
+
+
+def test_barge_in():
+    audio_manager = get_audio_manager()
+    
+    # An interrupt must silence the playing clip and everything queued behind it right away
+    _, playing = audio_manager.play_initial_response()
+    queued = audio_manager.play_disfluent_filler()
+    time.sleep(0.3)
+    start_time = time.perf_counter()
+    audio_manager.interrupt()
+    assert playing.future.result(timeout=1) is False
+    assert queued.future.result(timeout=1) is False
+    print(f"Interrupt to silence: {(time.perf_counter() - start_time) * 1000:.1f}ms")
+    assert audio_manager.audio_queue.unfinished_tasks == 0
+
+
+def test_barge_in_echo():
+    audio_manager = get_audio_manager()
+    audio_manager.wait_until_done()
+    sample_rate = 16000
+    tone = np.sin(np.arange(sample_rate // 4) * 2 * np.pi * 300 / sample_rate)
+    def microphone_block(level_dbfs: float) -> np.ndarray:
+        return (tone * np.sqrt(2) * 10 ** (level_dbfs / 20)).astype(np.float32)
+    
+    # While the assistant speaks, its echo at the playback level must not count as the customer talking
+    _, handle = audio_manager.play_initial_response()
+    time.sleep(0.3)
+    playback_dbfs = audio_manager.get_output_level()
+    assert playback_dbfs is not None, "Nothing was measured while playing"
+    threshold_dbfs = get_barge_in_threshold(playback_dbfs)
+    print(f"Playback at {playback_dbfs:.1f}dBFS, barge-in threshold {threshold_dbfs:.1f}dBFS")
+    assert get_level_dbfs(microphone_block(playback_dbfs), full_scale=1.0) < threshold_dbfs
+    assert get_level_dbfs(microphone_block(playback_dbfs + 10), full_scale=1.0) >= threshold_dbfs
+    handle.future.result(timeout=10)
+    
+    # Once the echo died down, normal speech interrupts again
+    time.sleep(config.BARGE_IN_ECHO_WINDOW_MS / 1000 + 0.1)
+    assert audio_manager.get_output_level() is None
+    assert get_level_dbfs(microphone_block(config.BARGE_IN_THRESHOLD_DBFS + 5), full_scale=1.0) >= get_barge_in_threshold(None)
+
+
+def test_silence_trim():
+    sample_rate = 24000
+    tone = (np.sin(np.arange(sample_rate) * 2 * np.pi * 440 / sample_rate) * 3000).astype(np.int16)
+    silence = np.zeros(sample_rate // 2, dtype=np.int16)
+    samples = np.concatenate([silence, tone, silence])
+    
+    # 500ms of silence on both sides, minus the 30ms of padding kept around the tone
+    trimmed, lead_ms, trail_ms = trim_silence(samples, sample_rate, pad_ms=30)
+    print(f"Trimmed {lead_ms}ms leading and {trail_ms}ms trailing silence")
+    assert 460 <= lead_ms <= 480 and 460 <= trail_ms <= 480, (lead_ms, trail_ms)
+    
+    gain_db = get_normalization_gain(trimmed, sample_rate, target_dbfs=-20)
+    leveled = apply_gain(trimmed, gain_db)
+    rms_dbfs = 20 * np.log10(np.sqrt(np.mean(np.square(leveled / 32768.0))))
+    print(f"Gain {gain_db:+.1f}dB, loudness after {rms_dbfs:.1f}dBFS")
+    assert abs(rms_dbfs + 20) < 1, rms_dbfs
+
+
+def test_filler_scheduler():
+    audio_manager = get_audio_manager()
+    audio_manager.wait_until_done()
+    filler_scheduler = FillerScheduler(audio_manager, min_delay_ms=100)
+    
+    # A call that returns before its threshold gets no filler
+    filler_scheduler.finish(filler_scheduler.start("test-model", 0))
+    assert filler_scheduler.stats()["fillers_played"] == 0
+    
+    # A call running well past its rolling estimate gets one
+    ticket = filler_scheduler.start("test-model", 0)
+    time.sleep(0.5)
+    filler_scheduler.finish(ticket)
+    stats = filler_scheduler.stats()
+    print(f"Filler scheduler stats: {stats}")
+    assert stats["fillers_played"] == 1, stats
+    audio_manager.wait_until_done()
+
+
+def test_streaming_agent():
+    kfc_agent = get_kfc_agent()
+    
+    # The reply must arrive in pieces, the first one well before the final model call completes
+    start_time = time.perf_counter()
+    delta_times = []
+    for delta in kfc_agent.stream("What burgers do you have?"):
+        if delta:
+            delta_times.append((time.perf_counter() - start_time) * 1000)
+    total_ms = (time.perf_counter() - start_time) * 1000
+    assert delta_times, "The agent streamed no text"
+    print(f"Streamed reply: {len(delta_times)} deltas, first {delta_times[0]:.0f}ms, last {delta_times[-1]:.0f}ms, complete {total_ms:.0f}ms: {kfc_agent.response}")
+    assert kfc_agent.response and len(delta_times) > 1
+    assert delta_times[0] < delta_times[-1], "The first delta only arrived with the end of the reply"
+
+
+def test_tool_executor():
+    order_cart = get_order_cart()
+    order_cart.reset_cart()
+    tool_calls = [
+        {"name": "add_item_to_cart", "args": {"item_name": "Zinger Burger", "quantity": 2}, "id": "1"},
+        {"name": "add_item_to_cart", "args": {"item_name": "French Fries", "quantity": 1}, "id": "2"},
+        {"name": "modify_item_quantity_in_cart", "args": {"item_name": "Zinger Burger", "new_quantity": 3}, "id": "3"},
+        {"name": "add_item_to_cart", "args": {"item_name": "Pepsi", "quantity": 1}, "id": "4"},
+        {"name": "get_cart_contents", "args": {}, "id": "5"},
+    ]
+    # Calls on the same item stay chained, the cart review waits for everything before it
+    assert get_call_groups(tool_calls) == [[[0, 2], [1], [3]], [[4]]]
+    # View changes keep their order too, the last requested menu is the one left on screen
+    view_calls = [{"name": name, "args": {}, "id": str(index)} for index, name in enumerate(["show_beverages", "show_main_dishes"])]
+    assert get_call_groups([tool_calls[1], *view_calls]) == [[[0], [1, 2]]]
+    ToolExecutor(get_available_tools(), 4).run(view_calls)
+    assert order_cart.action == "show_main_dishes", order_cart.action
+    
+    for max_workers in [1, 4]:
+        order_cart.reset_cart()
+        start_time = time.perf_counter()
+        results = ToolExecutor(get_available_tools(), max_workers).run(tool_calls)
+        print(f"{max_workers} workers: {(time.perf_counter() - start_time) * 1000:.1f}ms wall, {sum(elapsed for _, elapsed in results):.1f}ms summed")
+        quantities = {order.name: order.total_quantity for order in order_cart.orders}
+        assert quantities == {"Zinger Burger": 3, "French Fries": 1, "Pepsi": 1}, quantities
+        assert "Zinger Burger" in results[-1][0]
+    order_cart.reset_cart()
+
+
+def test_batch_cart_operations():
+    order_cart = get_order_cart()
+    order_cart.reset_cart()
+    order_cart.add_item_to_cart("Pepsi", 1)
+    
+    # One invalid operation leaves the cart untouched
+    result = order_cart.apply_cart_operations([
+        {"action": "add", "item_name": "Zinger Burger", "quantity": 2},
+        {"action": "add", "item_name": "Large Fries", "quantity": 1},
+    ])
+    print(result)
+    assert "not_applied" in result and [order.name for order in order_cart.orders] == ["Pepsi"]
+    
+    result = order_cart.apply_cart_operations([
+        {"action": "add", "item_name": "Zinger Burger", "quantity": 2},
+        {"action": "add", "item_name": "French Fries", "quantity": 1},
+        {"action": "set_quantity", "item_name": "Pepsi", "quantity": 3},
+        {"action": "remove", "item_name": "Coleslaw", "quantity": 1},
+    ])
+    print(result)
+    quantities = {order.name: order.total_quantity for order in order_cart.orders}
+    assert quantities == {"Pepsi": 3, "Zinger Burger": 2, "French Fries": 1}, quantities
+    assert "Coleslaw" in result
+    order_cart.reset_cart()
+
+
+def test_history_compaction():
+    messages = [SystemMessage(content="system prompt " * 50)]
+    for turn in range(20):
+        messages.append(HumanMessage(content=f"Add {turn + 1} zinger burgers please, and tell me about the sides " * 3))
+        messages.append(AIMessage(content="", tool_calls=[{"name": "add_item_to_cart", "args": {"item_name": "Zinger Burger", "quantity": 1}, "id": f"call_{turn}"}]))
+        messages.append(ToolMessage("name: Zinger Burger", tool_call_id=f"call_{turn}"))
+        messages.append(AIMessage(content="Added, anything else? " * 5))
+    
+    budget = estimate_tokens(messages) // 3
+    compacted, turns = compact_history(messages, budget, "20 x Zinger Burger (total $69.80)")
+    print(f"Compacted {turns} turns: {estimate_tokens(messages)} -> {estimate_tokens(compacted)} estimated tokens")
+    assert turns > 0 and estimate_tokens(compacted) <= budget
+    # The system prompt stays first, the summary follows it and turns are only cut at customer messages
+    assert compacted[0] is messages[0] and "Zinger Burger" in compacted[1].content
+    assert isinstance(compacted[2], HumanMessage) and compacted[-1] is messages[-1]
+    
+    # Compacting again replaces the summary instead of stacking another one
+    compacted_again, _ = compact_history(compacted + messages[-4:] * 10, budget, "nothing yet")
+    assert sum(message.name == "cart_state" for message in compacted_again) == 1
+
+
+def test_prompt_growth():
+    kfc_agent = get_kfc_agent()
+    kfc_agent.reset_session()
+    
+    def run_turn(text: str) -> dict:
+        if isinstance(kfc_agent, StreamingAgent):
+            for _ in kfc_agent.stream(text):
+                pass
+        else:
+            kfc_agent.invoke(text)
+        return kfc_agent.prompt_turns[-1]
+    
+    # The provider's counts are recorded on every path, the prompt grows within a session and starts over with the next
+    turns = [run_turn(text) for text in ["Hi, what sides do you have?", "Add a French Fries please", "And a Pepsi"]]
+    kfc_agent.reset_session()
+    turns.append(run_turn("Hi, what sides do you have?"))
+    print(f"Prompt tokens per turn: {[turn['prompt_tokens'] for turn in turns]}")
+    assert not any(turn["estimated"] for turn in turns), turns
+    first_call_tokens = [turn["prompt_tokens"] / turn["calls"] for turn in turns]
+    assert first_call_tokens[0] < first_call_tokens[2], turns
+    assert turns[3]["session"] != turns[2]["session"] and first_call_tokens[3] < first_call_tokens[2], turns
+    get_order_cart().reset_cart()
+
+
+def test_stable_prompt_prefix():
+    kfc_agent = get_kfc_agent()
+    kfc_agent.reset_session()
+    fingerprint = kfc_agent.get_prefix_fingerprint()
+    
+    # Cart changes, dialogue and a new session must leave the cached prefix byte-identical
+    for text in ["Add two zinger burgers and a Pepsi", "What is in my cart?"]:
+        if isinstance(kfc_agent, StreamingAgent):
+            for _ in kfc_agent.stream(text):
+                pass
+        else:
+            kfc_agent.invoke(text)
+        assert kfc_agent.get_prefix_fingerprint() == fingerprint, "The prompt prefix changed between turns"
+    kfc_agent.reset_session()
+    assert kfc_agent.get_prefix_fingerprint() == fingerprint, "The prompt prefix changed between sessions"
+    
+    # Cached and uncached input tokens are measured from the provider's counts, streamed calls included
+    stats = kfc_agent.get_prompt_token_stats()
+    print(f"Prompt tokens: {stats['cached_tokens']} cached, {stats['uncached_tokens']} uncached ({stats['cached_ratio']:.0%})")
+    if kfc_agent.backend == "oai":
+        assert not stats["estimated"], stats
+    get_order_cart().reset_cart()
+
             
 if __name__=="__main__":
     # test_agent()
@@ -80,4 +491,23 @@ if __name__=="__main__":
     # test_stt_listen()
     # test_wake_word()
     # test_webview()
+    # test_asset_cache()
+    # test_asset_server()
+    # test_render_coalescing()
+    # test_tool_latency()
+    # test_fragment_cache_benchmark()
+    # test_tts_cache()
+    # test_tts_warmup()
+    # test_playback_gapless()
+    # test_playback_handle()
+    # test_barge_in()
+    # test_barge_in_echo()
+    # test_silence_trim()
+    # test_filler_scheduler()
+    # test_streaming_agent()
+    # test_tool_executor()
+    # test_batch_cart_operations()
+    # test_history_compaction()
+    # test_prompt_growth()
+    # test_stable_prompt_prefix()
     pass
\ No newline at end of file
@@ -0,0 +1,265 @@
+import os, json, queue, hashlib, mimetypes, threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from .assets import get_asset_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import ENABLE_WEBVIEW_VERBOSITY, ASSET_SERVER_HOST, ASSET_SERVER_PORT
+
+
+ASSET_ROUTE = "/assets/"
+EVENTS_ROUTE = "/events"
+EVENTS_KEEPALIVE_INTERVAL = 15
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+
+class AssetRequestHandler(BaseHTTPRequestHandler):
+    """Serves registered assets by content-hashed name with long-lived cache headers."""
+    server: "AssetHTTPServer"
+
+    def do_GET(self):
+        name = self.path.split("?", 1)[0]
+        if name == EVENTS_ROUTE:
+            self.stream_events()
+            return
+        asset = None
+        if name.startswith(ASSET_ROUTE):
+            asset = self.server.asset_server.lookup(name[len(ASSET_ROUTE):])
+        if asset is None:
+            self.send_error(404)
+            return
+
+        data, content_type, etag = asset
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", ASSET_CACHE_CONTROL)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", ASSET_CACHE_CONTROL)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_events(self):
+        subscriber = self.server.asset_server.subscribe()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        try:
+            while True:
+                try:
+                    message = subscriber.get(timeout=EVENTS_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    message = b": keep-alive\n\n"
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.asset_server.unsubscribe(subscriber)
+
+    def log_message(self, format, *args):
+        if ENABLE_WEBVIEW_VERBOSITY:
+            print(f"WEBVIEW ASSETS: {format % args}")
+
+
+class AssetHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    asset_server: "AssetServer"
+
+
+
+class AssetServer:
+    """
+    Local static asset route for the webview pages.
+
+    Files and generated stylesheets are registered under a URL derived from a
+    hash of their content, so the URL changes whenever the content does and the
+    browser can cache every response indefinitely. The rendered pages then only
+    carry these URLs instead of inlined base64 payloads. The same route also
+    streams server-sent events to connected pages (see `publish`).
+
+    Assets registered under a logical `key` replace the previous content of
+    that key, so regenerated stylesheets or edited files do not pile up in
+    memory for the lifetime of the process.
+
+    Attributes:
+        host (str): Interface the asset route listens on.
+        port (int): Port the asset route listens on, the one actually bound once started.
+        base_url (str): Prefix of every asset URL handed out.
+    """
+    def __init__(self, host: str = ASSET_SERVER_HOST, port: int = ASSET_SERVER_PORT) -> None:
+        """
+        Initialize the AssetServer.
+
+        Args:
+            host (str): Interface the asset route listens on.
+            port (int): Port the asset route listens on.
+        """
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.lock = threading.Lock()
+        self.base_url = f"http://{host}:{port}{ASSET_ROUTE}"
+        self.assets: Dict[str, Tuple[bytes, str, str]] = {}
+        self.asset_names: Dict[Hashable, str] = {}
+        self.text_urls: Dict[Hashable, Tuple[str, str]] = {}
+        self.subscribers: List[queue.Queue] = []
+        self.events_url = f"http://{host}:{port}{EVENTS_ROUTE}"
+
+    @property
+    def is_running(self) -> bool:
+        return self.httpd is not None
+
+    def __bind__(self) -> Optional[AssetHTTPServer]:
+        # Another instance or program may hold the configured port, any free one serves the pages just as well
+        for port in dict.fromkeys([self.port, 0]):
+            try:
+                return AssetHTTPServer((self.host, port), AssetRequestHandler)
+            except OSError as e:
+                if ENABLE_WEBVIEW_VERBOSITY:
+                    print(f"WEBVIEW: Asset route could not listen on {self.host}:{port}: {e}")
+        return None
+
+    def start(self) -> "AssetServer":
+        """Start serving registered assets from a background thread, if no port can be bound the pages keep inlining their assets."""
+        if self.httpd is None:
+            httpd = self.__bind__()
+            if httpd is None:
+                return self
+            self.port = httpd.server_address[1]
+            self.base_url = f"http://{self.host}:{self.port}{ASSET_ROUTE}"
+            self.events_url = f"http://{self.host}:{self.port}{EVENTS_ROUTE}"
+            self.httpd = httpd
+            self.httpd.asset_server = self
+            threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+            if ENABLE_WEBVIEW_VERBOSITY:
+                print(f"WEBVIEW: Asset route listening on {self.base_url}")
+        return self
+
+    def stop(self) -> None:
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    @property
+    def subscriber_count(self) -> int:
+        with self.lock:
+            return len(self.subscribers)
+
+    def subscribe(self) -> queue.Queue:
+        subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue) -> None:
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, event: str, payload: Any) -> int:
+        """
+        Send a server-sent event to every connected page.
+
+        Args:
+            event (str): The event name.
+            payload (Any): JSON serializable event data.
+
+        Returns:
+            int: The number of pages the event was sent to.
+        """
+        message = f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(message)
+        return len(subscribers)
+
+    def lookup(self, name: str) -> Optional[Tuple[bytes, str, str]]:
+        with self.lock:
+            return self.assets.get(name)
+
+    def register_bytes(self, data: bytes, extension: str, content_type: Optional[str] = None, key: Optional[Hashable] = None) -> str:
+        """
+        Register raw content and return its content-hashed URL.
+
+        Args:
+            data (bytes): The asset content.
+            extension (str): File extension used for the URL, e.g. ".css".
+            content_type (Optional[str]): MIME type, guessed from `extension` if not given.
+            key (Optional[Hashable]): The logical asset, e.g. the source path. Its previous content stops being served, unkeyed content is served for good.
+
+        Returns:
+            str: The URL the asset is served from.
+        """
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        name = f"{digest}{extension}"
+        content_type = content_type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        with self.lock:
+            if name not in self.assets:
+                self.assets[name] = (data, content_type, f'"{digest}"')
+            if key is not None:
+                old_name = self.asset_names.get(key)
+                self.asset_names[key] = name
+                if old_name not in (None, name) and old_name not in self.asset_names.values():
+                    del self.assets[old_name]
+        return self.base_url + name
+
+    def register_text(self, text: str, extension: str, key: Optional[Hashable] = None) -> str:
+        """
+        Register generated text content (e.g. a rendered stylesheet) and return its URL.
+
+        Args:
+            text (str): The asset content.
+            extension (str): File extension used for the URL, e.g. ".css".
+            key (Optional[Hashable]): The logical asset, e.g. the template name, see `register_bytes`.
+
+        Returns:
+            str: The URL the asset is served from.
+        """
+        text_key = text if key is None else key
+        entry = self.text_urls.get(text_key)
+        if entry is not None and entry[0] == text:
+            return entry[1]
+        url = self.register_bytes(text.encode("utf-8"), extension, key=key)
+        with self.lock:
+            self.text_urls[text_key] = (text, url)
+        return url
+
+    def register_file(self, path: str) -> str:
+        """
+        Register a file on disk and return its content-hashed URL.
+
+        The file is only re-read and re-hashed when its mtime or size changes.
+
+        Args:
+            path (str): Absolute path of the file.
+
+        Returns:
+            str: The URL the file is served from.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        return get_asset_cache().get(
+            path,
+            lambda data: self.register_bytes(data, extension, key=("file", path)),
+            kind=("url", self.base_url)
+        )
+
+
+
+asset_server = None
+
+def get_asset_server() -> AssetServer:
+    global asset_server
+    if asset_server is None:
+        asset_server = AssetServer()
+    return asset_server
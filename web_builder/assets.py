@@ -0,0 +1,113 @@
+import os, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+from config import ENABLE_WEBVIEW_VERBOSITY, ASSET_CACHE_MAX_BYTES
+
+
+
+class AssetCache:
+    """
+    Process-wide LRU cache for values derived from files on disk.
+
+    Entries are keyed on the derivation `kind` and the absolute file path, and
+    are only served while the file's mtime and size still match the values
+    recorded when the entry was built, so edited images are picked up without
+    a restart. Memory is bounded by the summed size of the cached values.
+
+    Attributes:
+        max_bytes (int): Upper bound on the summed size of the cached values.
+        hits (int): Number of lookups served from memory.
+        misses (int): Number of lookups that had to read the file.
+        evictions (int): Number of entries dropped to stay under `max_bytes`.
+    """
+    def __init__(self, max_bytes: int = ASSET_CACHE_MAX_BYTES) -> None:
+        """
+        Initialize an empty AssetCache.
+
+        Args:
+            max_bytes (int): Upper bound on the summed size of the cached values.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[tuple[Hashable, str], tuple[int, int, Any, int]]" = OrderedDict()
+
+    def get(self, path: str, build: Callable[[bytes], Any], kind: Hashable = "raw") -> Any:
+        """
+        Return the value derived from `path`, reading the file only on a miss.
+
+        Args:
+            path (str): Absolute path of the source file.
+            build (Callable[[bytes], Any]): Derives the cached value from the file contents.
+            kind (Hashable): Distinguishes different derivations of the same file.
+
+        Returns:
+            Any: The cached or freshly built value.
+        """
+        stat = os.stat(path)
+        key = (kind, path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+        with open(path, "rb") as file:
+            value = build(file.read())
+        size = len(value) if isinstance(value, (str, bytes, bytearray)) else stat.st_size
+
+        with self.lock:
+            self.misses += 1
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[3]
+            self.entries[key] = (stat.st_mtime_ns, stat.st_size, value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted[3]
+                self.evictions += 1
+        if ENABLE_WEBVIEW_VERBOSITY:
+            print(f"WEBVIEW: Asset cache miss for {kind}:{path}, cached {len(self.entries)} entries ({self.total_bytes} bytes)")
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the hit/miss counters and current occupancy of the cache.
+
+        Returns:
+            Dict[str, int]: Counters for hits, misses, evictions, entries and bytes.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
+
+    def reset_stats(self) -> None:
+        """Reset the hit/miss/eviction counters without dropping cached entries."""
+        with self.lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def clear(self) -> None:
+        """Drop every cached entry."""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+
+asset_cache = None
+
+def get_asset_cache() -> AssetCache:
+    global asset_cache
+    if asset_cache is None:
+        asset_cache = AssetCache()
+    return asset_cache
@@ -1,13 +1,17 @@
 import random
 import os, base64
-from typing import List
-from jinja2 import Template
+from typing import List, Optional
 from webview import Webview
-from .styles import HOME_PAGE_STYLE
-from config import ENABLE_WEBVIEW_VERBOSITY
-from assistant.utils import StreamData, Item, Order
-from .tailwind_menu_page_style import MENU_PAGE_STYLE
-from .templates import HOME_PAGE_TEMPLATE, MENU_PAGE_TEMPLATE, ORDER_REVIEW_PAGE_TEMPLATE
+from .assets import get_asset_cache
+from .patcher import get_page_patcher
+from .scheduler import RenderScheduler
+from .asset_server import get_asset_server
+from .images import create_image_variant, is_image_variants_available
+from config import ( ENABLE_WEBVIEW_VERBOSITY, 
+    ENABLE_ASSET_SERVER, ENABLE_PATCH_UPDATES, ENABLE_IMAGE_VARIANTS, ENABLE_FRAGMENT_CACHE
+)
+from .registry import get_template_registry
+from assistant.utils import StreamData, Item
 
 
 MENU_ITEM_HEIGHT = 300
@@ -16,6 +20,16 @@ LOGO_IMAGE_PATH = "images/logo1.png"
 HOME_BACKGROUND_IMAGE = "images/poster1.jpg"
 MENU_BACKGROUND_IMAGE = "images/background.jpg"
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATCH_PHRASES = [
+    "Hungry? Just say the word",
+    "Voice-activated deliciousness",
+    "Your order is just a hello away",
+    "Speak up for finger-lickin' good!",
+]
+MENU_PAGE_ACTIONS = [
+    "show_beverages", "show_main_dishes", "show_side_dishes", 
+    "add_item_to_cart", "remove_item_from_cart", "modify_item_quantity_in_cart", "update_cart"
+]
 
 
 if ENABLE_WEBVIEW_VERBOSITY:
@@ -33,25 +47,81 @@ def start_webview_server():
         log_level="warning",
         title="KFC Voice Assistant", 
     )
+    if ENABLE_ASSET_SERVER:
+        get_asset_server().start()
+    prerender_home_pages()
     Webview.update_view(display_home_page())
     Webview.start_webview()
     return Webview
 
+def encode_base64_image(data: bytes, mime_type: str = "image/png") -> str:
+    encoded_data = base64.b64encode(data).decode('utf-8')
+    if ENABLE_WEBVIEW_VERBOSITY:
+        print(f"WEBVIEW: Successfully encoded image, encoded data length: {len(encoded_data)}")
+    return f"data:{mime_type};base64,{encoded_data}"
+
 def get_base64_image(image_path: str) -> str:
     image_path = os.path.join(BASE_DIR, image_path)
-    with open(image_path, "rb") as image_file:
-        encoded_data = base64.b64encode(image_file.read()).decode('utf-8')
-        if ENABLE_WEBVIEW_VERBOSITY:
-            print(f"WEBVIEW: Successfully encoded image: {image_path}, encoded data length: {len(encoded_data)}")
-        return f"data:image/png;base64,{encoded_data}"
+    return get_asset_cache().get(image_path, encode_base64_image, kind="base64")
+
+def get_image_url(image_path: str, variant: Optional[str] = None) -> str:
+    asset_server = get_asset_server()
+    if variant and ENABLE_IMAGE_VARIANTS and is_image_variants_available():
+        return get_image_variant_url(image_path, variant)
+    if asset_server.is_running:
+        return asset_server.register_file(os.path.join(BASE_DIR, image_path))
+    return get_base64_image(image_path)
+
+def get_image_variant_url(image_path: str, variant: str) -> str:
+    image_path = os.path.join(BASE_DIR, image_path)
+    asset_server = get_asset_server()
+    if asset_server.is_running:
+        return get_asset_cache().get(
+            image_path,
+            lambda data: asset_server.register_bytes(create_image_variant(data, variant), ".webp", key=("variant", variant, image_path)),
+            kind=("variant_url", variant, asset_server.base_url)
+        )
+    return get_asset_cache().get(
+        image_path,
+        lambda data: encode_base64_image(create_image_variant(data, variant), "image/webp"),
+        kind=("variant_base64", variant)
+    )
+
+def get_stylesheet(name: str, context: Optional[dict] = None) -> dict:
+    rendered_css = get_template_registry().render_static(name, context)
+    asset_server = get_asset_server()
+    if asset_server.is_running:
+        return {"css": "", "css_url": asset_server.register_text(rendered_css, ".css", key=name)}
+    return {"css": rendered_css, "css_url": ""}
+
+def get_patch_script_url() -> str:
+    asset_server = get_asset_server()
+    if not (ENABLE_PATCH_UPDATES and asset_server.is_running):
+        return ""
+    script = get_template_registry().render_static("patch_applier", {"events_url": asset_server.events_url})
+    return asset_server.register_text(script, ".js", key="patch_applier")
+
+render_scheduler = None
+
+def get_render_scheduler() -> RenderScheduler:
+    global render_scheduler
+    if render_scheduler is None:
+        render_scheduler = RenderScheduler(render_view)
+    return render_scheduler
 
 def display(data: StreamData):
+    get_render_scheduler().request(data)
+    return True
+
+def render_view(data: StreamData):
     rendered_html = ""
     if data.action is None:
         rendered_html = display_home_page()
-    elif data.action in ["show_beverages", "show_main_dishes", "show_side_dishes", \
-        "add_item_to_cart", "remove_item_from_cart", "modify_item_quantity_in_cart"]:
-        rendered_html = display_dishes(data)
+    elif data.action in MENU_PAGE_ACTIONS:
+        context = get_dishes_context(data)
+        if get_page_patcher().patch("menu_page", context):
+            return True
+        rendered_html = display_dishes(data, context)
     elif data.action == "get_cart_contents":
         rendered_html = display_order_review(data)
     elif data.action == "confirm_order":
@@ -62,26 +132,40 @@ def display(data: StreamData):
     Webview.update_view(rendered_html)
     return True
 
-def display_home_page() -> str:
-    css_template = Template(HOME_PAGE_STYLE)
-    html_template = Template(HOME_PAGE_TEMPLATE)
-    rendered_css = css_template.render({
-        "background_image": get_base64_image(HOME_BACKGROUND_IMAGE)
+home_pages = {}
+
+def get_asset_mode() -> str:
+    asset_server = get_asset_server()
+    return asset_server.base_url if asset_server.is_running else "inline"
+
+def render_home_page(catch_phrase: str) -> str:
+    stylesheet = get_stylesheet("home_page_style", {
+        "background_image": get_image_url(HOME_BACKGROUND_IMAGE, "background")
     })
-    rendered_html = html_template.render({
-        "css": rendered_css,
-        "catch_phrase": random.choice([
-            "Hungry? Just say the word",
-            "Voice-activated deliciousness",
-            "Your order is just a hello away",
-            "Speak up for finger-lickin' good!",
-        ])
+    return get_template_registry().render("home_page", {
+        **stylesheet,
+        "catch_phrase": catch_phrase
     })
+
+def prerender_home_pages():
+    global home_pages
+    asset_mode = get_asset_mode()
+    home_pages = {
+        (catch_phrase, asset_mode): render_home_page(catch_phrase) for catch_phrase in CATCH_PHRASES
+    }
+    if ENABLE_WEBVIEW_VERBOSITY:
+        print(f"WEBVIEW: Pre-rendered {len(home_pages)} home page variants.")
+
+def display_home_page() -> str:
+    get_page_patcher().invalidate()
+    catch_phrase = random.choice(CATCH_PHRASES)
+    key = (catch_phrase, get_asset_mode())
+    rendered_html = home_pages.get(key)
+    if rendered_html is None:
+        rendered_html = home_pages[key] = render_home_page(catch_phrase)
     return rendered_html
 
-def display_dishes(data: StreamData) -> str:
-    css_template = Template(MENU_PAGE_STYLE)
-    html_template = Template(MENU_PAGE_TEMPLATE)
+def get_dishes_context(data: StreamData) -> dict:
     menu_type_mapping = {
         "show_beverages": "beverages",
         "show_main_dishes": "main_dishes",
@@ -95,27 +179,22 @@ def display_dishes(data: StreamData) -> str:
     category_title = title_mapping.get(data.action, "Menu")
     current_menu_type = menu_type_mapping.get(data.action, "main_dishes")
         
-    # Generate menu items HTML
+    # Menu and cart images are resolved to urls by the template through `image_url`
     current_menu_items: List[Item] = []
-    for m, menu in enumerate(data.menu):
+    for menu in data.menu:
         if menu.menu_type == current_menu_type:
-            for item in menu.items:
-                current_menu_items.append(Item(
-                    name=item.name,
-                    price_per_unit=item.price_per_unit,
-                    image_url_path=get_base64_image(item.image_url_path),
-                ))
+            current_menu_items = menu.items
             break
-            
-    # Generate cart items HTML
-    cart_items = [
-        Order(
-            name=order.name,
-            total_quantity=order.total_quantity,
-            price_per_unit=order.price_per_unit,
-            image_url_path=get_base64_image(order.image_url_path),
-        ) for order in data.cart
-    ]
+    
+    # The category grid only changes with the menu, reuse it across cart updates
+    menu_items_html = ""
+    if ENABLE_FRAGMENT_CACHE and data.menu_version:
+        asset_server = get_asset_server()
+        menu_items_html = get_template_registry().render_fragment(
+            "menu_page", "menu_items", 
+            key=(current_menu_type, data.menu_version, asset_server.is_running and asset_server.base_url),
+            context={"menu_items": current_menu_items, "image_url": get_image_url}
+        )
     
     turn1, turn2, role1, role2 = "", "", "", ""
     if len(data.stream_messages)>1:
@@ -130,61 +209,58 @@ def display_dishes(data: StreamData) -> str:
         turn1 = data.stream_messages[-1].content
         role1 = "AI:" if role1=='assistant' else "You:"
         
-    rendered_css = css_template.render({})
-
-    rendered_html = html_template.render({
+    return {
         "role1": role1,
         "role2": role2,
         "turn1": turn1,
         "turn2": turn2,
-        "css": rendered_css,
-        "cart_items": cart_items,
+        "image_url": get_image_url,
+        "cart_items": data.cart,
         "category": category_title,
         "total_price": data.total_price,
         "menu_items": current_menu_items,
-        "logo_image": get_base64_image(LOGO_IMAGE_PATH),
-        "background_image": get_base64_image(MENU_BACKGROUND_IMAGE)
+        "menu_items_html": menu_items_html,
+        "logo_image": get_image_url(LOGO_IMAGE_PATH),
+        "background_image": get_image_url(MENU_BACKGROUND_IMAGE, "background")
+    }
+
+def display_dishes(data: StreamData, context: Optional[dict] = None) -> str:
+    registry = get_template_registry()
+    context = context or get_dishes_context(data)
+    render_version = get_page_patcher().begin("menu_page", context)
+
+    rendered_html = registry.render("menu_page", {
+        **context,
+        **get_stylesheet("menu_page_style"),
+        "render_version": render_version,
+        "patch_script_url": get_patch_script_url(),
     })
     if ENABLE_WEBVIEW_VERBOSITY:
         print(f"WEBVIEW: `generate_show_menu` rendered successfully.")
-    Webview.update_view(rendered_html)
     return rendered_html
 
 def display_order_review(data: StreamData) -> str:
-    css_template = Template(MENU_PAGE_STYLE)
-    html_template = Template(ORDER_REVIEW_PAGE_TEMPLATE)
-
-    # Generate cart items HTML
-    cart_items = [
-        Order(
-            name=order.name,
-            total_quantity=order.total_quantity,
-            price_per_unit=order.price_per_unit,
-            image_url_path=get_base64_image(order.image_url_path),
-        ) for order in data.cart
-    ]
-        
-    rendered_css = css_template.render({
-        "menu_item_height": MENU_ITEM_HEIGHT,
-        "cart_item_height": CART_ITEM_HEIGHT,
-        "background_image": get_base64_image(MENU_BACKGROUND_IMAGE)
-    })
+    registry = get_template_registry()
+    get_page_patcher().invalidate()
 
-    rendered_html = html_template.render({
-        "css": rendered_css,
-        "cart_items": cart_items,
+    stylesheet = get_stylesheet("menu_page_style")
+
+    rendered_html = registry.render("order_review_page", {
+        **stylesheet,
+        "image_url": get_image_url,
+        "cart_items": data.cart,
         "total_price": data.total_price,
-        "logo_image": get_base64_image(LOGO_IMAGE_PATH)
+        "logo_image": get_image_url(LOGO_IMAGE_PATH)
     })
     if ENABLE_WEBVIEW_VERBOSITY:
         print(f"WEBVIEW: `generate_show_menu` rendered successfully.")
-    Webview.update_view(rendered_html)
     return rendered_html
 
 def display_confirmation(data: StreamData) -> str:
     rendered_html = "<h1>Thank you for confirming the order...</h1>"
-    Webview.update_view(rendered_html)
+    get_page_patcher().invalidate()
     return rendered_html
    
-def display_data_dump(data: StreamData):
-    Webview.update_view(data.model_dump_json()) 
+def display_data_dump(data: StreamData) -> str:
+    get_page_patcher().invalidate()
+    return data.model_dump_json()
@@ -0,0 +1,69 @@
+import os, hashlib
+from io import BytesIO
+from typing import Dict, Tuple
+from config import ENABLE_WEBVIEW_VERBOSITY, IMAGE_VARIANT_FOLDER, IMAGE_VARIANT_QUALITY
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+# Target boxes are 2x the css size the image is displayed at, so they stay sharp on hidpi screens.
+#   name: (width, height, crop) -> `crop` fills the box like `object-cover`, otherwise the image is fit inside it
+IMAGE_VARIANTS: Dict[str, Tuple[int, int, bool]] = {
+    "cart_thumb": (96, 96, True),           # `h-12 w-12` cart sidebar thumbnails
+    "menu_card": (640, 400, True),          # `h-[200px]` menu grid cards
+    "background": (1920, 1080, False),      # full screen `background-size: cover` images
+}
+
+
+def is_image_variants_available() -> bool:
+    return Image is not None
+
+
+def get_variant_path(data: bytes, variant: str) -> str:
+    width, height, _ = IMAGE_VARIANTS[variant]
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    return os.path.join(IMAGE_VARIANT_FOLDER, f"{digest}_{width}x{height}.webp")
+
+
+def create_image_variant(data: bytes, variant: str) -> bytes:
+    """
+    Create (or load from the on-disk cache) a resized, recompressed WebP variant of an image.
+
+    Variants are cached under `IMAGE_VARIANT_FOLDER` keyed by the hash of the
+    source image and the target box, so they are only ever encoded once.
+
+    Args:
+        data (bytes): The source image file contents.
+        variant (str): The name of the target box in `IMAGE_VARIANTS`.
+
+    Returns:
+        bytes: The WebP encoded variant.
+    """
+    path = get_variant_path(data, variant)
+    if os.path.isfile(path):
+        with open(path, "rb") as file:
+            return file.read()
+
+    width, height, crop = IMAGE_VARIANTS[variant]
+    image = Image.open(BytesIO(data))
+    image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    if crop:
+        image = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+    else:
+        image.thumbnail((width, height), Image.Resampling.LANCZOS)
+
+    buffer = BytesIO()
+    image.save(buffer, format="WEBP", quality=IMAGE_VARIANT_QUALITY, method=6)
+    encoded = buffer.getvalue()
+
+    os.makedirs(IMAGE_VARIANT_FOLDER, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(encoded)
+    os.replace(temp_path, path)
+    if ENABLE_WEBVIEW_VERBOSITY:
+        print(f"WEBVIEW: Created `{variant}` image variant {path}, {len(data)} -> {len(encoded)} bytes")
+    return encoded
@@ -0,0 +1,105 @@
+import copy, threading
+from typing import Any, Dict, Tuple
+from .registry import get_template_registry
+from .asset_server import get_asset_server
+from config import ENABLE_WEBVIEW_VERBOSITY, ENABLE_PATCH_UPDATES
+
+
+# Template variables each patchable `{% block %}` of a page depends on
+PAGE_REGIONS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "menu_page": {
+        "category": ("category",),
+        "menu_items": ("menu_items",),
+        "total_price": ("total_price",),
+        "cart_items": ("cart_items",),
+        "transcript": ("role1", "turn1", "role2", "turn2"),
+    }
+}
+
+
+
+class PagePatcher:
+    """
+    Tracks the last fully rendered page and pushes only the regions that changed.
+
+    A full render records the page name and its template context. While the same
+    page stays on screen and the client-side patch applier is connected to the
+    asset route, later updates are diffed variable by variable and only the
+    `{% block %}` regions whose inputs changed are rendered and published.
+
+    Attributes:
+        page (Optional[str]): Name of the page currently on screen, if patchable.
+        version (int): Version stamped on the last full render, patches target it.
+    """
+    def __init__(self) -> None:
+        self.page = None
+        self.version = 0
+        self.patches_sent = 0
+        self.lock = threading.Lock()
+        self.context: Dict[str, Any] = {}
+
+    def begin(self, page: str, context: Dict[str, Any]) -> int:
+        """
+        Record a full render of `page` and return the version to stamp on it.
+
+        Args:
+            page (str): The registered template name being rendered.
+            context (Dict[str, Any]): The context the page is rendered with.
+
+        Returns:
+            int: The render version of this full render.
+        """
+        with self.lock:
+            self.version += 1
+            self.page = page if page in PAGE_REGIONS else None
+            self.context = copy.deepcopy(context)
+            return self.version
+
+    def invalidate(self) -> None:
+        """Forget the page on screen, so the next update is a full render."""
+        with self.lock:
+            self.page = None
+            self.context = {}
+
+    def can_patch(self, page: str) -> bool:
+        return ENABLE_PATCH_UPDATES and self.page == page and get_asset_server().subscriber_count > 0
+
+    def patch(self, page: str, context: Dict[str, Any]) -> bool:
+        """
+        Publish the regions of `page` whose inputs differ from the last update.
+
+        Args:
+            page (str): The registered template name on screen.
+            context (Dict[str, Any]): The context the page would be fully rendered with.
+
+        Returns:
+            bool: True if the page was brought up to date by a patch (or needed none).
+        """
+        with self.lock:
+            if not self.can_patch(page):
+                return False
+            changed = [
+                region for region, variables in PAGE_REGIONS[page].items()
+                if any(self.context.get(variable) != context.get(variable) for variable in variables)
+            ]
+            if not changed:
+                return True
+            registry = get_template_registry()
+            regions = {region: registry.render_block(page, region, context) for region in changed}
+            if not get_asset_server().publish("patch", {"version": self.version, "regions": regions}):
+                return False
+            self.context = copy.deepcopy(context)
+            self.patches_sent += 1
+        if ENABLE_WEBVIEW_VERBOSITY:
+            print(f"WEBVIEW: Patched regions {changed} of `{page}` ({sum(len(html) for html in regions.values())} bytes)")
+        return True
+
+
+
+page_patcher = None
+
+def get_page_patcher() -> PagePatcher:
+    global page_patcher
+    if page_patcher is None:
+        page_patcher = PagePatcher()
+    return page_patcher
@@ -0,0 +1,148 @@
+import os, threading
+from typing import Any, Dict, Hashable, Optional, Tuple
+from .css_build import get_purged_menu_page_style
+from config import TEMPLATE_CACHE_FOLDER, ENABLE_PURGED_STYLESHEET
+from .styles import HOME_PAGE_STYLE
+from .tailwind_menu_page_style import MENU_PAGE_STYLE
+from jinja2 import Environment, DictLoader, FileSystemBytecodeCache, Template
+from .templates import ( HOME_PAGE_TEMPLATE, 
+    MENU_PAGE_TEMPLATE, ORDER_REVIEW_PAGE_TEMPLATE, PATCH_APPLIER_SCRIPT
+)
+
+
+TEMPLATE_SOURCES = {
+    "home_page": HOME_PAGE_TEMPLATE,
+    "menu_page": MENU_PAGE_TEMPLATE,
+    "patch_applier": PATCH_APPLIER_SCRIPT,
+    "home_page_style": HOME_PAGE_STYLE,
+    "menu_page_style": get_purged_menu_page_style() if ENABLE_PURGED_STYLESHEET else MENU_PAGE_STYLE,
+    "order_review_page": ORDER_REVIEW_PAGE_TEMPLATE,
+}
+
+
+
+class TemplateRegistry:
+    """
+    Compiles the web_builder templates once into a shared jinja environment.
+
+    Templates are looked up by name from `TEMPLATE_SOURCES`, compiled on first
+    use (with the compiled bytecode persisted under `TEMPLATE_CACHE_FOLDER` so
+    later processes skip the parse as well) and kept in memory for the life of
+    the process. Stylesheets that only depend on static inputs are rendered
+    once per distinct context and reused verbatim, and blocks that only change
+    with slow-moving inputs (like the menu) are cached as fragments.
+    """
+    def __init__(self, sources: Dict[str, str] = TEMPLATE_SOURCES, cache_folder: str = TEMPLATE_CACHE_FOLDER) -> None:
+        """
+        Initialize the TemplateRegistry.
+
+        Args:
+            sources (Dict[str, str]): Mapping of template names to template source strings.
+            cache_folder (str): Folder where the compiled template bytecode is persisted.
+        """
+        os.makedirs(cache_folder, exist_ok=True)
+        self.environment = Environment(
+            auto_reload=False,
+            loader=DictLoader(sources),
+            bytecode_cache=FileSystemBytecodeCache(cache_folder),
+        )
+        self.lock = threading.Lock()
+        self.static_renders: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], str] = {}
+        self.fragments: Dict[Tuple[str, str, Hashable], str] = {}
+
+    def get(self, name: str) -> Template:
+        """
+        Return the compiled template registered under `name`.
+
+        Args:
+            name (str): The registered template name.
+
+        Returns:
+            Template: The compiled jinja template.
+        """
+        return self.environment.get_template(name)
+
+    def render(self, name: str, context: Dict[str, Any]) -> str:
+        """
+        Render the compiled template registered under `name`.
+
+        Args:
+            name (str): The registered template name.
+            context (Dict[str, Any]): Variables made available to the template.
+
+        Returns:
+            str: The rendered output.
+        """
+        return self.get(name).render(context)
+
+    def render_block(self, name: str, block: str, context: Dict[str, Any]) -> str:
+        """
+        Render a single `{% block %}` of the compiled template registered under `name`.
+
+        Args:
+            name (str): The registered template name.
+            block (str): The block name within the template.
+            context (Dict[str, Any]): Variables made available to the template.
+
+        Returns:
+            str: The rendered block.
+        """
+        template = self.get(name)
+        return "".join(template.blocks[block](template.new_context(context)))
+
+    def render_fragment(self, name: str, block: str, key: Hashable, context: Dict[str, Any]) -> str:
+        """
+        Render a `{% block %}` once per `key`, reusing the cached output afterwards.
+
+        Args:
+            name (str): The registered template name.
+            block (str): The block name within the template.
+            key (Hashable): Identifies every input the block output depends on.
+            context (Dict[str, Any]): Variables made available to the template on a miss.
+
+        Returns:
+            str: The rendered block.
+        """
+        cache_key = (name, block, key)
+        rendered = self.fragments.get(cache_key)
+        if rendered is None:
+            rendered = self.render_block(name, block, context)
+            with self.lock:
+                self.fragments[cache_key] = rendered
+        return rendered
+
+    def render_static(self, name: str, context: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Render a template whose output only depends on `context`, reusing earlier output.
+
+        Args:
+            name (str): The registered template name.
+            context (Optional[Dict[str, Any]]): Hashable variables made available to the template.
+
+        Returns:
+            str: The rendered output, rendered at most once per distinct context.
+        """
+        context = context or {}
+        key = (name, tuple(sorted(context.items())))
+        rendered = self.static_renders.get(key)
+        if rendered is None:
+            rendered = self.render(name, context)
+            with self.lock:
+                self.static_renders[key] = rendered
+        return rendered
+
+    def precompile(self) -> None:
+        """Compile every registered template up front."""
+        for name in self.environment.list_templates():
+            self.get(name)
+
+
+
+template_registry = None
+
+def get_template_registry() -> TemplateRegistry:
+    global template_registry
+    if template_registry is None:
+        template_registry = TemplateRegistry()
+        template_registry.precompile()
+    return template_registry
@@ -0,0 +1,187 @@
+import time, hashlib, threading
+from typing import Callable, Dict, Optional
+from assistant.utils import StreamData
+from config import ENABLE_WEBVIEW_VERBOSITY, RENDER_FRAME_WINDOW, RENDER_IN_BACKGROUND
+
+
+
+class Mailbox:
+    """
+    Single-slot, latest-value-wins handoff between threads.
+
+    `put` never blocks and overwrites any value that has not been taken yet,
+    so a slow consumer only ever sees the most recent state.
+    """
+    def __init__(self) -> None:
+        self.value = None
+        self.has_value = False
+        self.condition = threading.Condition()
+
+    def put(self, value) -> bool:
+        """
+        Store `value`, replacing any value not yet taken.
+
+        Returns:
+            bool: True if an untaken value was overwritten.
+        """
+        with self.condition:
+            overwritten = self.has_value
+            self.value, self.has_value = value, True
+            self.condition.notify()
+            return overwritten
+
+    def take(self, timeout: Optional[float] = None):
+        """
+        Wait for a value and remove it from the mailbox.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait, forever if None.
+
+        Returns:
+            The stored value, or None if the wait timed out.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.has_value, timeout):
+                return None
+            value, self.value, self.has_value = self.value, None, False
+            return value
+
+
+
+class RenderScheduler:
+    """
+    Renders view state on a dedicated worker thread, coalescing bursts of requests.
+
+    `request` only snapshots the state into a latest-state-wins mailbox and
+    returns, so callers such as the cart tools never wait on image encoding or
+    template rendering. The worker waits `frame_window` seconds after the first
+    request of a burst to let further requests replace it, then renders the
+    latest snapshot only if its fingerprint differs from the last one pushed.
+
+    Attributes:
+        frame_window (float): Seconds to wait for further requests before rendering.
+        background (bool): Render on the worker thread, otherwise inline on `request`.
+        requested (int): Number of display requests received.
+        emitted (int): Number of renders actually pushed to the webview.
+        skipped (int): Number of renders dropped because the state was unchanged.
+    """
+    def __init__(
+        self,
+        render: Callable[[StreamData], bool],
+        frame_window: float = RENDER_FRAME_WINDOW,
+        background: bool = RENDER_IN_BACKGROUND
+    ) -> None:
+        """
+        Initialize the RenderScheduler and start its worker thread.
+
+        Args:
+            render (Callable[[StreamData], bool]): Renders a snapshot and pushes it to the webview.
+            frame_window (float): Seconds to wait for further requests before rendering.
+            background (bool): Render on the worker thread, otherwise inline on `request`.
+        """
+        self.render = render
+        self.background = background
+        self.frame_window = frame_window
+        self.mailbox = Mailbox()
+        self.last_sequence = 0
+        self.last_fingerprint = None
+        self.lock = threading.Lock()
+        self.render_lock = threading.Lock()
+        self.requested = 0
+        self.emitted = 0
+        self.skipped = 0
+        self.render_time = 0.0
+        self.stopped = threading.Event()
+        if self.background:
+            self.worker_thread = threading.Thread(target=self.__render_worker__, daemon=True)
+            self.worker_thread.start()
+
+    @staticmethod
+    def fingerprint(data: StreamData) -> str:
+        return hashlib.sha1(data.model_dump_json().encode("utf-8")).hexdigest()
+
+    def __render_worker__(self):
+        while not self.stopped.is_set():
+            entry = self.mailbox.take()
+            if self.frame_window and entry is not None:
+                time.sleep(self.frame_window)
+                entry = self.mailbox.take(timeout=0) or entry
+            if entry is None:
+                continue
+            try:
+                self.__render__(*entry)
+            except Exception as e:
+                print(f"WEBVIEW: Exception in render worker: {e}")
+
+    def __render__(self, sequence: int, data: StreamData) -> bool:
+        with self.render_lock:
+            # A newer snapshot may already have been rendered through `flush`
+            if sequence <= self.last_sequence:
+                return False
+            self.last_sequence = sequence
+            fingerprint = self.fingerprint(data)
+            if fingerprint == self.last_fingerprint:
+                self.skipped += 1
+                return False
+            start_time = time.perf_counter()
+            self.render(data)
+            self.render_time += time.perf_counter() - start_time
+            self.last_fingerprint = fingerprint
+            self.emitted += 1
+        if ENABLE_WEBVIEW_VERBOSITY:
+            print(f"WEBVIEW: Render pushed for `{data.action}` ({self.emitted} pushed / {self.requested} requested)")
+        return True
+
+    def request(self, data: StreamData) -> None:
+        """
+        Schedule `data` to be displayed, returning without rendering in background mode.
+
+        Args:
+            data (StreamData): The view state to display, snapshotted on call.
+        """
+        snapshot = data.model_copy(deep=True)
+        with self.lock:
+            self.requested += 1
+            sequence = self.requested
+        if self.background:
+            self.mailbox.put((sequence, snapshot))
+        else:
+            self.__render__(sequence, snapshot)
+
+    def flush(self) -> bool:
+        """
+        Render the pending snapshot on the calling thread, if there is one.
+
+        Returns:
+            bool: True if a render was pushed.
+        """
+        entry = self.mailbox.take(timeout=0)
+        if entry is None:
+            return False
+        return self.__render__(*entry)
+
+    def stop(self) -> None:
+        """Render the pending snapshot and stop the worker thread, later requests are only rendered through `flush`."""
+        if not self.background or self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.flush()
+        # Wakes the worker if it is waiting for a request
+        self.mailbox.put(None)
+        self.worker_thread.join()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return the render counters.
+
+        Returns:
+            Dict[str, float]: Renders requested, emitted and skipped as unchanged, and
+                the mean time spent rendering a push in milliseconds.
+        """
+        with self.lock:
+            return {
+                "requested": self.requested,
+                "emitted": self.emitted,
+                "skipped": self.skipped,
+                "mean_render_ms": (self.render_time / self.emitted * 1000) if self.emitted else 0.0,
+            }
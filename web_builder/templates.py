@@ -1,7 +1,11 @@
 HOME_PAGE_TEMPLATE = """
+    {% if css_url %}
+    <link rel="stylesheet" href="{{ css_url }}">
+    {% else %}
     <style>
         {{ css }}
     </style>
+    {% endif %}
     <div class="background">
         <div class="container">
             <h1 class="title">KFC Voice Assistant</h1>
@@ -11,20 +15,32 @@ HOME_PAGE_TEMPLATE = """
 """
 
 MENU_PAGE_TEMPLATE = """
+{% if css_url %}
+<link rel="stylesheet" href="{{ css_url }}">
+{% else %}
 <style>
     {{ css }}
 </style>
-<div class="bg-gray-20 grid min-h-screen grid-cols-4 bg-gradient-to-br from-red-700 to-red-700">
+{% endif %}
+{% if patch_script_url %}
+<!-- Loads the patch applier, also when this markup is injected through innerHTML where script tags do not run -->
+<img hidden src="data:," alt="" onerror="if(!window.kfcPatchApplier){var s=document.createElement('script');s.src='{{ patch_script_url }}';document.head.appendChild(s);}" />
+{% endif %}
+<div class="bg-gray-20 grid min-h-screen grid-cols-4 bg-gradient-to-br from-red-700 to-red-700" data-render-version="{{ render_version }}">
     <div class="container col-span-3 mx-auto">
         <!-- Banner ad -->
         <!-- img class="w-full object-cover object-top" src="https://static-prod.adweek.com/wp-content/uploads/2024/06/kfcooh1-1024x538.png" alt="" /-->
         <!-- Banner ad end -->
-        <h2 class="px-3 pt-4 text-2xl font-bold text-white">{{ category }}</h2>
-        <div class="grid grid-cols-1 gap-2 p-2 md:grid-cols-2 lg:grid-cols-3">
+        <h2 class="px-3 pt-4 text-2xl font-bold text-white" data-region="category">{% block category %}{{ category }}{% endblock %}</h2>
+        <div class="grid grid-cols-1 gap-2 p-2 md:grid-cols-2 lg:grid-cols-3" data-region="menu_items">
+            {% block menu_items %}
+            {% if menu_items_html %}
+            {{ menu_items_html }}
+            {% else %}
             <!-- A menu item -->
             {% for item in menu_items %}
             <div class="rounded-md border bg-white p-0.5 shadow-md">
-                <img class="h-[200px] w-full rounded-sm object-cover" src="{{ item.image_url_path }}" alt="{{ item.name }}"/>
+                <img class="h-[200px] w-full rounded-sm object-cover" src="{{ image_url(item.image_url_path, 'menu_card') }}" alt="{{ item.name }}"/>
                 <div class="px-2 py-2">
                     <h2 class="text-lg font-semibold">{{ item.name }}</h2>
                     <h2 class="text-lg text-gray-600">${{ item.price_per_unit }}</h2>
@@ -32,17 +48,20 @@ MENU_PAGE_TEMPLATE = """
             </div>
             {% endfor %}
             <!-- Menu item end -->
+            {% endif %}
+            {% endblock %}
         </div>
     </div>
     <div class="sticky top-0 col-span-1 flex h-screen flex-col justify-between bg-gradient-to-t from-zinc-950 to-zinc-950/70 px-3 py-4">
         <div>
             <p class="text-2xl text-white">Your cart</p>
-            <p class="mt-1 text-xl text-white/60">Total price ${{ total_price }}</p>
-        <div class="cart-items mt-3 grid grid-cols-1 gap-2">
+            <p class="mt-1 text-xl text-white/60" data-region="total_price">{% block total_price %}Total price ${{ total_price }}{% endblock %}</p>
+        <div class="cart-items mt-3 grid grid-cols-1 gap-2" data-region="cart_items">
+        {% block cart_items %}
         <!-- A cart item -->
         {% for order in cart_items %}
         <div class="flex items-center gap-3 rounded-md bg-white/20 p-1">
-            <img class="h-12 w-12 rounded-md object-cover" src="{{ order.image_url_path }}" alt="{{ order.name }}" />
+            <img class="h-12 w-12 rounded-md object-cover" src="{{ image_url(order.image_url_path, 'cart_thumb') }}" alt="{{ order.name }}" />
             <div>
                 <p class="font-semibold text-white">{{ order.name }}</p>
                 <p class="text-xs text-white/40">x{{ order.total_quantity }} · ${{ order.price_per_unit}}</p>
@@ -50,6 +69,7 @@ MENU_PAGE_TEMPLATE = """
         </div>
         {% endfor %}
         <!-- Cart item end -->
+        {% endblock %}
       </div>
     </div>
     
@@ -59,11 +79,13 @@ MENU_PAGE_TEMPLATE = """
         <div class="p-2">
             <!-- Transcript start -->
             <div class="flex flex-col gap-2">
-                <p class="inline-block bg-gradient-to-b from-white/30 to-white bg-clip-text text-base text-transparent">
+                <p class="inline-block bg-gradient-to-b from-white/30 to-white bg-clip-text text-base text-transparent" data-region="transcript">
+                    {% block transcript %}
                     {{ role1 }} {{ turn1 }}
                     <br />
                     <br />
                     {{ role2 }} {{ turn2 }}
+                    {% endblock %}
                 </p>
             </div>
             <!-- Transcript end -->
@@ -75,9 +97,13 @@ MENU_PAGE_TEMPLATE = """
 """
 
 ORDER_REVIEW_PAGE_TEMPLATE = """
+    {% if css_url %}
+    <link rel="stylesheet" href="{{ css_url }}">
+    {% else %}
     <style>
         {{ css }}
     </style>
+    {% endif %}
     <div class="background"></div>
     <div class="menu">
         <img src="{{ logo_image }}" alt="KFC Logo" class="logo">
@@ -85,7 +111,7 @@ ORDER_REVIEW_PAGE_TEMPLATE = """
         <div class="menu-grid">
             {% for item in cart_items %}
             <div class="item">
-                <img src="{{ item.image_url_path }}" alt="{{ item.name }}">
+                <img src="{{ image_url(item.image_url_path, 'menu_card') }}" alt="{{ item.name }}">
                 <div class="item-name">{{ item.name }}</div>
                 <div class="item-price">Quantity: {{ item.total_quantity }} | Total price of Item {{ item.price_per_unit * item.total_quantity }}</div>
             </div>
@@ -98,6 +124,40 @@ ORDER_REVIEW_PAGE_TEMPLATE = """
 CONFIRMATION_PAGE_TEMPLATE = """
 """
 
+PATCH_APPLIER_SCRIPT = """
+(function () {
+    if (window.kfcPatchApplier) return;
+    window.kfcPatchApplier = true;
+    var pending = [];
+
+    function currentVersion() {
+        var root = document.querySelector("[data-render-version]");
+        return root ? parseInt(root.getAttribute("data-render-version"), 10) : -1;
+    }
+
+    function flush() {
+        var version = currentVersion();
+        pending = pending.filter(function (patch) {
+            if (patch.version < version) return false;
+            if (patch.version > version) return true;
+            for (var region in patch.regions) {
+                var node = document.querySelector('[data-region="' + region + '"]');
+                if (node) node.innerHTML = patch.regions[region];
+            }
+            return false;
+        });
+    }
+
+    var events = new EventSource("{{ events_url }}");
+    events.addEventListener("patch", function (event) {
+        pending.push(JSON.parse(event.data));
+        flush();
+    });
+    // Patches can overtake the full render they apply to, keep them until it lands
+    new MutationObserver(flush).observe(document.body, { childList: true, subtree: true });
+})();
+"""
+
 
 
 